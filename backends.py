@@ -0,0 +1,351 @@
+"""
+The cleaning steps and aggregations, written once for several engines.
+
+Every analysis below is expressed with a handful of table operations (drop
+duplicates, fill missing values, filter, inner join, count and sum per key).
+Each backend implements those operations on its own engine:
+
+    pandas    the reference, same results as instacart_analysis.py
+    polars    multi-threaded DataFrame engine
+    duckdb    embedded, multi-threaded SQL engine (in-process, no server)
+
+Per-key results come back as small pandas Series sorted by key, so the
+reports downstream stay the same whatever engine did the heavy lifting.
+polars and duckdb are optional; they are only imported when their backend is
+used.
+
+    python backends.py --data-dir /datasets --backend duckdb
+    python backends.py --data-dir /datasets --check     # parity across all installed engines
+"""
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from cleaning import MISSING_CART_POSITION
+
+RESULTS = (
+    'orders',
+    'products',
+    'order_products',
+    'hourly_counts',
+    'dow_counts',
+    'days_since_prior_counts',
+    'orders_per_user',
+    'items_per_order',
+    'product_metrics',
+    'user_reorder_rate',
+)
+
+
+def _series(keys, values, key, name):
+    # Per-key results in one shape for every engine: int64 or float64 keys and values, sorted by key
+    keys = np.asarray(keys)
+    keys = keys.astype(np.float64) if keys.dtype.kind == 'f' else keys.astype(np.int64)
+    values = np.asarray(values)
+    values = values.astype(np.float64) if values.dtype.kind == 'f' else values.astype(np.int64)
+    return pd.Series(values, index=pd.Index(keys, name=key), name=name)
+
+
+class PandasBackend:
+    """The operations on pandas DataFrames."""
+
+    name = 'pandas'
+
+    def table(self, df):
+        return df.reset_index(drop=True)
+
+    def to_pandas(self, table):
+        return table.reset_index(drop=True)
+
+    def drop_duplicates(self, table, subset=None):
+        """Drop rows equal to an earlier row on `subset` (all columns by default), keeping the first."""
+        return table[~table.duplicated(subset)]
+
+    def drop_case_duplicates(self, table, column):
+        """Drop rows whose `column` equals an earlier row's when case is ignored."""
+        return table[~table[column].str.lower().duplicated()]
+
+    def fill_null(self, table, column, value):
+        return table.assign(**{column: table[column].fillna(value)})
+
+    def filter_equal(self, table, column, value):
+        return table[table[column] == value]
+
+    def join(self, left, right, on):
+        """Inner join on the column `on`."""
+        return left.merge(right, on=on)
+
+    def count_by(self, table, key):
+        """Rows per value of `key`, leaving out missing keys."""
+        counts = table.groupby(key).size()
+        return _series(counts.index, counts, key, 'count')
+
+    def sum_by(self, table, key, column):
+        sums = table.groupby(key)[column].sum()
+        return _series(sums.index, sums, key, column)
+
+
+class PolarsBackend:
+    """The operations on Polars DataFrames."""
+
+    name = 'polars'
+
+    def __init__(self):
+        import polars
+        self.pl = polars
+
+    def table(self, df):
+        return self.pl.from_pandas(df)
+
+    def to_pandas(self, table):
+        return table.to_pandas()
+
+    def drop_duplicates(self, table, subset=None):
+        return table.unique(subset=subset, keep='first', maintain_order=True)
+
+    def drop_case_duplicates(self, table, column):
+        return table.filter(self.pl.col(column).str.to_lowercase().is_first_distinct())
+
+    def fill_null(self, table, column, value):
+        return table.with_columns(self.pl.col(column).fill_null(value))
+
+    def filter_equal(self, table, column, value):
+        return table.filter(self.pl.col(column) == value)
+
+    def join(self, left, right, on):
+        return left.join(right, on=on, how='inner')
+
+    def count_by(self, table, key):
+        counts = table.drop_nulls(key).group_by(key).len().sort(key)
+        return _series(counts[key].to_numpy(), counts['len'].to_numpy(), key, 'count')
+
+    def sum_by(self, table, key, column):
+        sums = table.drop_nulls(key).group_by(key).agg(self.pl.col(column).sum()).sort(key)
+        return _series(sums[key].to_numpy(), sums[column].to_numpy(), key, column)
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + value.replace("'", "''") + "'" if isinstance(value, str) else repr(value)
+
+
+class DuckDBBackend:
+    """
+    The operations as SQL on an in-process DuckDB connection.
+
+    SQL tables have no row order, so every table carries a _row column with
+    the original row position; "keep the first duplicate" and the final
+    conversion back to pandas are ordered by it.
+    """
+
+    name = 'duckdb'
+
+    def __init__(self):
+        import duckdb
+        self.connection = duckdb.connect()
+        self._names = itertools.count()
+
+    def _query(self, table, sql):
+        # Every step needs its own view name, chained queries on the same name recurse
+        name = f't{next(self._names)}'
+        return table.query(name, sql.format(t=name))
+
+    def table(self, df):
+        return self.connection.from_df(df.assign(_row=np.arange(len(df))))
+
+    def _columns(self, table):
+        return [column for column in table.columns if column != '_row']
+
+    def to_pandas(self, table):
+        return table.order('_row').df().drop(columns='_row')
+
+    def _keep_first(self, table, partition):
+        return self._query(table, f'SELECT * EXCLUDE (_first) FROM ('
+                                  f'SELECT *, row_number() OVER (PARTITION BY {partition} ORDER BY _row) AS _first '
+                                  f'FROM {{t}}) WHERE _first = 1')
+
+    def drop_duplicates(self, table, subset=None):
+        columns = subset if subset is not None else self._columns(table)
+        return self._keep_first(table, ', '.join(_quote(column) for column in columns))
+
+    def drop_case_duplicates(self, table, column):
+        return self._keep_first(table, f'lower({_quote(column)})')
+
+    def fill_null(self, table, column, value):
+        return self._query(table, f'SELECT * REPLACE (coalesce({_quote(column)}, {_literal(value)}) '
+                                  f'AS {_quote(column)}) FROM {{t}}')
+
+    def filter_equal(self, table, column, value):
+        return table.filter(f'{_quote(column)} = {_literal(value)}')
+
+    def join(self, left, right, on):
+        # The left table's row order is the one kept
+        return left.join(right.project(', '.join(_quote(c) for c in self._columns(right))), on)
+
+    def count_by(self, table, key):
+        counts = self._query(table, f'SELECT {_quote(key)} AS key, count(*) AS n FROM {{t}} '
+                                    f'WHERE {_quote(key)} IS NOT NULL GROUP BY 1 ORDER BY 1').df()
+        return _series(counts['key'], counts['n'], key, 'count')
+
+    def sum_by(self, table, key, column):
+        # sum() of integers is a 128-bit integer in DuckDB, which pandas would turn into floats
+        sums = self._query(table, f'SELECT {_quote(key)} AS key, sum({_quote(column)})::BIGINT AS total FROM {{t}} '
+                                  f'WHERE {_quote(key)} IS NOT NULL GROUP BY 1 ORDER BY 1').df()
+        return _series(sums['key'], sums['total'], key, column)
+
+
+BACKENDS = {
+    'pandas': PandasBackend,
+    'polars': PolarsBackend,
+    'duckdb': DuckDBBackend,
+}
+
+
+def get_backend(name):
+    """Create the backend called `name`; raises ImportError if its engine is not installed."""
+    if name not in BACKENDS:
+        raise KeyError(f'Unknown backend {name!r}, expected one of {sorted(BACKENDS)}')
+    return BACKENDS[name]()
+
+
+def clean_orders(backend, orders):
+    """Drop fully duplicated order rows."""
+    return backend.drop_duplicates(orders)
+
+
+def clean_products(backend, products):
+    """Fill missing product names with 'Unknown' and drop case-insensitive duplicate names."""
+    return backend.drop_case_duplicates(backend.fill_null(products, 'product_name', 'Unknown'), 'product_name')
+
+
+def clean_order_products(backend, order_products):
+    """Replace missing add_to_cart_order values with 999."""
+    return backend.fill_null(order_products, 'add_to_cart_order', MISSING_CART_POSITION)
+
+
+def product_metrics(backend, order_products, product_ids):
+    """
+    Order, reorder and first-in-cart counts and reorder rate per product.
+
+    Only products in `product_ids` are kept, like an inner merge with products.
+    """
+    order_count = backend.count_by(order_products, 'product_id')
+    reorder_count = backend.sum_by(order_products, 'product_id', 'reordered')
+    first = backend.count_by(backend.filter_equal(order_products, 'add_to_cart_order', 1), 'product_id')
+
+    metrics = pd.DataFrame({
+        'order_count': order_count,
+        'reorder_count': reorder_count,
+        'first_in_cart_count': first.reindex(order_count.index, fill_value=0),
+    })
+    metrics = metrics[metrics.index.isin(product_ids)]
+    metrics['reorder_rate'] = metrics['reorder_count'] / metrics['order_count']
+    return metrics
+
+
+def run_analyses(backend, orders, products, order_products):
+    """
+    Clean the raw tables and compute every aggregation on `backend`.
+
+    Takes raw pandas tables and returns a dict of pandas results keyed by the
+    names in RESULTS; the cleaned tables are included, converted back to pandas.
+    """
+    orders = clean_orders(backend, backend.table(orders))
+    products = clean_products(backend, backend.table(products))
+    order_products = clean_order_products(backend, backend.table(order_products))
+    cleaned_products = backend.to_pandas(products)
+
+    items = backend.join(order_products, orders, 'order_id')
+    return {
+        'orders': backend.to_pandas(orders),
+        'products': cleaned_products,
+        'order_products': backend.to_pandas(order_products),
+        'hourly_counts': backend.count_by(orders, 'order_hour_of_day'),
+        'dow_counts': backend.count_by(orders, 'order_dow'),
+        'days_since_prior_counts': backend.count_by(orders, 'days_since_prior_order'),
+        'orders_per_user': backend.count_by(orders, 'user_id'),
+        'items_per_order': backend.count_by(order_products, 'order_id'),
+        'product_metrics': product_metrics(backend, order_products, cleaned_products['product_id']),
+        'user_reorder_rate': (backend.sum_by(items, 'user_id', 'reordered')
+                              / backend.count_by(items, 'user_id')).rename('reordered'),
+    }
+
+
+def _comparable(df):
+    # Cleaned tables as plain numpy columns (engines disagree on nullable and string dtypes)
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if values.dtype.kind in 'iufb' or pd.api.types.is_numeric_dtype(values.dtype):
+            columns[column] = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            columns[column] = values.astype(object).where(values.notna(), None).to_numpy()
+    return pd.DataFrame(columns)
+
+
+def check_parity(results, expected):
+    """
+    Raise AssertionError if any result of one backend differs from another's.
+
+    Counts and cleaned tables must match exactly; rates are divisions of the
+    same integer sums, so they are compared exactly too.
+    """
+    for name in RESULTS:
+        left, right = results[name], expected[name]
+        if name in ('orders', 'products', 'order_products'):
+            pd.testing.assert_frame_equal(_comparable(left), _comparable(right), check_exact=True, obj=name)
+        elif isinstance(left, pd.DataFrame):
+            pd.testing.assert_frame_equal(left, right, check_exact=True, obj=name)
+        else:
+            pd.testing.assert_series_equal(left, right, check_exact=True, obj=name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the cleaning and aggregations on a chosen engine.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='pandas')
+    parser.add_argument('--check', action='store_true',
+                        help='run every installed backend and check that their results match pandas')
+    args = parser.parse_args()
+
+    tables = {table: data_loader.load_table(table, data_dir=args.data_dir)
+              for table in ('orders', 'products', 'order_products')}
+
+    if not args.check:
+        start = time.perf_counter()
+        results = run_analyses(get_backend(args.backend), tables['orders'], tables['products'],
+                               tables['order_products'])
+        for name in RESULTS[3:]:
+            print(f'{name}:')
+            print(results[name])
+            print()
+        print(f'{args.backend}: {time.perf_counter() - start:.2f}s')
+        return
+
+    expected = None
+    for name in BACKENDS:
+        try:
+            backend = get_backend(name)
+        except ImportError:
+            print(f'{name}: not installed, skipped')
+            continue
+        start = time.perf_counter()
+        results = run_analyses(backend, tables['orders'], tables['products'], tables['order_products'])
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = results
+        else:
+            check_parity(results, expected)
+        print(f'{name}: {elapsed:.2f}s, results match pandas')
+
+
+if __name__ == '__main__':
+    main()
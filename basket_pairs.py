@@ -0,0 +1,162 @@
+"""
+Product co-purchase (market basket) analysis with sparse matrices.
+
+order_products is turned into a sparse order x product incidence matrix X
+(1 when the product is in the order). Pair counts are X.T @ X: entry (i, j) is
+the number of orders that contain both products. Instead of building the whole
+product x product matrix at once, it is computed a block of product columns at
+a time, with the block size picked so that each block's result fits in the
+memory budget. Only the top k partners of every product are kept from each
+block.
+
+    python basket_pairs.py --data-dir /datasets --k 10 --min-support 100 --memory-mb 1024
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import data_loader
+from cleaning import clean_order_products, clean_products
+from product_metrics import attach_product_names
+
+# Rough cost of one stored entry of a sparse product: int32 index + int64 value,
+# plus the temporary copies scipy makes while multiplying and converting
+BYTES_PER_ENTRY = 48
+
+METRICS = ('pair_count', 'confidence', 'lift')
+
+
+def incidence_matrix(order_products, min_support=1):
+    """
+    Build the order x product incidence matrix.
+
+    Products bought in fewer than `min_support` orders are dropped (support
+    pruning). Returns (matrix, product_ids, product_support, n_orders), where
+    product_ids holds the product_id of every matrix column.
+    """
+    order_codes, order_ids = pd.factorize(order_products['order_id'])
+    product_codes, product_ids = pd.factorize(order_products['product_id'], sort=True)
+    n_orders = len(order_ids)
+
+    matrix = sp.csr_matrix(
+        (np.ones(len(order_codes), dtype=np.int32), (order_codes, product_codes)),
+        shape=(n_orders, len(product_ids)),
+    )
+    # A product listed twice in one order still counts once
+    matrix.data[:] = 1
+
+    support = np.asarray(matrix.sum(axis=0)).ravel()
+    keep = np.flatnonzero(support >= min_support)
+    return matrix[:, keep].tocsc(), np.asarray(product_ids)[keep], support[keep], n_orders
+
+
+def column_blocks(matrix, memory_budget):
+    """
+    Split the product columns into blocks whose pair-count result fits in `memory_budget` bytes.
+
+    The number of nonzeros in column j of X.T @ X is at most the total size of
+    the baskets that contain product j, which gives the cost of every column.
+    """
+    basket_sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    column_cost = (matrix.T @ basket_sizes) * BYTES_PER_ENTRY
+    blocks = []
+    start, used = 0, 0
+    for column, cost in enumerate(column_cost):
+        if column > start and used + cost > memory_budget:
+            blocks.append((start, column))
+            start, used = column, 0
+        used += cost
+    if start < matrix.shape[1]:
+        blocks.append((start, matrix.shape[1]))
+    return blocks
+
+
+def _top_partners(block_counts, first_column, support, n_orders, k, metric, min_pair_count):
+    # Keep the k best partners of every product in one block of pair counts
+    coo = block_counts.tocoo()
+    partner, product = coo.row, coo.col + first_column
+    counts = coo.data.astype(np.int64)
+    keep = (partner != product) & (counts >= min_pair_count)
+    partner, product, counts = partner[keep], product[keep], counts[keep]
+
+    pairs = pd.DataFrame({
+        'product': product,
+        'partner': partner,
+        'pair_count': counts,
+        'confidence': counts / support[product],
+        'lift': counts * n_orders / (support[product].astype(np.float64) * support[partner]),
+    })
+    # Best partner first, ties go to the lower partner id; then number the rows within each product
+    pairs = pairs.iloc[np.lexsort((pairs['partner'], -pairs[metric].to_numpy(), pairs['product']))]
+    starts = np.searchsorted(pairs['product'].to_numpy(), pairs['product'].to_numpy())
+    rank = np.arange(len(pairs)) - starts
+    return pairs[rank < k].assign(rank=rank[rank < k] + 1)
+
+
+def co_purchases(order_products, k=10, min_support=1, min_pair_count=1, metric='pair_count',
+                 memory_budget=512 * 2**20):
+    """
+    Top k co-purchased products for every product.
+
+    Returns one row per (product_id, other_product_id) pair with the number of
+    orders containing both, the confidence (share of product_id's orders that
+    also contain the other product) and the lift (how much more often they are
+    bought together than if they were independent). Rows are ranked by `metric`.
+    """
+    if metric not in METRICS:
+        raise ValueError(f'Unknown metric {metric!r}, expected one of {METRICS}')
+    matrix, product_ids, support, n_orders = incidence_matrix(order_products, min_support)
+    transposed = matrix.T.tocsr()
+
+    results = []
+    for start, stop in column_blocks(matrix, memory_budget):
+        block_counts = transposed @ matrix[:, start:stop]
+        results.append(_top_partners(block_counts, start, support, n_orders, k, metric, min_pair_count))
+
+    pairs = pd.concat(results, ignore_index=True) if results else pd.DataFrame(
+        columns=['product', 'partner', 'pair_count', 'confidence', 'lift', 'rank'])
+    return pd.DataFrame({
+        'product_id': product_ids[pairs['product'].to_numpy(dtype=np.int64)],
+        'other_product_id': product_ids[pairs['partner'].to_numpy(dtype=np.int64)],
+        'rank': pairs['rank'].to_numpy(dtype=np.int64),
+        'pair_count': pairs['pair_count'].to_numpy(dtype=np.int64),
+        'confidence': pairs['confidence'].to_numpy(dtype=np.float64),
+        'lift': pairs['lift'].to_numpy(dtype=np.float64),
+    })
+
+
+def name_pairs(pairs, products):
+    """Add product_name and other_product_name columns to a co_purchases() result."""
+    named = attach_product_names(pairs.set_index('product_id'), products)
+    other = attach_product_names(pairs[['other_product_id']].set_index('other_product_id').rename_axis('product_id'),
+                                 products)
+    named.insert(3, 'other_product_name', other['product_name'].to_numpy())
+    return named
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the products most often bought together.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--k', type=int, default=10, help='partners to keep per product')
+    parser.add_argument('--min-support', type=int, default=100, help='minimum number of orders per product')
+    parser.add_argument('--min-pair-count', type=int, default=1)
+    parser.add_argument('--metric', choices=METRICS, default='pair_count')
+    parser.add_argument('--memory-mb', type=int, default=512, help='memory budget for one block of pair counts')
+    parser.add_argument('--output', help='write the pairs to this Parquet file')
+    args = parser.parse_args()
+
+    order_products = clean_order_products(data_loader.load_table('order_products', data_dir=args.data_dir))
+    products = clean_products(data_loader.load_table('products', data_dir=args.data_dir))
+    pairs = co_purchases(order_products, k=args.k, min_support=args.min_support,
+                         min_pair_count=args.min_pair_count, metric=args.metric,
+                         memory_budget=args.memory_mb * 2**20)
+    if args.output:
+        pairs.to_parquet(args.output, index=False)
+    print(name_pairs(pairs, products))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+Scaling benchmark for the analysis stages.
+
+Times every pipeline node (loading each table, cleaning it, the duplicate
+checks, the aggregates and each report) and the drawing of the figures on a
+data directory, with nothing read from the pipeline store, records
+the process's peak RSS after each one (and how much RSS and Arrow memory it
+added) and writes the results to JSON. Passing
+an earlier result as --baseline compares the two and exits with status 1 when
+any stage got slower or bigger than the tolerance allows.
+
+    python synthetic_data.py --rows 1000000 --out-dir /tmp/synthetic-1m
+    python benchmark.py --data-dir /tmp/synthetic-1m --output baseline-1m.json
+    python benchmark.py --data-dir /tmp/synthetic-1m --baseline baseline-1m.json
+
+--generate ROWS writes the synthetic data first if the directory has none.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+
+import pandas as pd
+
+import data_loader
+import synthetic_data
+from charts import chart_data, render_all
+from pipeline import NODES, REPORTS, SOURCES, Pipeline
+from profiling import StageProfiler, peak_rss_mb
+
+
+def run(data_dir, stages=REPORTS):
+    """
+    Evaluate the `stages` nodes (and what they need) on `data_dir` and return the results as a dict.
+
+    The raw_* stages always start from an empty Parquet cache, so they measure
+    CSV parsing; load_cached then measures reading all tables back from the cache.
+    """
+    # No tracemalloc, it would slow the stages down
+    profiler = StageProfiler(trace_memory=False)
+    with tempfile.TemporaryDirectory(prefix='instacart-benchmark-') as cache_dir:
+        pipeline = Pipeline(data_dir, cache_dir, persist=False, profiler=profiler)
+        pipeline.evaluate(list(SOURCES) + list(stages))
+        render_all(chart_data(pipeline), os.path.join(cache_dir, 'charts'), profiler=profiler)
+        with profiler.stage('load_cached'):
+            data_loader.load_all(data_dir, cache_dir)
+        rows = {SOURCES[name]: len(pipeline.values[name]) for name in SOURCES}
+
+    results = {
+        record.name: {'seconds': record.wall_seconds, 'peak_rss_mb': record.peak_rss_mb,
+                      'rss_delta_mb': record.rss_delta_mb, 'arrow_allocated_mb': record.arrow_allocated_mb}
+        for record in profiler.records
+    }
+
+    return {
+        'data_dir': os.path.abspath(data_dir),
+        'rows': rows,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'stages': results,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def compare(result, baseline, tolerance=0.2, min_seconds=0.05):
+    """
+    Return the regressions of `result` against `baseline` as a list of messages.
+
+    A stage regresses when it takes more than (1 + tolerance) times the baseline
+    time and at least `min_seconds` longer (so tiny stages don't flag on noise),
+    or when the peak RSS after it grew by more than the tolerance.
+    """
+    regressions = []
+    for name, current in result['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None:
+            continue
+        slower = current['seconds'] - before['seconds']
+        if current['seconds'] > before['seconds'] * (1 + tolerance) and slower >= min_seconds:
+            regressions.append(f'{name}: {before["seconds"]:.3f}s -> {current["seconds"]:.3f}s')
+        if current['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f'{name}: peak RSS {before["peak_rss_mb"]:.0f} MiB -> {current["peak_rss_mb"]:.0f} MiB')
+    return regressions
+
+
+def print_results(result, baseline=None):
+    print(f'{"stage":<28}{"seconds":>10}{"peak RSS MiB":>14}' + (f'{"baseline s":>12}' if baseline else ''))
+    for name, stage in result['stages'].items():
+        line = f'{name:<28}{stage["seconds"]:>10.3f}{stage["peak_rss_mb"]:>14.1f}'
+        if baseline and name in baseline['stages']:
+            line += f'{baseline["stages"][name]["seconds"]:>12.3f}'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the analysis stages and check for regressions.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--generate', type=int, metavar='ROWS',
+                        help='write synthetic data with about ROWS order_products rows first, if missing')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=list(NODES), default=list(REPORTS),
+                        help='only run these nodes and what they need (all tables are always loaded)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    if args.generate and not os.path.exists(data_loader.source_path('order_products', args.data_dir)):
+        synthetic_data.generate(args.data_dir, args.generate, args.seed)
+
+    result = run(args.data_dir, args.stages)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if baseline:
+        regressions = compare(result, baseline, args.tolerance)
+        for message in regressions:
+            print(f'REGRESSION {message}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
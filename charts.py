@@ -0,0 +1,261 @@
+"""
+Batch rendering of the report figures, without a display.
+
+The figures of instacart_analysis.py are drawn here from small aggregate
+series only (counts per hour, per order size, per product, ...), taken from
+the report nodes of the pipeline store (pipeline.py), never from the full
+tables. render_all() sends them to a process pool that uses the
+non-interactive Agg backend and writes PNG and/or SVG files. A manifest in the
+output directory keeps a hash of every figure's input series and drawing code,
+so figures whose inputs did not change since the last run are not drawn again.
+
+    python charts.py --data-dir /datasets --out-dir charts --format png svg
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import pandas as pd
+
+import data_loader
+from pipeline import STORE_DIR, Pipeline
+
+MANIFEST = 'manifest.json'
+FORMATS = ('png', 'svg')
+
+
+def _count_distribution(counts):
+    # How many ids have each count: value_counts() of a per-id count Series, sorted by count
+    counts = counts[counts > 0]
+    return counts.value_counts().sort_index().rename_axis('size').rename('count')
+
+
+def chart_data(pipeline):
+    """
+    Collect the aggregate series every figure is drawn from, keyed by figure name.
+
+    The series are the report nodes of `pipeline` (see pipeline.py), so they
+    are loaded from its store when their inputs did not change and nothing is
+    recomputed from the full tables. Every value is a small Series indexed by
+    the x-axis values (or a DataFrame for the Wednesday vs. Saturday comparison).
+    """
+    order_sizes = pipeline.get('order_size_distribution').rename_axis('size').rename('count')
+    return {
+        'orders_by_hour': pipeline.get('orders_by_hour'),
+        'orders_by_dow': pipeline.get('orders_by_dow'),
+        'days_since_prior_order': pipeline.get('days_since_prior_order'),
+        'wednesday_vs_saturday': pipeline.get('wednesday_vs_saturday'),
+        # The histogram only needs how many customers have each number of orders
+        'orders_per_customer': _count_distribution(pipeline.get('orders_per_customer')),
+        'top_20_products': pipeline.get('top_20_products').set_index('product_name')['order_count'],
+        'order_sizes': order_sizes,
+        'order_sizes_filtered': order_sizes[order_sizes.index < 35],
+        'top_20_reordered': pipeline.get('top_20_reordered').set_index('product_name')['reorder_count'],
+    }
+
+
+def _orders_by_hour(plt, counts):
+    counts.plot(kind='bar', figsize=(12, 6), color='skyblue', edgecolor='black')
+    plt.title('Total Number of Orders by Hour of Day', fontsize=16)
+    plt.xlabel('Hour of Day (0 = Midnight, 23 = 11:00 PM)', fontsize=12)
+    plt.ylabel('Number of Orders', fontsize=12)
+    plt.grid(axis='y', linestyle='--', alpha=0.7)
+
+
+def _orders_by_dow(plt, counts):
+    counts.plot(kind='bar', figsize=(10, 6), color='orange', edgecolor='black')
+    plt.title('Total Number of Orders by Day of Week', fontsize=16)
+    plt.xlabel('Day of Week (0 = Sunday, 1 = Monday, ..., 6 = Saturday)', fontsize=12)
+    plt.ylabel('Number of Orders', fontsize=12)
+    plt.grid(axis='y', linestyle='--', alpha=0.6)
+
+
+def _days_since_prior_order(plt, counts):
+    counts.plot(kind='bar', figsize=(12, 6), color='turquoise', edgecolor='black')
+    plt.title('Distribution of Days Since Prior Order', fontsize=16)
+    plt.xlabel('Days Since Prior Order', fontsize=12)
+    plt.ylabel('Number of Orders', fontsize=12)
+    plt.grid(axis='y', linestyle='--', alpha=0.5)
+
+
+def _wednesday_vs_saturday(plt, hours):
+    plt.figure(figsize=(10, 6))
+    plt.bar(hours.index, hours['Wednesday'], width=1, alpha=0.5, label='Wednesday', color='blue')
+    plt.bar(hours.index, hours['Saturday'], width=1, alpha=0.5, label='Saturday', color='red')
+    plt.title('Comparison of Order Hours: Wednesday vs. Saturday')
+    plt.xlabel('Hour of Day')
+    plt.ylabel('Number of Orders')
+    plt.xticks(range(0, 24))
+    plt.legend()
+
+
+def _orders_per_customer(plt, customers):
+    # Same bins as plt.hist(orders per customer, bins=30), with each count weighted by its customers
+    plt.figure(figsize=(12, 6))
+    plt.hist(customers.index, bins=30, weights=customers.to_numpy(), color='green', edgecolor='black')
+    plt.title('Distribution of Orders per Customer', fontsize=16)
+    plt.xlabel('Number of Orders', fontsize=12)
+    plt.ylabel('Number of Customers', fontsize=12)
+    plt.grid(axis='y', linestyle='--', alpha=0.7)
+
+
+def _top_20_products(plt, counts):
+    plt.figure(figsize=(12, 10))
+    plt.bar(counts.index, counts, color='tan', edgecolor='black')
+    plt.title('Top 20 Most Popular Products', fontsize=16)
+    plt.xlabel('Product Name', fontsize=12)
+    plt.ylabel('Number of Times Ordered', fontsize=12)
+    plt.xticks(rotation=45, ha='right')
+    plt.grid(axis='y', linestyle='--', alpha=0.5)
+
+
+def _order_size_bars(plt, counts, title):
+    counts.plot(kind='bar', figsize=(15, 7), color='red', edgecolor='black')
+    plt.title(title, fontsize=16)
+    plt.xlabel('Number of Items per Order', fontsize=12)
+    plt.ylabel('Total Number of Orders', fontsize=12)
+    plt.xticks(ticks=range(0, len(counts), 2), labels=counts.index[::2], rotation=0)
+    plt.grid(axis='y', linestyle='--', alpha=0.6)
+
+
+def _order_sizes(plt, counts):
+    _order_size_bars(plt, counts, 'Distribution of Order Sizes')
+
+
+def _order_sizes_filtered(plt, counts):
+    _order_size_bars(plt, counts, 'Distribution of Order Sizes (Filtered: < 35 Items)')
+
+
+def _top_20_reordered(plt, counts):
+    plt.figure(figsize=(12, 10))
+    plt.barh(counts.index, counts, color='pink', edgecolor='black')
+    plt.gca().invert_yaxis()
+    plt.title('Top 20 Most Frequently Reordered Products', fontsize=16)
+    plt.xlabel('Number of Reorders', fontsize=12)
+    plt.ylabel('Product Name', fontsize=12)
+    plt.grid(axis='x', linestyle='--', alpha=0.5)
+
+
+# Figure name -> drawing function, in the order the script shows them
+FIGURES = {
+    'orders_by_hour': _orders_by_hour,
+    'orders_by_dow': _orders_by_dow,
+    'days_since_prior_order': _days_since_prior_order,
+    'wednesday_vs_saturday': _wednesday_vs_saturday,
+    'orders_per_customer': _orders_per_customer,
+    'top_20_products': _top_20_products,
+    'order_sizes': _order_sizes,
+    'order_sizes_filtered': _order_sizes_filtered,
+    'top_20_reordered': _top_20_reordered,
+}
+
+
+def figure_hash(name, data, formats):
+    """Hash of a figure's input series, its drawing code and the output formats."""
+    digest = hashlib.sha256()
+    digest.update(name.encode())
+    digest.update(inspect.getsource(FIGURES[name]).encode())
+    if name in ('order_sizes', 'order_sizes_filtered'):
+        digest.update(inspect.getsource(_order_size_bars).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    digest.update(repr(list(data.columns) if isinstance(data, pd.DataFrame) else data.name).encode())
+    digest.update(','.join(formats).encode())
+    return digest.hexdigest()
+
+
+def _use_agg():
+    # Runs once in every worker process, before anything is drawn
+    import matplotlib
+    matplotlib.use('Agg')
+    # Fixed element ids in SVG files, so identical inputs give identical outputs
+    matplotlib.rcParams['svg.hashsalt'] = 'instacart'
+
+
+def _render(name, data, out_dir, formats):
+    import matplotlib.pyplot as plt
+
+    FIGURES[name](plt, data)
+    plt.tight_layout()
+    paths = []
+    for fmt in formats:
+        path = os.path.join(out_dir, f'{name}.{fmt}')
+        # No creation date in the SVG files either
+        plt.savefig(path, format=fmt, metadata={'Date': None} if fmt == 'svg' else None)
+        paths.append(path)
+    plt.close('all')
+    return paths
+
+
+def _read_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def render_all(data, out_dir, formats=('png',), workers=None, force=False, profiler=None):
+    """
+    Draw every figure in `data` (as returned by chart_data()) into `out_dir`.
+
+    Figures are drawn concurrently in `workers` processes. A figure is skipped
+    when its hash matches the manifest and all its files exist, unless `force`.
+    With a profiling.StageProfiler, the drawing is recorded as its
+    'render_charts' stage. Returns a dict of figure name -> 'rendered' or 'unchanged'.
+    """
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f'Unknown formats {sorted(unknown)}, expected some of {FORMATS}')
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = _read_manifest(out_dir)
+
+    hashes = {name: figure_hash(name, series, formats) for name, series in data.items()}
+    stale = [
+        name for name in data
+        if force or manifest.get(name) != hashes[name]
+        or not all(os.path.exists(os.path.join(out_dir, f'{name}.{fmt}')) for fmt in formats)
+    ]
+
+    with profiler.stage('render_charts', rows_in=len(data)) if profiler else nullcontext() as record:
+        if stale:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+                futures = {name: pool.submit(_render, name, data[name], out_dir, formats) for name in stale}
+                for name, future in futures.items():
+                    future.result()
+                    manifest[name] = hashes[name]
+        if record is not None:
+            record.rows_out = len(stale)
+
+    tmp_path = os.path.join(out_dir, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST))
+    return {name: 'rendered' if name in stale else 'unchanged' for name in data}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the report figures to image files.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    parser.add_argument('--out-dir', default='charts')
+    parser.add_argument('--format', nargs='+', choices=FORMATS, default=['png'])
+    parser.add_argument('--workers', type=int, help='number of rendering processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='render every figure, even unchanged ones')
+    args = parser.parse_args()
+
+    pipeline = Pipeline(args.data_dir, store_dir=args.store_dir)
+    data = chart_data(pipeline)
+    statuses = render_all(data, args.out_dir, args.format, args.workers, args.force, pipeline.profiler)
+    for name, status in statuses.items():
+        print(f'{name:<25}{status}')
+    print()
+    print(pipeline.profiler.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""
+The cleaning steps from instacart_analysis.py as reusable functions.
+
+The script walks through each step with checks and printouts; these functions
+apply the same fixes without the exploration, for the other entry points.
+"""
+
+from dedup import find_duplicates
+
+# Placeholder for the cart position of items past the 64th, which the raw data leaves empty
+MISSING_CART_POSITION = 999
+
+
+def clean_orders(orders):
+    """Drop fully duplicated order rows."""
+    duplicates = find_duplicates(orders)
+    return orders[~duplicates.exact].reset_index(drop=True)
+
+
+def clean_products(products):
+    """Fill missing product names with 'Unknown' and drop case-insensitive duplicate names."""
+    products = products.copy()
+    products['product_name'] = products['product_name'].fillna('Unknown')
+    duplicates = find_duplicates(products, name_column='product_name')
+    return products[~duplicates.name_clashes].reset_index(drop=True)
+
+
+def clean_order_products(order_products):
+    """Replace missing add_to_cart_order values with 999 and make the column an integer."""
+    order_products = order_products.copy()
+    order_products['add_to_cart_order'] = (
+        order_products['add_to_cart_order'].fillna(MISSING_CART_POSITION).astype(int)
+    )
+    return order_products
@@ -0,0 +1,153 @@
+"""
+Cached loader for the five Instacart CSV files.
+
+The raw files use semicolon (;) as the separator and are slow to parse, so each
+file is parsed once with explicit compact dtypes and written to a Parquet cache.
+Later loads read the cache instead, and only the columns that are asked for.
+The cache entry is keyed by the source file's path, size and modification
+time, so dropping a new version of a CSV in place invalidates it
+automatically, and several data directories can share one cache directory.
+
+Parsing itself is split into byte ranges parsed in parallel (parallel_csv.py),
+which also corrects the shifted header of products.csv and checks that
+integer values fit their compact dtype instead of letting them wrap around.
+"""
+
+import hashlib
+import os
+
+import pandas as pd
+
+import parallel_csv
+
+DATA_DIR = '/datasets'
+CACHE_DIR = os.environ.get(
+    'INSTACART_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.cache', 'instacart'),
+)
+
+# Bump this whenever SCHEMAS or the cache layout changes so old cache entries are not reused.
+CACHE_VERSION = 3
+
+# Rows per Parquet row group: small enough that order_products has dozens of
+# row groups to hand out to worker processes (parallel.py) and to skip by their
+# statistics (streaming.py), large enough that the per-group overhead is negligible
+ROW_GROUP_ROWS = 2**17
+
+# File name and column dtypes for every table.
+# Nullable integers (Int16) are used where the raw data has missing values, so the
+# column doesn't get promoted to float64 the way it does with inferred dtypes.
+SCHEMAS = {
+    'orders': {
+        'file': 'instacart_orders.csv',
+        'dtypes': {
+            'order_id': 'int32',
+            'user_id': 'int32',
+            'order_number': 'int16',
+            'order_dow': 'int8',
+            'order_hour_of_day': 'int8',
+            'days_since_prior_order': 'float32',
+        },
+    },
+    'products': {
+        'file': 'products.csv',
+        'dtypes': {
+            'product_id': 'int32',
+            'product_name': 'str',
+            'aisle_id': 'int16',
+            'department_id': 'int8',
+        },
+    },
+    'departments': {
+        'file': 'departments.csv',
+        'dtypes': {
+            'department_id': 'int8',
+            'department': 'str',
+        },
+    },
+    'aisles': {
+        'file': 'aisles.csv',
+        'dtypes': {
+            'aisle_id': 'int16',
+            'aisle': 'str',
+        },
+    },
+    'order_products': {
+        'file': 'order_products.csv',
+        'dtypes': {
+            'order_id': 'int32',
+            'product_id': 'int32',
+            'add_to_cart_order': 'Int16',
+            'reordered': 'int8',
+        },
+    },
+}
+
+
+def source_path(table, data_dir=DATA_DIR):
+    """Return the path of the raw CSV file for a table."""
+    return os.path.join(data_dir, SCHEMAS[table]['file'])
+
+
+def source_id(table, data_dir=DATA_DIR):
+    """Short hash of the absolute path of a table's CSV, telling data directories apart."""
+    return hashlib.sha256(os.path.abspath(source_path(table, data_dir)).encode()).hexdigest()[:12]
+
+
+def cache_path(table, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """Return the Parquet cache path for the current version of a table's CSV."""
+    stat = os.stat(source_path(table, data_dir))
+    name = f'{table}-{source_id(table, data_dir)}-v{CACHE_VERSION}-{stat.st_size}-{stat.st_mtime_ns}.parquet'
+    return os.path.join(cache_dir, name)
+
+
+def parse_csv(table, data_dir=DATA_DIR, columns=None, workers=None):
+    """Parse a raw CSV file with the declared dtypes (no cache involved), on `workers` processes."""
+    return parallel_csv.read_csv(source_path(table, data_dir), SCHEMAS[table]['dtypes'], columns, workers)
+
+
+def _remove_stale_entries(table, data_dir, cache_dir, keep):
+    # Older versions of the same source file are never read again once it changes;
+    # entries of the same table from other data directories are left alone
+    prefix = f'{table}-{source_id(table, data_dir)}-'
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith('.parquet'):
+            path = os.path.join(cache_dir, name)
+            if path != keep:
+                os.remove(path)
+
+
+def load_table(table, columns=None, data_dir=DATA_DIR, cache_dir=CACHE_DIR, use_cache=True):
+    """
+    Load one of the five tables, reading only `columns` if given.
+
+    The first call parses the CSV and writes the cache; later calls with an
+    unchanged source file read straight from the cache.
+    """
+    if table not in SCHEMAS:
+        raise KeyError(f'Unknown table {table!r}, expected one of {sorted(SCHEMAS)}')
+    if not use_cache:
+        return parse_csv(table, data_dir, columns)
+
+    path = cache_path(table, data_dir, cache_dir)
+    if not os.path.exists(path):
+        df = parse_csv(table, data_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary name first so a crash never leaves a half-written cache
+        tmp_path = path + '.tmp'
+        df.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_ROWS)
+        os.replace(tmp_path, path)
+        _remove_stale_entries(table, data_dir, cache_dir, keep=path)
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+
+    return pd.read_parquet(path, columns=None if columns is None else list(columns))
+
+
+def load_all(data_dir=DATA_DIR, cache_dir=CACHE_DIR, use_cache=True):
+    """Load all five tables and return them in a dict keyed by table name."""
+    return {
+        table: load_table(table, data_dir=data_dir, cache_dir=cache_dir, use_cache=use_cache)
+        for table in SCHEMAS
+    }
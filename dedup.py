@@ -0,0 +1,178 @@
+"""
+Hash-based duplicate detection for the cleaning steps.
+
+Every row is hashed to a single 64-bit integer once, and product names are
+turned into integer codes of their lowercased form once (only the distinct
+names are lowercased, not every row). Exact duplicates, repeated keys and
+case-insensitive name clashes are then found by comparing integers.
+
+Two different rows hashing to the same 64-bit value is possible in theory but
+vanishingly unlikely at these table sizes (about 1 in 10^7 for 10^6 rows).
+"""
+
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+def row_hashes(df, columns=None):
+    """Return one uint64 hash per row of `df`, over `columns` (all columns by default)."""
+    if columns is not None:
+        df = df[list(columns)]
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def name_codes(names):
+    """
+    Return integer codes that are equal for names that only differ in case.
+
+    Missing names get -1. Only the distinct names are lowercased.
+    """
+    codes, uniques = pd.factorize(names)
+    lowered_codes, _ = pd.factorize(pd.Series(uniques).str.lower())
+    result = np.full(len(codes), -1, dtype=np.int64)
+    known = codes >= 0
+    result[known] = lowered_codes[codes[known]]
+    return result
+
+
+def _duplicated(values):
+    # True for every value that already appeared earlier in the array
+    return pd.Series(values).duplicated().to_numpy()
+
+
+@dataclass
+class DuplicateReport:
+    """
+    Boolean row masks from find_duplicates().
+
+    Every mask marks the later occurrences only, so dropping the marked rows
+    keeps the first occurrence, like drop_duplicates() does.
+    """
+
+    exact: np.ndarray
+    key_collisions: np.ndarray
+    name_clashes: np.ndarray
+    hashes: np.ndarray
+    codes: np.ndarray = None
+
+    def summary(self):
+        """Counts of each kind of duplicate, for printing or logging."""
+        return {
+            'exact_duplicates': int(self.exact.sum()),
+            'key_collisions': int(self.key_collisions.sum()),
+            'name_clashes': int(self.name_clashes.sum()),
+        }
+
+
+def find_duplicates(df, key=None, name_column=None):
+    """
+    Find exact duplicate rows, key collisions and case-insensitive name clashes.
+
+    key_collisions marks rows whose `key` value was seen before but which are not
+    exact copies of an earlier row. name_clashes marks rows whose `name_column`
+    matches an earlier row's name when case is ignored. Masks for checks that
+    were not asked for are all False.
+    """
+    hashes = row_hashes(df)
+    exact = _duplicated(hashes)
+    no_match = np.zeros(len(df), dtype=bool)
+
+    key_collisions = no_match
+    if key is not None:
+        key_collisions = _duplicated(df[key].to_numpy()) & ~exact
+
+    codes = None
+    name_clashes = no_match
+    if name_column is not None:
+        codes = name_codes(df[name_column])
+        name_clashes = _duplicated(codes)
+
+    return DuplicateReport(exact, key_collisions, name_clashes, hashes, codes)
+
+
+def _merge_sorted(left, right):
+    # Merge two sorted arrays with no values in common, in time linear in their lengths
+    return np.insert(left, np.searchsorted(left, right), right)
+
+
+class SeenSet:
+    """
+    Persisted set of row hashes for deduplicating incremental loads.
+
+    The hashes are held as a few sorted uint64 runs of decreasing size. New
+    hashes become a run of their own, and a run is merged into the one before
+    it once it gets at least half as long, so there are O(log n) runs and
+    every hash is merged O(log n) times: remembering a batch costs time
+    proportional to the batch, not to the history. save() merges the runs and
+    writes one sorted array with np.save.
+    """
+
+    def __init__(self, hashes=None):
+        self._runs = [] if hashes is None or not len(hashes) else [np.unique(np.asarray(hashes, dtype=np.uint64))]
+
+    @property
+    def hashes(self):
+        """All hashes in the set, as one sorted array."""
+        if len(self._runs) > 1:
+            merged = self._runs[-1]
+            for run in reversed(self._runs[:-1]):
+                merged = _merge_sorted(run, merged)
+            self._runs = [merged]
+        return self._runs[0] if self._runs else np.zeros(0, dtype=np.uint64)
+
+    def __len__(self):
+        return sum(len(run) for run in self._runs)
+
+    def contains(self, hashes):
+        """Return a boolean mask of which hashes are already in the set."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        found = np.zeros(len(hashes), dtype=bool)
+        for run in self._runs:
+            positions = np.searchsorted(run, hashes)
+            positions[positions == len(run)] = 0
+            found |= run[positions] == hashes
+        return found
+
+    def _remember(self, hashes):
+        # Add sorted hashes that are not in the set yet, merging runs of similar size
+        run = hashes
+        while self._runs and len(self._runs[-1]) <= 2 * len(run):
+            run = _merge_sorted(self._runs.pop(), run)
+        self._runs.append(run)
+
+    def add(self, hashes):
+        """
+        Remember `hashes` and return a mask of the ones that were not in the set.
+
+        Values repeated inside `hashes` count as seen after their first occurrence.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        new = ~self.contains(hashes) & ~_duplicated(hashes)
+        if new.any():
+            self._remember(np.sort(hashes[new]))
+        return new
+
+    def new_rows(self, df, columns=None):
+        """
+        Return a mask of rows of `df` that were never seen before, and remember them.
+
+        Rows repeated inside `df` itself count as seen after their first occurrence.
+        """
+        return self.add(row_hashes(df, columns))
+
+    def save(self, path):
+        """Write the set to a .npy file (atomically, through a temporary file)."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.hashes)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a set written by save(); a missing file gives an empty set."""
+        if not os.path.exists(path):
+            return cls()
+        return cls(np.load(path))
@@ -0,0 +1,35 @@
+"""
+product_id -> products row lookups.
+
+Product attributes are looked up by indexing a dense array with product_id
+(product ids are small integers), which avoids building a hash table for a
+join. product_metrics.py uses it to attach names to the few reported rows and
+to apply the inner-join semantics of a merge with products.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def product_positions(products):
+    """
+    Return a dense array mapping product_id -> row position in `products`.
+
+    Product ids that are not in the table map to -1.
+    """
+    ids = products['product_id'].to_numpy()
+    if pd.Series(ids).duplicated().any():
+        # A merge would fan out duplicate ids into several rows, a lookup can't
+        raise ValueError('products has duplicate product_id values, deduplicate it first')
+    positions = np.full(ids.max() + 1 if len(ids) else 0, -1, dtype=np.int32)
+    positions[ids] = np.arange(len(ids), dtype=np.int32)
+    return positions
+
+
+def lookup_positions(positions, product_ids):
+    """Look up row positions for an array of product ids (-1 where unknown)."""
+    product_ids = np.asarray(product_ids)
+    in_range = (product_ids >= 0) & (product_ids < len(positions))
+    result = np.full(len(product_ids), -1, dtype=np.int32)
+    result[in_range] = positions[product_ids[in_range]]
+    return result
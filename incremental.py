@@ -0,0 +1,266 @@
+"""
+Incremental updates of the analysis aggregates from daily data drops.
+
+The aggregates (hour/day-of-week counts, days-since-prior histogram, orders per
+user, items per order, per-product and per-user reorder counters, first-in-cart
+counts) are kept in a state file, together with the set of order ids seen so
+far (a dedup.SeenSet). update() counts only the drop's new orders and
+order_products rows, as compact (ids, counts) deltas added to the counters in
+place, and save() writes those deltas to a delta file next to the state
+instead of rewriting it. Every COMPACT_EVERY saves the deltas are folded into
+the state file and removed.
+
+order_products rows whose order has not arrived yet are held back in the
+state and counted in the drop that delivers their order, so an items-only
+drop delivered twice is still only counted once.
+
+So folding in and writing a drop cost time proportional to the drop. Loading
+still reads the whole state, whose size is bounded by the number of distinct
+orders, products and users, not by the number of rows in the history.
+
+    python incremental.py update --state aggregates.npz --drop-dir /datasets/drops/2026-10-18
+    python incremental.py report --state aggregates.npz
+"""
+
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from dedup import SeenSet
+from streaming import PartialAggregates, batch_events, compact_counts, order_events
+from topk import top_k
+
+# Number of delta files after which save() rewrites the whole state
+COMPACT_EVERY = 30
+
+
+def _delta_path(path, generation, number):
+    # Delta files belong to one generation of the state file, so a compaction
+    # interrupted before it removed them can't make load() apply them twice
+    return f'{path}.{generation}.{number}.delta'
+
+
+def _item_users(order_ids, orders):
+    # user_id of every item's order among `orders` (-1 for any other order), by binary search
+    keys = orders['order_id'].to_numpy()
+    sort = np.argsort(keys, kind='stable')
+    keys, users = keys[sort], orders['user_id'].to_numpy(dtype=np.int64)[sort]
+    result = np.full(len(order_ids), -1, dtype=np.int64)
+    if len(keys):
+        positions = np.minimum(np.searchsorted(keys, order_ids), len(keys) - 1)
+        found = keys[positions] == order_ids
+        result[found] = users[positions[found]]
+    return result
+
+
+def _size_histogram_delta(before, after):
+    # Each touched order leaves the bin of its old size and enters the bin of its new one;
+    # bin 0 stands for "no items yet" and is not part of the histogram
+    sizes, inverse = np.unique(np.concatenate([before, after]), return_inverse=True)
+    moves = np.repeat(np.array([-1, 1], dtype=np.int64), len(before))
+    delta = np.bincount(inverse, moves, minlength=len(sizes)).astype(np.int64)
+    keep = (sizes > 0) & (delta != 0)
+    return sizes[keep], delta[keep]
+
+
+def _merge_compact(compacts):
+    # Sum several {counter: (ids, values)} deltas into one
+    names = {name for compact in compacts for name in compact}
+    events = []
+    for name in sorted(names):
+        parts = [compact[name] for compact in compacts if name in compact]
+        events.append((name, np.concatenate([ids for ids, _ in parts]), np.concatenate([values for _, values in parts])))
+    return compact_counts(events)
+
+
+class AggregateState:
+    """
+    Persisted aggregates plus the set of order ids seen so far.
+
+    Items are only accepted for orders that were not seen in an earlier drop,
+    and are held back until their order arrives, so an accepted item's order is
+    always in the same drop: joining items to users only needs the drop's own
+    orders, nothing from the history.
+    """
+
+    def __init__(self, aggregates=None, seen_orders=None, generation=0, deltas=0, held=None):
+        self.aggregates = aggregates or PartialAggregates(np.zeros(0, dtype=np.int64))
+        self.seen_orders = seen_orders if seen_orders is not None else SeenSet()
+        # order_products rows waiting for their order to arrive in a later drop
+        self.held = held
+        self.generation = generation
+        # Delta files written since the last compaction, and drops not saved yet
+        self.deltas = deltas
+        self._pending = []
+
+    def seen(self, order_ids):
+        """Return a boolean mask of which order ids are already in the state."""
+        return self.seen_orders.contains(np.asarray(order_ids).astype(np.uint64))
+
+    def update(self, new_orders, new_order_products):
+        """
+        Fold a data drop into the state.
+
+        Duplicate rows inside the drop and orders whose order_id was already seen
+        are skipped. Items are only accepted for orders that were not seen in an
+        earlier drop, so re-delivered baskets are not counted twice. Items of
+        orders that are not in this drop either are held back until their order
+        arrives; items delivered again for an order that is still held back are
+        skipped.
+        """
+        item_orders = new_order_products['order_id'].to_numpy()
+        redelivered = self.seen(item_orders)
+        if self.held is not None:
+            redelivered |= np.isin(item_orders, self.held['order_id'].to_numpy())
+            new_order_products = pd.concat([self.held, new_order_products[~redelivered]], ignore_index=True)
+        else:
+            new_order_products = new_order_products[~redelivered]
+        new_orders = new_orders.drop_duplicates()
+        order_ids = new_orders['order_id'].to_numpy()
+        # Remembers the new ids; repeated ids inside the drop keep their first row
+        new_orders = new_orders[self.seen_orders.add(order_ids.astype(np.uint64))]
+
+        users = _item_users(new_order_products['order_id'].to_numpy(), new_orders)
+        arrived = users >= 0
+        self.held = new_order_products[~arrived].reset_index(drop=True) if not arrived.all() else None
+        new_order_products, users = new_order_products[arrived], users[arrived]
+        compact = compact_counts(order_events(new_orders) + batch_events(new_order_products, users))
+        compact['order_size_histogram'] = self._order_size_histogram_delta(compact['items_per_order'])
+        self.aggregates.add_compact(compact)
+        self._pending.append((compact, new_orders['order_id'].to_numpy(dtype=np.int64)))
+        return self
+
+    def _order_size_histogram_delta(self, items_delta):
+        # Only the orders touched by this drop move between histogram bins
+        order_ids, added = items_delta
+        sizes = self.aggregates.counters.get('items_per_order', np.zeros(0, dtype=np.int64))
+        before = np.zeros(len(order_ids), dtype=np.int64)
+        in_range = order_ids < len(sizes)
+        before[in_range] = sizes[order_ids[in_range]]
+        return _size_histogram_delta(before, before + added)
+
+    def order_size_distribution(self):
+        """Number of orders per basket size, like items_per_order.value_counts().sort_index()."""
+        histogram = self.aggregates.counters.get('order_size_histogram', np.zeros(0, dtype=np.int64))
+        sizes = np.flatnonzero(histogram)
+        return pd.Series(histogram[sizes], index=pd.Index(sizes, name='product_id'), name='count')
+
+    def save(self, path):
+        """
+        Write the drops folded in since the last save() to a new delta file next to `path`.
+
+        When there is no state file yet, or COMPACT_EVERY delta files have piled
+        up, the whole state is written to `path` instead (atomically, through a
+        temporary file) and the delta files are removed.
+        """
+        if not os.path.exists(path) or self.deltas + 1 >= COMPACT_EVERY:
+            self._compact(path)
+        elif self._pending:
+            compact = _merge_compact([compact for compact, _ in self._pending])
+            arrays = {'order_ids': np.concatenate([order_ids for _, order_ids in self._pending])}
+            for name, (ids, values) in compact.items():
+                arrays[f'ids_{name}'] = ids
+                arrays[f'values_{name}'] = values
+            arrays.update(self._held_arrays())
+            self.deltas += 1
+            _write_npz(_delta_path(path, self.generation, self.deltas), arrays)
+        self._pending = []
+
+    def _compact(self, path):
+        old_deltas = glob.glob(glob.escape(path) + '.*.delta')
+        self.generation += 1
+        arrays = {f'counter_{name}': values for name, values in self.aggregates.counters.items()}
+        arrays['seen_orders'] = self.seen_orders.hashes
+        arrays['generation'] = np.array(self.generation)
+        arrays.update(self._held_arrays())
+        _write_npz(path, arrays)
+        for delta_path in old_deltas:
+            os.remove(delta_path)
+        self.deltas = 0
+
+    def _held_arrays(self):
+        # Every state and delta file carries the items held back at the time it was written
+        if self.held is None:
+            return {}
+        return {f'held_{column}': self.held[column].to_numpy(dtype=np.float64, na_value=np.nan)
+                for column in self.held.columns}
+
+    @staticmethod
+    def _read_held(data):
+        columns = [key[len('held_'):] for key in data.files if key.startswith('held_')]
+        if not columns:
+            return None
+        dtypes = data_loader.SCHEMAS['order_products']['dtypes']
+        return pd.DataFrame({column: pd.Series(data[f'held_{column}']).astype(dtypes.get(column, 'float64'))
+                             for column in columns})
+
+    @classmethod
+    def load(cls, path):
+        """Read a state written by save(), with its delta files; a missing file gives an empty state."""
+        if not os.path.exists(path):
+            return cls()
+        with np.load(path) as data:
+            counters = {key[len('counter_'):]: data[key] for key in data.files if key.startswith('counter_')}
+            state = cls(PartialAggregates(np.zeros(0, dtype=np.int64), counters), SeenSet(data['seen_orders']),
+                        int(data['generation']), held=cls._read_held(data))
+        while os.path.exists(_delta_path(path, state.generation, state.deltas + 1)):
+            state.deltas += 1
+            with np.load(_delta_path(path, state.generation, state.deltas)) as data:
+                names = [key[len('ids_'):] for key in data.files if key.startswith('ids_')]
+                state.aggregates.add_compact({name: (data[f'ids_{name}'], data[f'values_{name}']) for name in names})
+                state.seen_orders.add(data['order_ids'].astype(np.uint64))
+                state.held = cls._read_held(data)
+        return state
+
+
+def _write_npz(path, arrays):
+    # Atomically, through a temporary file
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def update(state_path, new_orders, new_order_products):
+    """Load the state, fold a data drop into it and save it again."""
+    state = AggregateState.load(state_path)
+    state.update(new_orders, new_order_products)
+    state.save(state_path)
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the analysis aggregates incrementally.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update_parser = subparsers.add_parser('update', help='fold a new data drop into the state')
+    update_parser.add_argument('--state', required=True)
+    update_parser.add_argument('--drop-dir', required=True,
+                               help='directory with the new instacart_orders.csv and order_products.csv')
+    report_parser = subparsers.add_parser('report', help='print the aggregates held in the state')
+    report_parser.add_argument('--state', required=True)
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        state = update(
+            args.state,
+            data_loader.parse_csv('orders', args.drop_dir),
+            data_loader.parse_csv('order_products', args.drop_dir),
+        )
+    else:
+        state = AggregateState.load(args.state)
+
+    aggregates = state.aggregates
+    print(aggregates.hourly_counts())
+    print(aggregates.dow_counts())
+    print(aggregates.days_since_prior_counts())
+    print(state.order_size_distribution())
+    metrics = aggregates.product_metrics()
+    print(metrics.loc[top_k(metrics['order_count'], 20).index])
+
+
+if __name__ == '__main__':
+    main()
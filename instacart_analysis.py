@@ -1,14 +1,27 @@
 # Import the libraries you'll need for this analysis
+import os
+
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from basket_pairs import co_purchases, name_pairs
+from compact import compact_tables
+from data_loader import load_table
+from dedup import find_duplicates
+from product_metrics import named_series, product_metrics
+from time_cube import OrderTimeCube
+from topk import bottom_k, top_k
+from user_index import UserOrderIndex
+
 # Load the datasets
 # Note: These files use semicolon (;) as the separator instead of comma
-orders         = pd.read_csv('/datasets/instacart_orders.csv', sep=';')
-products       = pd.read_csv('/datasets/products.csv', sep=';')
-departments    = pd.read_csv('/datasets/departments.csv', sep=';')
-aisles         = pd.read_csv('/datasets/aisles.csv', sep=';')
-order_products = pd.read_csv('/datasets/order_products.csv', sep=';')
+# load_table() parses each file once with compact dtypes and caches it as Parquet,
+# so later runs skip the CSV parsing entirely
+orders         = load_table('orders')
+products       = load_table('products')
+departments    = load_table('departments')
+aisles         = load_table('aisles')
+order_products = load_table('order_products')
 
 # In this cell, type "orders" below this line and execute the cell
 orders #calling the "orders" variable allows for quick inspection of the DataFrame. Displayed below is the first 5, and last 5 rows confirming data has been loaded correctly. We also get total number of rows and columns, and column header info.  
@@ -105,82 +118,83 @@ print(order_products['add_to_cart_order'].max())
 #checked max value to confirm the values have been changes to 999.
 
 # Find the number of duplicate rows in the orders dataframe
+# find_duplicates() hashes every row once, the masks it returns are reused below
 
-print(orders.duplicated().sum())
+orders_duplicates = find_duplicates(orders, key='order_id')
+print(orders_duplicates.exact.sum())
 
 #There are 15 duplicated rows in the orders dataframe.
 
 # View the duplicate rows
 
-print(orders[orders.duplicated()])
+print(orders[orders_duplicates.exact])
 
 # Remove duplicate orders
 
-orders = orders.drop_duplicates().reset_index(drop=True)
+orders = orders[~orders_duplicates.exact].reset_index(drop=True)
 
 # Double check for duplicate rows
 
-print(orders.duplicated().sum())
+print(find_duplicates(orders).exact.sum())
 
 #confirmed there are no more duplicate rows
 
-# Check for fully duplicate rows
+# Check for fully duplicate rows, duplicate product IDs and duplicate product names in one pass
+# Names are compared without case, only the distinct names get lowercased
 
-print(products.duplicated().sum())
+products_duplicates = find_duplicates(products, key='product_id', name_column='product_name')
+print(products_duplicates.exact.sum())
 
-# Check for just duplicate product IDs using subset='product_id' in duplicated()
+# Check for just duplicate product IDs (rows that reuse an earlier product_id)
 
-products[products.duplicated(subset='product_id', keep=False)]
+products[products_duplicates.key_collisions]
 
-# Check for just duplicate product names (convert names to lowercase to compare better)
+# Check for just duplicate product names (ignoring capitalization)
 
-print(products['product_name'].str.lower().duplicated().sum())
+print(products_duplicates.name_clashes.sum())
 print()
-products[products['product_name'].str.lower().duplicated()]
+products[products_duplicates.name_clashes]
 
 #viewed the actual duplicated rows in addition to the number of duplicated rows. 
 
 products[products['product_name'].str.lower() == 'high performance energy drink']
 
-#Create a helper column with lowercased names
-products['product_name_lower'] = products['product_name'].str.lower()
-
-#Drop duplicates based on that helper column
-products = products.drop_duplicates(subset='product_name_lower').reset_index(drop=True)
-
-#Remove the helper column to keep the DataFrame clean
-products = products.drop(columns=['product_name_lower'])
+#Drop the rows whose name (ignoring capitalization) already appeared earlier
+#No helper column is needed, the name clash mask was already computed above
+products = products[~products_duplicates.name_clashes].reset_index(drop=True)
 
 #Corrected confirmation: Check 'products' instead of 'order_products'
 #We check the 'product_name' column specifically for duplicates
-print(f"Duplicate product names remaining: {products['product_name'].str.lower().duplicated().sum()}")
+print(f"Duplicate product names remaining: {find_duplicates(products, name_column='product_name').name_clashes.sum()}")
 
 #Checked for duplicates using duplicated().sum() and put my response in an f string. 
 
 #Check for duplicate entries in the departments dataframe
 
-departments[departments.duplicated()]
+departments_duplicates = find_duplicates(departments, name_column='department')
+departments[departments_duplicates.exact]
 
 #Check for duplicate department names (ignoring capitalization)
 
-print(departments['department'].str.lower().duplicated().sum())
+print(departments_duplicates.name_clashes.sum())
 
 #It is safe to conclude departments DataFrame has zero duplicated entires.
 
 # Check for aisles entries in the departments dataframe
 #Typo in instructions. I suppose its meant to say check for duplicate entries in the aisles dataframe
 
-print(aisles.duplicated().sum())
+aisles_duplicates = find_duplicates(aisles, name_column='aisle')
+print(aisles_duplicates.exact.sum())
 
 #Run a case-sensitive check to ensure there are no duplicates in the aisles dataframe. 
 
-print(aisles['aisle'].str.lower().duplicated().sum())
+print(aisles_duplicates.name_clashes.sum())
 
 #Safe to conclude that there are no duplicates in the aisles dataframe. 
 
 # Check for duplicate entries in the order_products dataframe
 
-print(order_products.duplicated().sum())
+print(find_duplicates(order_products).exact.sum())
 
 #No need to run a case-sensitive check because all data in this dataframe are numbers and numbers dont have upper and lower case versions. 
 
@@ -194,13 +208,31 @@ print("Unique days of week:", sorted(orders['order_dow'].unique()))
 
 #Order ranges for both columns are validated.
 
-# Count the number of orders placed at each hour of the day
-# .value_counts() calculates the frequency of each unique value in the column
-hourly_counts = orders['order_hour_of_day'].value_counts()
+# Optional compact mode: set INSTACART_COMPACT_MODE=1 to shrink all five tables now that cleaning is done
+# Integers get the smallest type that fits, names become categories, and a before/after memory report is printed
+COMPACT_MODE = os.environ.get('INSTACART_COMPACT_MODE') == '1'
+
+if COMPACT_MODE:
+    tables = compact_tables({
+        'orders': orders,
+        'products': products,
+        'departments': departments,
+        'aisles': aisles,
+        'order_products': order_products,
+    })
+    orders, products, departments, aisles, order_products = (
+        tables['orders'], tables['products'], tables['departments'], tables['aisles'], tables['order_products']
+    )
+
+# Count every order by day of week, hour of day and days since prior order in one pass
+# The hourly, daily, days-since-prior and Wednesday vs. Saturday sections all read from this small cube
+# instead of filtering the full orders table again
+order_time_cube = OrderTimeCube.from_orders(orders)
 
-# Sort the counts by the index (the hour)
-# This ensures the chart displays hours chronologically from 0 to 23
-hourly_counts_sorted = hourly_counts.sort_index()
+# Count the number of orders placed at each hour of the day
+# .marginal() adds up the cube over the other two axes, one count per hour
+# The counts come out in index order, so the chart displays hours chronologically from 0 to 23
+hourly_counts_sorted = order_time_cube.marginal('order_hour_of_day')
 
 # Create the bar plot
 # We use a bar plot to clearly see the differences between individual hours
@@ -231,12 +263,11 @@ plt.tight_layout()
 plt.show()
 
 # 1. Count the number of orders for each day of the week
-# .value_counts() identifies how many orders were placed on Day 0, Day 1, etc.
-dow_counts = orders['order_dow'].value_counts()
+# .marginal() adds up the cube to show how many orders were placed on Day 0, Day 1, etc.
 
-# 2. Sort the results by the index (0-6)
+# 2. The results come out sorted by the index (0-6)
 # This ensures the chart follows the natural order of a week
-dow_counts_sorted = dow_counts.sort_index()
+dow_counts_sorted = order_time_cube.marginal('order_dow')
 
 # 3. Create a bar plot to visualize the frequency of orders
 # Using 'lightgreen' helps differentiate this chart from the hourly analysis
@@ -264,11 +295,9 @@ plt.show()
 #Based on the trends, Sunday and Monday show the highest volume of orders. It levels out Tuesday through Saturday. 
 
 # Count the frequency of each interval of days since the last order
-wait_counts = orders['days_since_prior_order'].value_counts()
-
-# Sort the results by the index (the number of days)
-# This will ensure ascending order for easier readability
-wait_counts_sorted = wait_counts.sort_index()
+# The results are already in index order (the number of days), which makes them easier to read
+# First orders have no prior order, so they are left out like .value_counts() would do
+wait_counts_sorted = order_time_cube.marginal('days_since_prior_order')
 
 # Create a bar plot to visualize the distribution
 # We use a wider figure (12, 6) to accommodate the 30 day labels
@@ -297,15 +326,9 @@ plt.show()
 """
 Is there a difference in 'order_hour_of_day' distributions on Wednesdays and Saturdays?"""
 
-# Create a mask for orders placed on Wednesdays (Day 3)
-wednesday_mask = orders['order_dow'] == 3
-
-# Create a mask for orders placed on Saturdays (Day 6)
-saturday_mask = orders['order_dow'] == 6
-
-# Apply the masks to filter the data, then count the hours and sort by index
-wednesday_hours = orders[wednesday_mask]['order_hour_of_day'].value_counts().sort_index()
-saturday_hours = orders[saturday_mask]['order_hour_of_day'].value_counts().sort_index()
+# Take the hours of orders placed on Wednesdays (Day 3) and on Saturdays (Day 6) from the cube
+wednesday_hours = order_time_cube.marginal('order_hour_of_day', order_dow=3)
+saturday_hours = order_time_cube.marginal('order_hour_of_day', order_dow=6)
 
 # Combine the Wednesday and Saturday series into a single DataFrame
 # axis=1: aligns the data side-by-side as columns
@@ -318,18 +341,15 @@ combined_hours = combined_hours.fillna(0)
 # Display the first few rows to verify the alignment
 print(combined_hours.head())
 
-#Isolate the hours for each day
-wednesday_hours = orders[orders['order_dow'] == 3]['order_hour_of_day']
-saturday_hours = orders[orders['order_dow'] == 6]['order_hour_of_day']
-
 #Plot them together
+#The hourly counts are already there, so we draw one bar per hour instead of a histogram of every order
 plt.figure(figsize=(10, 6))
 
 #Plot Wednesday in blue
-plt.hist(wednesday_hours, bins=24, alpha=0.5, label='Wednesday', color='blue')
+plt.bar(wednesday_hours.index, wednesday_hours, width=1, alpha=0.5, label='Wednesday', color='blue')
 
 #Plot Saturday in orange
-plt.hist(saturday_hours, bins=24, alpha=0.5, label='Saturday', color='red')
+plt.bar(saturday_hours.index, saturday_hours, width=1, alpha=0.5, label='Saturday', color='red')
 
 #Add labels (Y-axis is now back to "Number of Orders")
 plt.title('Comparison of Order Hours: Wednesday vs. Saturday')
@@ -346,12 +366,14 @@ plt.show()
 What's the distribution for the number of orders per customer?
 """
 
-#Count how many orders each user has made
-# We group by user_id and count the number of order_ids for each
-user_order_counts = orders.groupby('user_id')['order_id'].count()
+# Index every customer's orders (sorted by order_number) and every order's items (sorted by cart position)
+# Each customer's history is one contiguous block, so per-customer numbers need no groupby or merge
+# The reorder rate per customer further down uses this same index
+user_index = UserOrderIndex.build(orders, order_products)
 
-# Sort the results from the grouping to see the order counts in order
-user_order_counts_sorted = user_order_counts.sort_values()
+#Count how many orders each user has made
+# The index stores where each user's orders start and end, so the count is the size of that block
+user_order_counts = user_index.order_counts()
 
 #user_order_counts contains the total orders for each user_id
 plt.figure(figsize=(12, 6))
@@ -372,23 +394,25 @@ plt.show()
 What are the top 20 popular products
 """
 
-# Merge the order_products and products DataFrames using the 'product_id' column
-# We use an 'inner' merge to ensure we only keep items that exist in both tables
-order_info = order_products.merge(products, on='product_id')
+# Count, for every product, how often it was ordered, reordered and put in the cart first
+# All four product reports read this one table, so order_products is only scanned once
+# Like an 'inner' merge, products that are missing from the products table are left out
+product_stats = product_metrics(order_products, products)
 
-# Group by both ID and Name, then use .size() to count the occurrences
-# .size() returns the total number of rows for each unique product
-product_counts = order_info.groupby(['product_id', 'product_name']).size()
+# Pick the 20 most frequently ordered items, most popular first, without sorting every product
+# top_k() breaks ties by the lower product_id
+top_20_counts = top_k(product_stats['order_count'], 20)
 
-# Sort the counts in descending order so the most frequently ordered items are at the top
-product_counts_sorted = product_counts.sort_values(ascending=False)
+# Put the order counts next to the product names: one row per (product_id, product_name)
+# Product names are only looked up for these 20 rows
+product_counts_top = named_series(top_20_counts.to_frame(), 'order_count', products).rename(None)
 
 # Display the top results to verify the ranking
-print(product_counts_sorted.head(20))
+print(product_counts_top)
 
 #Convert the Series to a DataFrame and reset the index
 #This turns the MultiIndex (id, name) into regular columns
-top_20_df = product_counts_sorted.head(20).reset_index()
+top_20_df = product_counts_top.reset_index()
 
 #Rename the count column (which usually defaults to 0 or 'size') 
 top_20_df.columns = ['product_id', 'product_name', 'count']
@@ -466,21 +490,17 @@ plt.show()
 
 """What are the top 20 items that are reordered most frequently?"""
 
-# Create a DataFrame containing only items that have been reordered
-reordered_products = order_products[order_products['reordered'] == 1]
-
-# Merge the filtered reordered items with the products table
-reordered_info = reordered_products.merge(products, on='product_id')
-
-# Group by product_id and product_name to count reorders for each item
-reorder_counts = reordered_info.groupby(['product_id', 'product_name']).size()
+# The number of reorders for each item was already counted in product_stats
+# Items that were never reordered are left out, like a filter on reordered == 1 would
+reorder_counts = product_stats['reorder_count']
+reorder_counts = reorder_counts[reorder_counts > 0]
 
-#Sort the counts
-reorder_counts_sorted = reorder_counts.sort_values(ascending=False)
+#Get the top 20 (ties go to the lower product_id) and attach their names
+top_20_reorders = named_series(top_k(reorder_counts, 20).to_frame(), 'reorder_count', products).rename(None)
 
-#Get the top 20 and convert to a clean DataFrame
+#Convert to a clean DataFrame
 # reset_index() pulls 'product_id' and 'product_name' out of the index and into columns
-top_20_reorders_table = reorder_counts_sorted.head(20).reset_index()
+top_20_reorders_table = top_20_reorders.reset_index()
 
 #Rename the count column for clarity
 top_20_reorders_table.columns = ['product_id', 'product_name', 'reorder_count']
@@ -488,9 +508,8 @@ top_20_reorders_table.columns = ['product_id', 'product_name', 'reorder_count']
 #Display the results as a table
 print(top_20_reorders_table)
 
-#Prepare the data (Resetting the index to separate IDs from Names)
-top_20_reorders_df = reorder_counts_sorted.head(20).reset_index()
-top_20_reorders_df.columns = ['product_id', 'product_name', 'reorder_count']
+#Prepare the data (the same table, with separate ID and Name columns)
+top_20_reorders_df = top_20_reorders_table
 
 #Create a horizontal bar chart
 plt.figure(figsize=(12, 10))
@@ -523,27 +542,20 @@ plt.show()
 For each product, what proportion of its orders are reorders?
 """
 
-#Merge the datasets
-#Combining order_products with products to get names and IDs
-order_info_combined = order_products.merge(products, on='product_id')
+#The average of 'reordered' for each product is the 'reorder_rate' column of product_stats
 
-#Group the data. Calculate the mean of 'reordered'
-#Grouping by ID and Name, then calculating the average reorder rate
-reorder_rate_series = order_info_combined.groupby(['product_id', 'product_name'])['reordered'].mean()
+#Attach the product names, one row per (product_id, product_name)
+reorder_rate_series = named_series(product_stats, 'reorder_rate', products)
 
-#Sort the results
-# Sorting by the calculated rate in descending order (highest rates first)
-reorder_rate_sorted = reorder_rate_series.sort_values(ascending=False)
-
-#Convert to a DataFrame
+#Convert to a DataFrame, in product_id order
 # Use reset_index to move 'product_id' and 'product_name' out of the index and into columns
-reorder_rate_df = reorder_rate_sorted.reset_index()
+reorder_rate_df = reorder_rate_series.reset_index()
 
 #Rename the calculated column for better clarity
 reorder_rate_df.columns = ['product_id', 'product_name', 'reorder_rate']
 
 #Optional Sorting (As per reviewer's request for "informative slice")
-#We will keep the data sorted by 'reorder_rate' to show the top/bottom as requested.
+#Instead of sorting every product, we only pick out the top and bottom rows we show.
 
 # --- Reviewer Feedback Implementation ---
 
@@ -554,23 +566,24 @@ print("-" * 50)
 
 # Show an informative slice: The Top 5 and Bottom 5 reorder rates
 print("Informative Slice: Top 5 and Bottom 5 Products by Reorder Rate")
-informative_slice = pd.concat([reorder_rate_df.head(5), reorder_rate_df.tail(5)])
+# top_k() and bottom_k() select rows without a full sort, ties go to the lower product_id
+# The bottom 5 are reversed so the whole slice reads from the highest rate to the lowest
+top_5_rates = top_k(product_stats['reorder_rate'], 5)
+bottom_5_rates = bottom_k(product_stats['reorder_rate'], 5).iloc[::-1]
+informative_slice = named_series(pd.concat([top_5_rates, bottom_5_rates]).to_frame(), 'reorder_rate',
+                                 products).reset_index()
 display(informative_slice)
 
 """
 For each customer, what proportion of their products ordered are reorders?
 """
-# Merge order_products with orders to bring in customer_id and order_timing
-order_customer_info = order_products.merge(orders, on='order_id')
-
-# Group the data by user_id
-user_groups = order_customer_info.groupby('user_id')
-
 # Calculate the average reorder rate for each user
-user_reorder_rate = user_groups['reordered'].mean()
+# user_index already links every item to its customer, so no merge with orders is needed
+user_reorder_rate = user_index.reorder_rate()
 
-# Sort the customers by their reorder rate in descending order
-user_reorder_sorted = user_reorder_rate.sort_values(ascending=False)
+# Rank every customer by reorder rate in descending order, the full table is shown
+# Ranking through top_k() breaks ties by the lower user_id, like the product reports
+user_reorder_sorted = top_k(user_reorder_rate, len(user_reorder_rate))
 
 # Convert the Series into a clean DataFrame
 user_reorder_df = user_reorder_sorted.reset_index()
@@ -584,23 +597,18 @@ user_reorder_df
 """
 What are the top 20 items that people put in their carts first?
 """
-# Combine the two datasets on the common 'product_id' column
-order_products_named = order_products.merge(products, on='product_id')
-
-# Create a DataFrame containing only the first item added to each cart
-first_items = order_products_named[order_products_named['add_to_cart_order'] == 1]
-
-# Group by product and count how many times each was the first item added
-first_item_counts = first_items.groupby(['product_id', 'product_name']).size()
+# How many times each product was the first item added is counted in product_stats
 
 # Calculate the total occurrences for each product being the first added
-first_item_counts = first_items.groupby(['product_id', 'product_name']).size()
+first_item_counts = product_stats['first_in_cart_count']
 
-# Sort the products by first-in-cart frequency from highest to lowest
-first_item_counts_sorted = first_item_counts.sort_values(ascending=False)
+# Products that were never the first item are left out, like a filter on add_to_cart_order == 1 would
+first_item_counts = first_item_counts[first_item_counts > 0]
 
-# Extract the top 20 products most likely to be added to the cart first
-top_20_first_items = first_item_counts_sorted.head(20)
+# Extract the top 20 products most likely to be added to the cart first, highest first
+# Ties go to the lower product_id; names are only looked up for these 20 rows
+top_20_first_items = named_series(top_k(first_item_counts, 20).to_frame(), 'first_in_cart_count',
+                                  products).rename(None)
 
 # Display the top 20 results
 print(top_20_first_items)
@@ -614,3 +622,16 @@ and most reordered item types. It could simply be that the app prioritizes popul
 first suggested purchases, so it happens to be more convenient for customers to place these
 items in their cart first.
 """
+
+"""
+Which products are bought together in the same basket?
+"""
+# For every product, find the 5 products that most often land in the same order
+# The pair counts come from a sparse order x product matrix, so we never join order_products with itself
+# Products that appear in fewer than 100 orders are skipped, there is too little data to say anything about them
+co_purchase_pairs = co_purchases(order_products, k=5, min_support=100)
+
+# Show the partners of the 5 most popular products, with names
+# lift > 1 means two products are bought together more often than if customers picked them independently
+top_5_product_ids = top_20_df['product_id'].head(5)
+print(name_pairs(co_purchase_pairs[co_purchase_pairs['product_id'].isin(top_5_product_ids)], products))
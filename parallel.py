@@ -0,0 +1,225 @@
+"""
+Multi-core execution of the analysis aggregations.
+
+order_products is split into independent work units, at least one per
+worker: the row groups of its Parquet cache (split further into row slices
+when there are fewer row groups than workers), or byte ranges of whole rows of
+the CSV file when there is no cache (see parallel_csv.py). Every worker
+process reads its own unit from disk, so no DataFrame is pickled to the workers, and folds it into
+streaming.PartialAggregates. The join with orders (for the per-user reorder
+rate) goes through the order_id -> user_id array, which the parent writes to
+disk once and every worker memory-maps.
+
+Workers send back only the nonzero entries of their counters (ids and
+values), so what crosses process boundaries and what the parent merges is
+proportional to the rows of each unit, not to the largest id. The parent adds
+them into counters it allocated once. The small orders aggregations (hour, day
+of week, days since prior order, orders per user) are counted in the parent.
+All the aggregations in the script are counts or sums, so merging the units
+gives exactly the serial result.
+
+    python parallel.py --data-dir /datasets --workers 32 --check
+    python parallel.py --data-dir /datasets --scaling      # time 1, 2, 4, ... workers
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from cleaning import clean_order_products, clean_orders, clean_products
+from parallel_csv import DEFAULT_CHUNK_BYTES, byte_ranges, detect_layout, parse_range
+from product_metrics import product_metrics
+from streaming import ORDER_PRODUCTS_COLUMNS, PartialAggregates, order_user_map
+
+RESULTS = (
+    'hourly_counts',
+    'dow_counts',
+    'days_since_prior_counts',
+    'orders_per_user',
+    'items_per_order',
+    'product_metrics',
+    'user_reorder_rate',
+)
+
+
+def _row_slices(group_rows, workers):
+    # (group, start, stop) for every row group, split into slices of total // workers rows
+    # when there are fewer groups than workers, so that every worker gets a unit
+    if len(group_rows) >= workers:
+        return [(group, 0, rows) for group, rows in enumerate(group_rows)]
+    step = max(1, sum(group_rows) // workers)
+    return [(group, start, min(start + step, rows))
+            for group, rows in enumerate(group_rows) for start in range(0, rows, step)]
+
+
+def work_units(data_dir=data_loader.DATA_DIR, cache_dir=data_loader.CACHE_DIR, chunk_bytes=DEFAULT_CHUNK_BYTES,
+               workers=1):
+    """
+    Split order_products into units a worker can read on its own.
+
+    One unit per row group of the Parquet cache when it exists, otherwise one
+    per byte range of about `chunk_bytes` of the CSV file. With fewer row
+    groups than `workers`, the row groups are split into row slices so there
+    are at least `workers` units (given that many rows); byte ranges are
+    capped at 1 / `workers` of the file.
+    """
+    path = data_loader.cache_path('order_products', data_dir, cache_dir)
+    if os.path.exists(path):
+        import pyarrow.parquet as pq
+        metadata = pq.ParquetFile(path).metadata
+        group_rows = [metadata.row_group(group).num_rows for group in range(metadata.num_row_groups)]
+        return [('parquet', path, group, start, stop) for group, start, stop in _row_slices(group_rows, workers)]
+    source = data_loader.source_path('order_products', data_dir)
+    names, skip = detect_layout(source)
+    chunk_bytes = max(1, min(chunk_bytes, os.path.getsize(source) // workers))
+    return [('csv', source, start, end, names, skip) for start, end in byte_ranges(source, chunk_bytes)]
+
+
+def read_unit(unit):
+    """Read the order_products rows of one work unit."""
+    if unit[0] == 'parquet':
+        import pyarrow.parquet as pq
+        _, path, group, start, stop = unit
+        table = pq.ParquetFile(path).read_row_group(group, columns=ORDER_PRODUCTS_COLUMNS)
+        return table.slice(start, stop - start).to_pandas()
+    _, path, start, end, names, skip = unit
+    return parse_range(path, start, end, names, skip, data_loader.SCHEMAS['order_products']['dtypes'],
+                       ORDER_PRODUCTS_COLUMNS)
+
+
+def _aggregate_unit(unit, order_users_path):
+    # Runs in a worker process: read one unit, count it, send back the nonzero entries only
+    order_users = np.load(order_users_path, mmap_mode='r')
+    aggregates = PartialAggregates(order_users).add_batch(read_unit(unit))
+    compact = {}
+    for name, counter in aggregates.counters.items():
+        ids = np.flatnonzero(counter)
+        compact[name] = (ids, counter[ids])
+    return compact
+
+
+def results_from_aggregates(aggregates, products):
+    """Turn merged PartialAggregates into the same named results as serial_results()."""
+    return {
+        'hourly_counts': aggregates.hourly_counts(),
+        'dow_counts': aggregates.dow_counts(),
+        'days_since_prior_counts': aggregates.days_since_prior_counts(),
+        'orders_per_user': aggregates.orders_per_user(),
+        'items_per_order': aggregates.items_per_order(),
+        'product_metrics': aggregates.product_metrics(products),
+        'user_reorder_rate': aggregates.user_reorder_rate(),
+    }
+
+
+def parallel_results(orders, products, data_dir=data_loader.DATA_DIR, cache_dir=data_loader.CACHE_DIR, workers=None,
+                     chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Compute every aggregation, reading order_products on `workers` processes (default: all cores).
+
+    orders and products must already be cleaned; order_products is read from
+    `data_dir` (through the Parquet cache in `cache_dir` when it exists).
+    """
+    workers = workers or os.cpu_count() or 1
+    order_users = order_user_map(orders)
+    sizes = {'order_id': len(order_users),
+             'user_id': int(orders['user_id'].max()) + 1 if len(orders) else 0,
+             'product_id': int(products['product_id'].max()) + 1 if len(products) else 0}
+    # The parent never joins anything itself, it only merges the workers' counters
+    merged = PartialAggregates(np.zeros(0, dtype=np.int64), sizes=sizes)
+    merged.add_orders(orders)
+
+    units = work_units(data_dir, cache_dir, chunk_bytes, workers)
+    with tempfile.TemporaryDirectory() as tmp:
+        order_users_path = os.path.join(tmp, 'order_users.npy')
+        np.save(order_users_path, order_users)
+        if workers == 1:
+            for unit in units:
+                merged.add_compact(_aggregate_unit(unit, order_users_path))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_aggregate_unit, unit, order_users_path) for unit in units]
+                for future in futures:
+                    merged.add_compact(future.result())
+    return results_from_aggregates(merged, products)
+
+
+def serial_results(orders, order_products, products):
+    """The same aggregations written the way instacart_analysis.py does them, in one process."""
+    return {
+        'hourly_counts': orders['order_hour_of_day'].value_counts().sort_index(),
+        'dow_counts': orders['order_dow'].value_counts().sort_index(),
+        'days_since_prior_counts': orders['days_since_prior_order'].value_counts().sort_index(),
+        'orders_per_user': orders.groupby('user_id')['order_id'].count(),
+        'items_per_order': order_products.groupby('order_id')['product_id'].count(),
+        'product_metrics': product_metrics(order_products, products),
+        'user_reorder_rate': order_products.merge(orders, on='order_id').groupby('user_id')['reordered'].mean(),
+    }
+
+
+def check_against_serial(results, expected):
+    """
+    Raise AssertionError if any parallel result differs from the serial one.
+
+    Counts have to match exactly; reorder rates are compared exactly too,
+    because both paths divide the same integer sums.
+    """
+    for name in RESULTS:
+        left, right = results[name], expected[name]
+        if isinstance(left, pd.DataFrame):
+            pd.testing.assert_frame_equal(left, right, check_exact=True, obj=name)
+        else:
+            pd.testing.assert_series_equal(left, right, check_exact=True, obj=name)
+
+
+def scaling(orders, products, data_dir=data_loader.DATA_DIR, cache_dir=data_loader.CACHE_DIR, max_workers=None):
+    """Time parallel_results() with 1, 2, 4, ... workers; returns a DataFrame of seconds and speedup."""
+    max_workers = max_workers or os.cpu_count() or 1
+    counts = sorted({min(2 ** i, max_workers) for i in range(max_workers.bit_length() + 1)})
+    seconds = []
+    for workers in counts:
+        start = time.perf_counter()
+        parallel_results(orders, products, data_dir, cache_dir, workers)
+        seconds.append(time.perf_counter() - start)
+    timings = pd.DataFrame({'seconds': seconds}, index=pd.Index(counts, name='workers'))
+    timings['speedup'] = timings['seconds'].iloc[0] / timings['seconds']
+    timings['efficiency'] = timings['speedup'] / timings.index
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the analysis aggregations on several cores.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--check', action='store_true', help='also run the serial path and compare')
+    parser.add_argument('--scaling', action='store_true', help='time 1, 2, 4, ... up to --workers processes')
+    args = parser.parse_args()
+
+    orders = clean_orders(data_loader.load_table('orders', data_dir=args.data_dir))
+    products = clean_products(data_loader.load_table('products', data_dir=args.data_dir))
+    # Makes sure the Parquet cache exists, so the workers read row groups instead of parsing CSV
+    data_loader.load_table('order_products', columns=['order_id'], data_dir=args.data_dir)
+
+    if args.scaling:
+        print(scaling(orders, products, args.data_dir, max_workers=args.workers))
+        return
+
+    results = parallel_results(orders, products, args.data_dir, workers=args.workers)
+    for name in RESULTS:
+        print(f'{name}:')
+        print(results[name])
+        print()
+
+    if args.check:
+        order_products = clean_order_products(data_loader.load_table('order_products', data_dir=args.data_dir))
+        check_against_serial(results, serial_results(orders, order_products, products))
+        print('Parallel results match the serial path.')
+
+
+if __name__ == '__main__':
+    main()
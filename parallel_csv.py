@@ -0,0 +1,149 @@
+"""
+Parallel parsing of the semicolon-separated files by byte ranges.
+
+A file is split into chunks of about `chunk_bytes` whose boundaries are moved
+forward to the next newline, so every chunk holds whole rows. Each chunk is
+parsed on its own with the declared dtypes and no type inference, in a pool
+of processes, and the parts are concatenated in file order.
+
+The header is checked before parsing. products.csv is known to have data
+rows with one more field than the header: a leading row index without a
+header name, which makes read_csv shift every column left (the index ends up
+labeled product_id and department_id has no header). When the data rows have
+exactly one field more than the header, that leading field is skipped while
+parsing, so the columns come out under the right names.
+
+Integer columns are parsed as 64-bit integers and narrowed to their declared
+width afterwards, with a range check: read_csv with a narrow dtype wraps
+out-of-range values silently (266 becomes 10 in an int8 column), which would
+corrupt every count downstream. A value that does not fit raises ValueError.
+
+Rows must not contain quoted newlines, since chunk boundaries are found by
+looking for newline bytes. None of the Instacart files have them.
+"""
+
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_BYTES = 32 * 2**20
+
+# Narrow integer dtypes and the 64-bit dtype they are parsed with (nullable ones stay nullable)
+WIDE_DTYPES = {
+    'int8': 'int64', 'int16': 'int64', 'int32': 'int64',
+    'Int8': 'Int64', 'Int16': 'Int64', 'Int32': 'Int64',
+}
+
+
+def _fields(line):
+    return next(iter(pd.read_csv(io.BytesIO(line), sep=';', header=None, dtype=str).itertuples(index=False)))
+
+
+def detect_layout(path):
+    """
+    Return (header names, number of leading fields to skip) for a file.
+
+    The skip is 1 when the first data row has one field more than the header
+    (an unnamed leading index column) and 0 when they match.
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        first_row = f.readline()
+    names = list(_fields(header))
+    if not first_row.strip():
+        return names, 0
+    extra = len(_fields(first_row)) - len(names)
+    if extra not in (0, 1):
+        raise ValueError(f'{path}: the header has {len(names)} fields but the first row has {len(names) + extra}')
+    return names, extra
+
+
+def wide_dtype(dtype):
+    """The 64-bit dtype a declared integer dtype is parsed with; other dtypes are returned unchanged."""
+    return WIDE_DTYPES.get(str(dtype), dtype)
+
+
+def downcast(df, dtypes, source=''):
+    """
+    Cast the columns of `df` to `dtypes`, checking that integers fit first.
+
+    Raises ValueError naming the column when a value is outside the range of
+    its declared integer dtype, where astype() alone would wrap it around.
+    """
+    columns = {}
+    for column in df.columns:
+        dtype = dtypes[column]
+        if str(dtype) in WIDE_DTYPES and len(df):
+            limits = np.iinfo(str(dtype).lower())
+            low, high = df[column].min(), df[column].max()
+            if (pd.notna(low) and low < limits.min) or (pd.notna(high) and high > limits.max):
+                raise ValueError(f'{source}: {column} has values in [{low}, {high}], '
+                                 f'outside the {dtype} range [{limits.min}, {limits.max}]')
+        columns[column] = df[column].astype(dtype)
+    return pd.DataFrame(columns, index=df.index)
+
+
+def byte_ranges(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Split the data rows of a file (after the header) into (start, end) byte ranges of whole rows."""
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        f.readline()
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            # Move the boundary past the end of the row it landed in
+            if f.tell() < size:
+                f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_range(path, start, end, names, skip, dtypes, columns):
+    """Parse the whole rows in bytes [start, end) of a file laid out as detect_layout() reported."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # The skipped leading fields get placeholder names and are left out by usecols
+    all_names = [f'_skip{i}' for i in range(skip)] + names
+    parsed = pd.read_csv(
+        io.BytesIO(data),
+        sep=';',
+        header=None,
+        names=all_names,
+        usecols=columns,
+        dtype={column: wide_dtype(dtypes[column]) for column in columns},
+    )
+    return downcast(parsed, dtypes, path)
+
+
+def read_csv(path, dtypes, columns=None, workers=None, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """
+    Parse a semicolon-separated file with the declared `dtypes`, in parallel.
+
+    Reads only `columns` if given (all declared columns otherwise). Files that
+    fit in one chunk are parsed in this process.
+    """
+    names, skip = detect_layout(path)
+    missing = set(dtypes) - set(names)
+    if missing:
+        raise ValueError(f'{path}: declared columns {sorted(missing)} are not in the header {names}')
+    columns = [name for name in names if name in dtypes] if columns is None else list(columns)
+
+    ranges = byte_ranges(path, chunk_bytes)
+    if len(ranges) <= 1:
+        parts = [parse_range(path, start, end, names, skip, dtypes, columns) for start, end in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(parse_range, path, start, end, names, skip, dtypes, columns)
+                       for start, end in ranges]
+            parts = [future.result() for future in futures]
+
+    if not parts:
+        return pd.DataFrame({column: pd.Series(dtype=dtypes[column]) for column in columns})
+    return pd.concat(parts, ignore_index=True)[columns]
@@ -0,0 +1,341 @@
+"""
+The analysis of instacart_analysis.py as a lazy DAG of named nodes.
+
+    raw tables -> cleaned tables -> aggregates -> reports
+
+Every node lists the nodes it reads (NODES below). Asking a Pipeline for a
+report evaluates only the nodes that report needs. Every computed node is
+saved to disk under a key made from its code (the node function, the helpers
+of this module it calls and the source of every local module they use) and
+the keys of its inputs; the raw tables' keys come from their CSV file's
+resolved path, size and modification time and the code that parses them
+(data_loader.py and the modules it uses). A rerun loads every node whose key
+did not change, so after editing one report only that report is recomputed,
+and its inputs are read back from the store. Stored results are also tagged
+with the source files they derive from, so runs on different data
+directories keep their own results side by side.
+
+Computed nodes run under a StageProfiler, so the run report shows the time,
+memory and row counts of each one.
+
+    python pipeline.py top_20_products orders_per_customer
+    python pipeline.py --all --report run.json --deep-dive product_stats
+    python pipeline.py --list
+"""
+
+import argparse
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import types
+
+import pandas as pd
+
+import data_loader
+from basket_pairs import co_purchases, name_pairs
+from cleaning import clean_order_products, clean_orders, clean_products
+from dedup import find_duplicates
+from product_metrics import attach_product_names, product_metrics, product_time_counts, top_products
+from profiling import StageProfiler
+from reorder_cycles import product_cycles, user_product_cycles
+from time_cube import OrderTimeCube
+from topk import bottom_k, top_k
+from user_index import UserOrderIndex
+
+STORE_DIR = os.path.join(data_loader.CACHE_DIR, 'pipeline')
+
+# Raw table nodes: node name -> table name in data_loader.SCHEMAS
+SOURCES = {f'raw_{table}': table for table in data_loader.SCHEMAS}
+
+
+def _orders_duplicates(orders):
+    return find_duplicates(orders, key='order_id').summary()
+
+
+def _products_duplicates(products):
+    return find_duplicates(products, key='product_id', name_column='product_name').summary()
+
+
+def _wednesday_vs_saturday(cube):
+    hours = pd.concat([cube.marginal('order_hour_of_day', order_dow=3),
+                       cube.marginal('order_hour_of_day', order_dow=6)], axis=1, keys=['Wednesday', 'Saturday'])
+    return hours.fillna(0)
+
+
+def _order_size_distribution(order_products):
+    return order_products.groupby('order_id')['product_id'].count().value_counts().sort_index()
+
+
+def _reorder_rate_extremes(stats, products):
+    # Top 5 and bottom 5 products by reorder rate, from the highest rate to the lowest
+    rates = pd.concat([top_k(stats['reorder_rate'], 5), bottom_k(stats['reorder_rate'], 5).iloc[::-1]])
+    return attach_product_names(rates.to_frame(), products)
+
+
+def _user_reorder_extremes(index):
+    rate = index.reorder_rate()
+    extremes = pd.concat([top_k(rate, 5), bottom_k(rate, 5).iloc[::-1]]).reset_index()
+    extremes.columns = ['user_id', 'user_reorder_rate']
+    return extremes
+
+
+def _top_co_purchases(order_products, top_20, products):
+    # The 5 most frequent partners of the 5 most popular products
+    pairs = co_purchases(order_products, k=5, min_support=100)
+    return name_pairs(pairs[pairs['product_id'].isin(top_20['product_id'].head(5))], products)
+
+
+# Node name -> (function, input nodes); the function is called with the input values in order
+NODES = {
+    'orders': (clean_orders, ('raw_orders',)),
+    'products': (clean_products, ('raw_products',)),
+    'order_products': (clean_order_products, ('raw_order_products',)),
+
+    'time_cube': (OrderTimeCube.from_orders, ('orders',)),
+    'user_index': (UserOrderIndex.build, ('orders', 'order_products')),
+    'product_stats': (product_metrics, ('order_products', 'products')),
+    'product_time_counts': (product_time_counts, ('orders', 'order_products')),
+    'reorder_cycles': (user_product_cycles, ('orders', 'order_products')),
+    'product_cycles': (product_cycles, ('reorder_cycles',)),
+
+    # The duplicate checks the script runs on the raw tables before cleaning them
+    'orders_duplicates': (_orders_duplicates, ('raw_orders',)),
+    'products_duplicates': (_products_duplicates, ('raw_products',)),
+
+    'orders_by_hour': (lambda cube: cube.marginal('order_hour_of_day'), ('time_cube',)),
+    'orders_by_dow': (lambda cube: cube.marginal('order_dow'), ('time_cube',)),
+    'days_since_prior_order': (lambda cube: cube.marginal('days_since_prior_order'), ('time_cube',)),
+    'wednesday_vs_saturday': (_wednesday_vs_saturday, ('time_cube',)),
+    'orders_per_customer': (UserOrderIndex.order_counts, ('user_index',)),
+    'top_20_products': (lambda stats, products: top_products(stats, 'order_count', products),
+                        ('product_stats', 'products')),
+    'order_size_distribution': (_order_size_distribution, ('order_products',)),
+    'top_20_reordered': (lambda stats, products: top_products(stats, 'reorder_count', products),
+                         ('product_stats', 'products')),
+    'reorder_rate_extremes': (_reorder_rate_extremes, ('product_stats', 'products')),
+    'user_reorder_extremes': (_user_reorder_extremes, ('user_index',)),
+    'top_20_first_in_cart': (lambda stats, products: top_products(stats, 'first_in_cart_count', products),
+                             ('product_stats', 'products')),
+    'top_co_purchases': (_top_co_purchases, ('order_products', 'top_20_products', 'products')),
+}
+
+# The outputs of the analysis, in the order the script shows them
+REPORTS = (
+    'orders_duplicates', 'products_duplicates', 'orders_by_hour', 'orders_by_dow', 'days_since_prior_order', 'wednesday_vs_saturday',
+    'orders_per_customer', 'top_20_products', 'order_size_distribution', 'top_20_reordered',
+    'reorder_rate_extremes', 'user_reorder_extremes', 'top_20_first_in_cart', 'top_co_purchases',
+)
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _local_module(value):
+    # The module of this repository that defines `value`, if any. This module itself
+    # is left out, its functions are followed one by one (see code_fingerprint()).
+    module = value if isinstance(value, types.ModuleType) else sys.modules.get(getattr(value, '__module__', None))
+    path = getattr(module, '__file__', None)
+    if module is not sys.modules[__name__] and path and os.path.dirname(os.path.abspath(path)) == _REPO_DIR:
+        return module
+    return None
+
+
+def _global_names(code):
+    # Global names used by a code object and by the lambdas and functions nested in it
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names |= _global_names(constant)
+    return names
+
+
+def code_fingerprint(function):
+    """
+    Hash of a function's source, of the helpers of this module it uses and of every local module it depends on.
+
+    Helpers defined in pipeline.py are hashed by their own source and followed
+    through the names they use in turn. Modules are followed through the names
+    they import, so editing topk.py also changes the fingerprint of nodes that
+    only use it through product_metrics.py.
+    """
+    digest = hashlib.sha256()
+    pending_functions = [function]
+    hashed = set()
+    pending = []
+    while pending_functions:
+        function = inspect.unwrap(pending_functions.pop())
+        code = getattr(function, '__code__', None)
+        if code is None or code in hashed:
+            continue
+        hashed.add(code)
+        digest.update(inspect.getsource(function).encode())
+        namespace = getattr(function, '__globals__', None) or vars(sys.modules[function.__module__])
+        for name in sorted(_global_names(code)):
+            value = namespace.get(name)
+            if isinstance(value, types.FunctionType) and value.__module__ == __name__:
+                pending_functions.append(value)
+            else:
+                pending.append(_local_module(value))
+        pending.append(_local_module(function))
+
+    seen = set()
+    while pending:
+        module = pending.pop()
+        if module is None or module.__name__ in seen:
+            continue
+        seen.add(module.__name__)
+        pending.extend(_local_module(value) for value in vars(module).values())
+    for name in sorted(seen):
+        with open(sys.modules[name].__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _rows(value):
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+class Pipeline:
+    """
+    Lazily evaluated analysis nodes with a persistent store of computed results.
+
+    persist=False keeps results in memory only (nothing is read from or written
+    to `store_dir`), which is what the benchmark uses.
+    """
+
+    def __init__(self, data_dir=data_loader.DATA_DIR, cache_dir=data_loader.CACHE_DIR, store_dir=STORE_DIR,
+                 persist=True, profiler=None):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.store_dir = store_dir
+        self.persist = persist
+        self.profiler = profiler if profiler is not None else StageProfiler(trace_memory=False)
+        self.values = {}
+        self.keys = {}
+        self.sources = {}
+        self.computed = []
+        self.loaded = []
+
+    def key(self, name):
+        """The cache key of a node: its code and the keys of its inputs, without evaluating anything."""
+        if name not in self.keys:
+            digest = hashlib.sha256(name.encode())
+            if name in SOURCES:
+                path = data_loader.source_path(SOURCES[name], self.data_dir)
+                stat = os.stat(path)
+                digest.update(f'{os.path.abspath(path)}-{data_loader.CACHE_VERSION}-'
+                              f'{stat.st_size}-{stat.st_mtime_ns}'.encode())
+                # The parsing code (data_loader.py, parallel_csv.py, ...) shapes the raw tables too
+                digest.update(code_fingerprint(data_loader.load_table).encode())
+            else:
+                function, inputs = NODES[name]
+                digest.update(code_fingerprint(function).encode())
+                for dependency in inputs:
+                    digest.update(self.key(dependency).encode())
+            self.keys[name] = digest.hexdigest()
+        return self.keys[name]
+
+    def source(self, name):
+        """Short hash of the source files a node derives from (their paths, not their contents)."""
+        if name not in self.sources:
+            if name in SOURCES:
+                self.sources[name] = data_loader.source_id(SOURCES[name], self.data_dir)
+            else:
+                inputs = sorted({self.source(dependency) for dependency in NODES[name][1]})
+                self.sources[name] = hashlib.sha256(' '.join(inputs).encode()).hexdigest()[:12]
+        return self.sources[name]
+
+    def _store_prefix(self, name):
+        return f'{name}-{self.source(name)}-'
+
+    def _store_path(self, name):
+        return os.path.join(self.store_dir, f'{self._store_prefix(name)}{self.key(name)[:20]}.pkl')
+
+    def _save(self, name, value):
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = self._store_path(name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        # Results of older versions of the node on the same source files are never read again;
+        # results computed from other data directories are kept
+        prefix = self._store_prefix(name)
+        for entry in os.listdir(self.store_dir):
+            if entry.startswith(prefix) and entry.endswith('.pkl') and os.path.join(self.store_dir, entry) != path:
+                os.remove(os.path.join(self.store_dir, entry))
+
+    def get(self, name):
+        """Return the value of a node, loading or computing it and whatever it needs."""
+        if name in self.values:
+            return self.values[name]
+        if name not in SOURCES and name not in NODES:
+            raise KeyError(f'Unknown node {name!r}, expected one of {sorted(set(SOURCES) | set(NODES))}')
+
+        if name in SOURCES:
+            # data_loader keeps its own Parquet cache of the raw tables
+            with self.profiler.stage(name) as record:
+                value = data_loader.load_table(SOURCES[name], data_dir=self.data_dir, cache_dir=self.cache_dir)
+                record.rows_out = len(value)
+        elif self.persist and os.path.exists(self._store_path(name)):
+            with self.profiler.stage(f'{name} (stored)') as record:
+                with open(self._store_path(name), 'rb') as f:
+                    value = pickle.load(f)
+                record.rows_out = _rows(value)
+            self.loaded.append(name)
+        else:
+            function, inputs = NODES[name]
+            arguments = [self.get(dependency) for dependency in inputs]
+            with self.profiler.stage(name) as record:
+                value = function(*arguments)
+                known = [_rows(argument) for argument in arguments if _rows(argument) is not None]
+                record.rows_in = sum(known) if known else None
+                record.rows_out = _rows(value)
+            if self.persist:
+                self._save(name, value)
+            self.computed.append(name)
+
+        self.values[name] = value
+        return value
+
+    def evaluate(self, names=REPORTS):
+        """Return a dict of node name -> value for the requested nodes."""
+        return {name: self.get(name) for name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate analysis reports, recomputing only what changed.')
+    parser.add_argument('nodes', nargs='*', help='nodes to evaluate (see --list)')
+    parser.add_argument('--all', action='store_true', help='evaluate every report')
+    parser.add_argument('--list', action='store_true', help='list the nodes and their inputs')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    parser.add_argument('--no-store', action='store_true', help='compute everything and save nothing')
+    parser.add_argument('--report', help='write the run report to this JSON file')
+    parser.add_argument('--deep-dive', help='also run cProfile and allocation tracking on this node')
+    parser.add_argument('--trace-memory', action='store_true', help='record heap use of every node (slower)')
+    args = parser.parse_args()
+
+    if args.list:
+        for name in SOURCES:
+            print(name)
+        for name, (_, inputs) in NODES.items():
+            print(f'{name:<25}<- {", ".join(inputs)}')
+        return
+
+    profiler = StageProfiler(trace_memory=args.trace_memory, deep_dive=args.deep_dive)
+    pipeline = Pipeline(args.data_dir, store_dir=args.store_dir, persist=not args.no_store, profiler=profiler)
+    for name, value in pipeline.evaluate(REPORTS if args.all or not args.nodes else args.nodes).items():
+        print(f'\n{name}')
+        print(value)
+
+    print(f'\ncomputed: {", ".join(pipeline.computed) or "-"}')
+    print(f'loaded from the store: {", ".join(pipeline.loaded) or "-"}\n')
+    print(profiler.summary())
+    if args.report:
+        profiler.save(args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Fast previews of the report metrics on a sample of customers.
+
+A fraction of the customers is sampled, stratified by how many orders they
+placed (so light and heavy shoppers keep their share), and all orders and
+order_products rows of the sampled customers are kept. The sample goes
+through the usual cleaning and is saved as Parquet, so later previews with
+the same fraction and seed start from it directly.
+
+Every metric comes with a bootstrap confidence interval. Customers are the
+sampling unit, so each bootstrap replicate resamples customers (within their
+stratum) with replacement. Every metric is a sum over customers, so a
+replicate is a matrix product of the replicate weights with a sparse
+customers x categories count matrix; no replicate ever touches the rows.
+
+    python preview.py --data-dir /datasets --fraction 0.01 --bootstrap 200
+"""
+
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import data_loader
+from cleaning import clean_order_products, clean_orders, clean_products
+from enrichment import lookup_positions, product_positions
+from product_metrics import attach_product_names
+from topk import top_k
+
+SAMPLE_DIR = os.path.join(data_loader.CACHE_DIR, 'preview')
+
+# Strata by number of orders per customer: 1-3, 4-9, 10-19, 20-39, 40+
+STRATA_EDGES = (4, 10, 20, 40)
+
+
+def sample_users(orders, fraction, seed=0):
+    """
+    Pick `fraction` of the customers in every orders-per-customer stratum.
+
+    Every non-empty stratum keeps at least one customer. Returns the sorted
+    user_ids and the stratum of each.
+    """
+    per_user = np.bincount(orders['user_id'].to_numpy())
+    user_ids = np.flatnonzero(per_user)
+    strata = np.digitize(per_user[user_ids], STRATA_EDGES)
+    rng = np.random.default_rng(seed)
+
+    picked = []
+    for stratum in np.unique(strata):
+        members = user_ids[strata == stratum]
+        size = max(1, int(round(len(members) * fraction)))
+        picked.append(rng.choice(members, size, replace=False))
+    picked = np.sort(np.concatenate(picked)) if picked else np.array([], dtype=np.int64)
+    return picked, np.digitize(per_user[picked], STRATA_EDGES)
+
+
+def _sample_key(fraction, seed, data_dir, cache_dir):
+    # Changes whenever one of the source files (its absolute path, size or modification time)
+    # or the sampling parameters change
+    sources = [(os.path.abspath(data_loader.source_path(table, data_dir)),
+                os.path.basename(data_loader.cache_path(table, data_dir, cache_dir)))
+               for table in ('orders', 'order_products')]
+    return hashlib.sha256(repr((fraction, seed, STRATA_EDGES, sources)).encode()).hexdigest()[:20]
+
+
+def load_sample(fraction=0.01, seed=0, data_dir=data_loader.DATA_DIR, cache_dir=data_loader.CACHE_DIR,
+                sample_dir=SAMPLE_DIR):
+    """
+    Return the cleaned (orders, order_products) of the sampled customers.
+
+    The first call builds the sample from the full tables and saves it; later
+    calls with the same fraction, seed and source files read it back.
+    """
+    path = os.path.join(sample_dir, _sample_key(fraction, seed, data_dir, cache_dir))
+    if os.path.exists(os.path.join(path, 'order_products.parquet')):
+        return (pd.read_parquet(os.path.join(path, 'orders.parquet')),
+                pd.read_parquet(os.path.join(path, 'order_products.parquet')))
+
+    orders = clean_orders(data_loader.load_table('orders', data_dir=data_dir, cache_dir=cache_dir))
+    users, _ = sample_users(orders, fraction, seed)
+    in_sample = np.zeros(int(orders['user_id'].max()) + 1 if len(orders) else 0, dtype=bool)
+    in_sample[users] = True
+    orders = orders[in_sample[orders['user_id'].to_numpy()]].reset_index(drop=True)
+
+    order_products = data_loader.load_table('order_products', data_dir=data_dir, cache_dir=cache_dir)
+    order_ids = order_products['order_id'].to_numpy()
+    kept = np.zeros(max(int(order_ids.max()) + 1 if len(order_ids) else 0, int(orders['order_id'].max()) + 1),
+                    dtype=bool)
+    kept[orders['order_id'].to_numpy()] = True
+    order_products = clean_order_products(order_products[kept[order_ids]].reset_index(drop=True))
+
+    os.makedirs(path, exist_ok=True)
+    # order_products is written last, its presence marks a complete sample
+    orders.to_parquet(os.path.join(path, 'orders.parquet'), index=False)
+    order_products.to_parquet(os.path.join(path, 'order_products.parquet'), index=False)
+    return orders, order_products
+
+
+def replicate_weights(strata, n_replicates, seed=0):
+    """
+    Bootstrap weights, shape (n_replicates, n_users).
+
+    Weight [b, u] is how many times user u was drawn in replicate b; users are
+    drawn with replacement within their own stratum, keeping stratum sizes.
+    """
+    rng = np.random.default_rng(seed)
+    weights = np.zeros((n_replicates, len(strata)))
+    for stratum in np.unique(strata):
+        members = np.flatnonzero(strata == stratum)
+        weights[:, members] = rng.multinomial(len(members), np.full(len(members), 1 / len(members)), n_replicates)
+    return weights
+
+
+def _counts(user_codes, categories, n_users, values=None):
+    # Sparse users x categories matrix of row counts (or of summed `values`)
+    data = np.ones(len(user_codes)) if values is None else np.asarray(values, dtype=np.float64)
+    shape = (n_users, int(categories.max()) + 1 if len(categories) else 0)
+    return sp.csr_matrix((data, (user_codes, categories)), shape=shape)
+
+
+def _totals(weights, matrix):
+    # Weighted column sums for every replicate: (n_replicates, n_categories)
+    return np.asarray((matrix.T @ weights.T).T)
+
+
+def _interval(point, replicates, confidence, index):
+    tail = (1 - confidence) / 2 * 100
+    with np.errstate(invalid='ignore', divide='ignore'):
+        lower, upper = np.nanpercentile(replicates, [tail, 100 - tail], axis=0)
+    return pd.DataFrame({'estimate': point, 'lower': lower, 'upper': upper}, index=index)
+
+
+def _shares(weights, matrix, confidence, index_name, keep=None):
+    # Share of each category in the total, with its interval
+    point = np.asarray(matrix.sum(axis=0)).ravel()
+    replicates = _totals(weights, matrix)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        point = point / point.sum()
+        replicates = replicates / replicates.sum(axis=1, keepdims=True)
+    keep = np.flatnonzero(point) if keep is None else keep
+    return _interval(point[keep], replicates[:, keep], confidence, pd.Index(keep, name=index_name))
+
+
+def _ratio(weights, numerator, denominator, confidence, index):
+    # Ratio of two weighted sums (e.g. reorders / items), with its interval;
+    # a one-column denominator divides every numerator column
+    with np.errstate(invalid='ignore', divide='ignore'):
+        point = np.asarray(numerator.sum(axis=0)).ravel() / np.asarray(denominator.sum(axis=0)).ravel()
+        replicates = _totals(weights, numerator) / _totals(weights, denominator)
+    return _interval(point, replicates, confidence, index)
+
+
+def preview_metrics(orders, order_products, products, strata, n_replicates=200, confidence=0.95, top_n=20, seed=0):
+    """
+    Compute the report metrics on a sample, each as estimate / lower / upper.
+
+    `strata` holds the stratum of every sampled user, in sorted user_id order
+    (as returned by sample_users()). Returns a dict of DataFrames.
+    """
+    user_ids = np.unique(orders['user_id'].to_numpy())
+    n_users = len(user_ids)
+    weights = replicate_weights(strata, n_replicates, seed)
+    order_user = np.searchsorted(user_ids, orders['user_id'].to_numpy())
+
+    days = orders['days_since_prior_order'].to_numpy(dtype=np.float64, na_value=np.nan)
+    known_days = ~np.isnan(days)
+
+    # Items per order and the user of every item, through a dense order_id -> user map
+    order_ids = orders['order_id'].to_numpy()
+    user_of_order = np.full(int(order_ids.max()) + 1, -1, dtype=np.int64)
+    user_of_order[order_ids] = order_user
+    item_orders = order_products['order_id'].to_numpy()
+    item_user = user_of_order[item_orders]
+    basket_sizes = np.bincount(item_orders, minlength=len(user_of_order))[order_ids]
+    has_items = basket_sizes > 0
+
+    products_matrix = _counts(item_user, order_products['product_id'].to_numpy(), n_users)
+    reorders_matrix = _counts(item_user, order_products['product_id'].to_numpy(), n_users,
+                              order_products['reordered'].to_numpy())
+    zeros = np.zeros(len(item_user), dtype=np.int64)
+    items = _counts(item_user, zeros, n_users)
+    reorders = _counts(item_user, zeros, n_users, order_products['reordered'].to_numpy())
+
+    # Top products by the sample's point estimate; intervals only for those columns. Only
+    # products of the products table compete, attach_product_names() drops the others.
+    item_counts = pd.Series(np.asarray(products_matrix.sum(axis=0)).ravel())
+    candidates = np.flatnonzero(item_counts.to_numpy())
+    candidates = candidates[lookup_positions(product_positions(products), candidates) >= 0]
+    top = top_k(item_counts.iloc[candidates], top_n).index.to_numpy()
+    item_share = _ratio(weights, products_matrix[:, top], items, confidence, pd.Index(top, name='product_id'))
+
+    return {
+        'hourly_share': _shares(weights, _counts(order_user, orders['order_hour_of_day'].to_numpy(), n_users),
+                                confidence, 'order_hour_of_day'),
+        'dow_share': _shares(weights, _counts(order_user, orders['order_dow'].to_numpy(), n_users),
+                             confidence, 'order_dow'),
+        'days_since_prior_share': _shares(weights, _counts(order_user[known_days],
+                                                           days[known_days].astype(np.int64), n_users),
+                                          confidence, 'days_since_prior_order'),
+        'basket_size_share': _shares(weights, _counts(order_user[has_items], basket_sizes[has_items], n_users),
+                                     confidence, 'basket_size'),
+        'top_products_item_share': attach_product_names(item_share, products),
+        'top_products_reorder_rate': attach_product_names(
+            _ratio(weights, reorders_matrix[:, top], products_matrix[:, top], confidence,
+                   pd.Index(top, name='product_id')), products),
+        'reorder_rate': _ratio(weights, reorders, items, confidence, pd.Index(['all'], name='items')),
+    }
+
+
+def preview(fraction=0.01, seed=0, n_replicates=200, confidence=0.95, data_dir=data_loader.DATA_DIR,
+            cache_dir=data_loader.CACHE_DIR, sample_dir=SAMPLE_DIR):
+    """Load (or build) the sample and compute its metrics with confidence intervals."""
+    orders, order_products = load_sample(fraction, seed, data_dir, cache_dir, sample_dir)
+    products = clean_products(data_loader.load_table('products', data_dir=data_dir, cache_dir=cache_dir))
+    per_user = np.bincount(orders['user_id'].to_numpy())
+    strata = np.digitize(per_user[np.flatnonzero(per_user)], STRATA_EDGES)
+    return preview_metrics(orders, order_products, products, strata, n_replicates, confidence, seed=seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Preview the report metrics on a sample of customers.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--fraction', type=float, default=0.01, help='share of customers to sample')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bootstrap', type=int, default=200, help='number of bootstrap replicates')
+    parser.add_argument('--confidence', type=float, default=0.95)
+    args = parser.parse_args()
+
+    metrics = preview(args.fraction, args.seed, args.bootstrap, args.confidence, args.data_dir)
+    for name, table in metrics.items():
+        print(f'{name}:')
+        print(table)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Single-pass per-product metrics.
+
+The popularity, reorder, reorder-rate and first-in-cart reports all count rows
+of order_products per product. Rather than filtering, merging and grouping once
+per report, all the counters are computed together with np.bincount over
+product_id, and product names are attached only to the rows that get reported.
+"""
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from enrichment import lookup_positions, product_positions
+from topk import top_k
+
+COUNTERS = ('order_count', 'reorder_count', 'first_in_cart_count')
+
+
+def _grow(counts, size):
+    # Pad a counter array with zeros so arrays from different batches line up
+    if len(counts) >= size:
+        return counts
+    return np.concatenate([counts, np.zeros(size - len(counts), dtype=counts.dtype)])
+
+
+def count_product_events(order_products, minlength=0):
+    """
+    Count rows, reorders and first-in-cart placements per product_id.
+
+    Returns a dict of int64 arrays indexed by product_id. Counters from separate
+    chunks of order_products can be combined with add_counters().
+    """
+    product_ids = order_products['product_id'].to_numpy()
+    reordered = order_products['reordered'].to_numpy(dtype=np.int64)
+    # add_to_cart_order is NA (or the 999 placeholder) for items past position 64,
+    # neither of which can be the first item in the cart
+    first_in_cart = order_products['add_to_cart_order'].to_numpy(dtype=np.int64, na_value=0) == 1
+
+    size = max(minlength, int(product_ids.max()) + 1 if len(product_ids) else 0)
+    return {
+        'order_count': np.bincount(product_ids, minlength=size),
+        'reorder_count': np.bincount(product_ids, weights=reordered, minlength=size).astype(np.int64),
+        'first_in_cart_count': np.bincount(product_ids[first_in_cart], minlength=size),
+    }
+
+
+def add_counters(left, right):
+    """Add two counter dicts together (arrays of different lengths are zero-padded)."""
+    result = {}
+    for name in left.keys() | right.keys():
+        a = left.get(name, np.zeros(0, dtype=np.int64))
+        b = right.get(name, np.zeros(0, dtype=np.int64))
+        size = max(len(a), len(b))
+        result[name] = _grow(a, size) + _grow(b, size)
+    return result
+
+
+def metrics_frame(counters, products=None):
+    """
+    Turn counter arrays into a DataFrame indexed by product_id.
+
+    Only products that were ordered at least once are included. If `products` is
+    given, products missing from it are dropped as well, the same way an inner
+    merge with the products table would drop them.
+    """
+    order_count = counters['order_count']
+    product_ids = np.flatnonzero(order_count)
+    if products is not None:
+        known = lookup_positions(product_positions(products), product_ids) >= 0
+        product_ids = product_ids[known]
+
+    # Counters filled batch by batch can end at different lengths; ids past one's end count zero
+    metrics = pd.DataFrame(
+        {name: _grow(counters[name], len(order_count))[product_ids] for name in COUNTERS},
+        index=pd.Index(product_ids, name='product_id'),
+    )
+    metrics['reorder_rate'] = metrics['reorder_count'] / metrics['order_count']
+    return metrics
+
+
+def product_time_counts(orders, order_products):
+    """
+    The counters of count_product_events() per product and order time.
+
+    Returns a dict of sparse matrices (CSC) of shape (max product_id + 1, 7 * 24),
+    where column order_dow * 24 + order_hour_of_day holds the counts of that
+    hour. Summing the columns of a few hours gives the counters restricted to
+    those hours, without going back to the item rows. Items of orders that are
+    not in `orders` are left out.
+    """
+    order_ids = orders['order_id'].to_numpy()
+    cell_of_order = np.full(int(order_ids.max()) + 1 if len(order_ids) else 0, -1, dtype=np.int64)
+    cell_of_order[order_ids] = (orders['order_dow'].to_numpy(dtype=np.int64) * 24
+                                + orders['order_hour_of_day'].to_numpy(dtype=np.int64))
+
+    item_orders = order_products['order_id'].to_numpy()
+    cells = np.full(len(item_orders), -1, dtype=np.int64)
+    in_range = item_orders < len(cell_of_order)
+    cells[in_range] = cell_of_order[item_orders[in_range]]
+    known = cells >= 0
+
+    product_ids = order_products['product_id'].to_numpy()[known].astype(np.int64)
+    cells = cells[known]
+    reordered = order_products['reordered'].to_numpy(dtype=np.int64)[known]
+    first_in_cart = order_products['add_to_cart_order'].to_numpy(dtype=np.int64, na_value=0)[known] == 1
+    shape = (int(product_ids.max()) + 1 if len(product_ids) else 0, 7 * 24)
+
+    def matrix(rows, columns, values):
+        return sp.csc_matrix((values, (rows, columns)), shape=shape, dtype=np.int64)
+
+    return {
+        'order_count': matrix(product_ids, cells, np.ones(len(cells), dtype=np.int64)),
+        'reorder_count': matrix(product_ids, cells, reordered),
+        'first_in_cart_count': matrix(product_ids[first_in_cart], cells[first_in_cart],
+                                      np.ones(int(first_in_cart.sum()), dtype=np.int64)),
+    }
+
+
+def product_metrics(order_products, products=None):
+    """Compute order, reorder, first-in-cart counts and reorder rate per product."""
+    return metrics_frame(count_product_events(order_products), products)
+
+
+def attach_product_names(metrics, products):
+    """
+    Return `metrics` as a DataFrame with product_id and product_name columns first.
+
+    Meant for the few rows that end up in a report, not the full metrics table.
+    Ids that are not in `products` get a missing name.
+    """
+    pos = lookup_positions(product_positions(products), metrics.index.to_numpy())
+    known = pos >= 0
+    names = np.full(len(pos), None, dtype=object)
+    names[known] = products['product_name'].to_numpy()[pos[known]]
+    named = metrics.reset_index()
+    named.insert(1, 'product_name', names)
+    return named
+
+
+def named_series(metrics, column, products):
+    """
+    One metric as a Series indexed by (product_id, product_name), in the row order of `metrics`.
+
+    The same shape as grouping the products-merged order_products by
+    ['product_id', 'product_name'], for reports built from the full metrics
+    table or from a top_k() selection of it.
+    """
+    named = attach_product_names(metrics[[column]], products)
+    return named.set_index(['product_id', 'product_name'])[column]
+
+
+def top_products(metrics, column, products, n=20):
+    """Return the top `n` products by `column` (ties by product_id), with product names attached."""
+    return attach_product_names(top_k(metrics[column], n).to_frame(), products)
@@ -0,0 +1,211 @@
+"""
+Per-stage profiling of analysis runs.
+
+Every stage run inside StageProfiler.stage() gets a record with its wall time,
+CPU time, memory use and row counts:
+
+    wall_seconds          elapsed time
+    cpu_seconds           CPU time of this process (above wall time when numpy uses threads)
+    peak_memory_mb        highest traced heap use during the stage, above what it started with
+    allocated_mb          traced heap the stage left allocated when it finished
+    peak_rss_mb           peak resident set size of the process after the stage
+    rss_delta_mb          change in resident set size over the stage
+    arrow_allocated_mb    change in memory held by Arrow's allocators over the stage
+    rows_in, rows_out     rows the stage read and produced, as reported by the stage
+
+Heap numbers come from tracemalloc, which numpy and pandas report their array
+buffers to. Arrow allocates outside of it (Parquet reads, Arrow-backed
+columns), which is what the RSS and Arrow numbers are for; they are recorded
+whether or not tracemalloc runs. One stage can be picked for a deep-dive: it additionally runs under
+cProfile and the report lists its slowest functions and biggest allocation sites.
+
+    profiler = StageProfiler(deep_dive='clean')
+    with profiler.stage('clean', rows_in=len(orders)) as record:
+        orders = clean_orders(orders)
+        record.rows_out = len(orders)
+    print(profiler.summary())
+    profiler.save('run.json')
+"""
+
+import cProfile
+import json
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+
+MB = 2**20
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB everywhere else
+    return peak / MB if sys.platform == 'darwin' else peak / 2**10
+
+
+def current_rss_mb():
+    """Resident set size of this process right now, in MiB (None where /proc is not available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() / MB
+
+
+def arrow_allocated_mb():
+    """Memory currently held by Arrow's allocators, in MiB (None without pyarrow)."""
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    return pyarrow.total_allocated_bytes() / MB
+
+
+def _change(start, end):
+    return round(end - start, 1) if start is not None and end is not None else None
+
+
+@dataclass
+class StageRecord:
+    """Measurements of one stage run."""
+
+    name: str
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_memory_mb: float = None
+    allocated_mb: float = None
+    peak_rss_mb: float = 0.0
+    rss_delta_mb: float = None
+    arrow_allocated_mb: float = None
+    rows_in: int = None
+    rows_out: int = None
+    deep_dive: dict = field(default=None, repr=False)
+
+
+def _top_functions(profile, limit):
+    # The slowest functions by cumulative time, from cProfile's raw stats
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({
+            'function': f'{filename}:{line}({function})',
+            'calls': calls,
+            'own_seconds': round(own, 4),
+            'cumulative_seconds': round(cumulative, 4),
+        })
+    rows.sort(key=lambda row: row['cumulative_seconds'], reverse=True)
+    return rows[:limit]
+
+
+def _top_allocations(before, after, limit):
+    # Source lines holding the most more memory at the end of the stage than at its start,
+    # leaving out the profiler's own bookkeeping
+    ignore = [tracemalloc.Filter(False, module.__file__) for module in (cProfile, pstats, tracemalloc)]
+    ignore.append(tracemalloc.Filter(False, __file__))
+    rows = []
+    for diff in after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')[:limit]:
+        frame = diff.traceback[0]
+        rows.append({
+            'line': f'{frame.filename}:{frame.lineno}',
+            'size_mb': round(diff.size_diff / MB, 3),
+            'blocks': diff.count_diff,
+        })
+    return rows
+
+
+class StageProfiler:
+    """
+    Collects a StageRecord for every stage of a run.
+
+    trace_memory turns tracemalloc on for the run. It slows allocation-heavy
+    code down, parsing CSV files into Python strings most of all, so use
+    trace_memory=False when only the timings matter. deep_dive is
+    the name of the stage to profile in detail, if any.
+    """
+
+    def __init__(self, trace_memory=True, deep_dive=None, deep_dive_limit=25):
+        self.trace_memory = trace_memory or deep_dive is not None
+        self.deep_dive = deep_dive
+        self.deep_dive_limit = deep_dive_limit
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Run the body as stage `name` and yield its record, for setting rows_out."""
+        record = StageRecord(name, rows_in=rows_in)
+        deep_dive = name == self.deep_dive
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace_memory:
+            start_memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        if deep_dive:
+            snapshot = tracemalloc.take_snapshot()
+            profile = cProfile.Profile()
+            profile.enable()
+
+        start_rss, start_arrow = current_rss_mb(), arrow_allocated_mb()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_seconds = round(time.perf_counter() - wall, 4)
+            record.cpu_seconds = round(time.process_time() - cpu, 4)
+            if deep_dive:
+                profile.disable()
+                record.deep_dive = {
+                    'functions': _top_functions(profile, self.deep_dive_limit),
+                    'allocations': _top_allocations(snapshot, tracemalloc.take_snapshot(), self.deep_dive_limit),
+                }
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record.peak_memory_mb = round((peak - start_memory) / MB, 1)
+                record.allocated_mb = round((current - start_memory) / MB, 1)
+            if started_tracing:
+                tracemalloc.stop()
+            record.peak_rss_mb = round(peak_rss_mb(), 1)
+            record.rss_delta_mb = _change(start_rss, current_rss_mb())
+            record.arrow_allocated_mb = _change(start_arrow, arrow_allocated_mb())
+            self.records.append(record)
+
+    def report(self):
+        """The run report as a JSON-serializable dict."""
+        return {
+            'stages': [asdict(record) for record in self.records],
+            'wall_seconds': round(sum(record.wall_seconds for record in self.records), 4),
+            'cpu_seconds': round(sum(record.cpu_seconds for record in self.records), 4),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self):
+        """A table of the stage records for the terminal, plus the deep-dive if there was one."""
+        optional = lambda value, spec: format(value, spec) if value is not None else '-'
+        lines = [f'{"stage":<20}{"wall s":>9}{"cpu s":>9}{"peak MiB":>10}{"alloc MiB":>11}'
+                 f'{"RSS MiB":>9}{"RSS +MiB":>10}{"Arrow MiB":>11}{"rows in":>12}{"rows out":>12}']
+        for record in self.records:
+            lines.append(f'{record.name:<20}{record.wall_seconds:>9.3f}{record.cpu_seconds:>9.3f}'
+                         f'{optional(record.peak_memory_mb, ".1f"):>10}{optional(record.allocated_mb, ".1f"):>11}'
+                         f'{record.peak_rss_mb:>9.1f}{optional(record.rss_delta_mb, ".1f"):>10}'
+                         f'{optional(record.arrow_allocated_mb, ".1f"):>11}{optional(record.rows_in, "d"):>12}'
+                         f'{optional(record.rows_out, "d"):>12}')
+
+        for record in self.records:
+            if record.deep_dive is None:
+                continue
+            lines.append(f'\nDeep-dive into {record.name}, slowest functions:')
+            for row in record.deep_dive['functions'][:10]:
+                lines.append(f'{row["cumulative_seconds"]:>9.3f}s {row["calls"]:>9} calls  {row["function"]}')
+            lines.append('Biggest allocations still held at the end:')
+            for row in record.deep_dive['allocations'][:10]:
+                lines.append(f'{row["size_mb"]:>9.1f} MiB {row["blocks"]:>9} blocks  {row["line"]}')
+        return '\n'.join(lines)
@@ -0,0 +1,366 @@
+"""
+Local HTTP/JSON service answering parameterized versions of the reports.
+
+The aggregates are loaded once at startup from the pipeline store (see
+pipeline.py): the cleaned products, the per-product counters, the per-product
+counters by day of week and hour (product_time_counts), the order-time cube
+and the user index. Every query is answered from those, none of them merges
+order_products with orders or products again.
+
+    GET /products/top?by=first_in_cart_count&n=20&department_id=4&order_dow=0
+        top products by order_count, reorder_count, first_in_cart_count or
+        reorder_rate; optional department_id, aisle_id, order_dow,
+        order_hour_of_day (comma-separated values allowed) and min_orders
+    GET /products/<product_id>          counters, reorder rate, aisle and department
+    GET /users/<user_id>                orders, items, reorder rate, most bought products
+    GET /orders/marginal?axis=order_hour_of_day&order_dow=3
+                                        order counts along one axis of the time cube;
+                                        days_since_prior_order=31 selects first orders
+    GET /reports/<name>                 any report node of the pipeline (see REPORTS)
+    GET /metrics                        request and cache counters
+
+Answers are kept in a bounded LRU cache keyed by the path and the sorted
+parameters. Queries run in a thread pool, so the event loop keeps accepting
+requests while one is computed, and concurrent requests for the same answer
+wait for a single computation.
+
+    python query_service.py --data-dir /datasets --port 8765 --cache-size 1024
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from enrichment import lookup_positions, product_positions
+from pipeline import REPORTS, STORE_DIR, Pipeline
+from product_metrics import COUNTERS, metrics_frame, top_products
+from time_cube import AXES
+
+SORT_COLUMNS = COUNTERS + ('reorder_rate',)
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class LRUCache:
+    """Bounded mapping that drops the least recently used entry when full."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (True, value) and mark the entry as recently used, or (False, None)."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, self.entries[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else None,
+        }
+
+
+def _records(frame):
+    # JSON-ready rows: plain Python values, missing values as null
+    frame = frame.reset_index() if not isinstance(frame.index, pd.RangeIndex) else frame
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict(orient='records')
+
+
+def _jsonable(value):
+    if isinstance(value, pd.Series):
+        return _records(value.to_frame())
+    if isinstance(value, pd.DataFrame):
+        return _records(value)
+    return value
+
+
+def _ints(params, name):
+    # Comma-separated integer values of a query parameter, or None when it is not given
+    if name not in params:
+        return None
+    try:
+        return [int(value) for value in params[name].split(',')]
+    except ValueError:
+        raise ValueError(f'{name} must be one or more comma-separated integers, got {params[name]!r}') from None
+
+
+def _id(text, name):
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer, got {text!r}') from None
+
+
+def _check_range(values, name, size):
+    if values is not None and any(value < 0 or value >= size for value in values):
+        raise ValueError(f'{name} must be between 0 and {size - 1}')
+
+
+class QueryEngine:
+    """The loaded aggregates and the queries on them (synchronous, safe to call from several threads)."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self._lock = threading.Lock()
+        self.products = pipeline.get('products')
+        self.product_stats = pipeline.get('product_stats')
+        self.time_counts = pipeline.get('product_time_counts')
+        self.time_cube = pipeline.get('time_cube')
+        self.user_index = pipeline.get('user_index')
+        self.positions = product_positions(self.products)
+
+        # Dense product_id -> aisle_id / department_id (-1 for unknown products)
+        product_ids = self.products['product_id'].to_numpy()
+        size = int(product_ids.max()) + 1 if len(product_ids) else 0
+        self.aisle_of = np.full(size, -1, dtype=np.int64)
+        self.aisle_of[product_ids] = self.products['aisle_id'].to_numpy(dtype=np.int64)
+        self.department_of = np.full(size, -1, dtype=np.int64)
+        self.department_of[product_ids] = self.products['department_id'].to_numpy(dtype=np.int64)
+
+    def _in_category(self, product_ids, mapping, values):
+        known = product_ids < len(mapping)
+        category = np.full(len(product_ids), -1, dtype=np.int64)
+        category[known] = mapping[product_ids[known]]
+        return np.isin(category, values)
+
+    def top_products(self, by='order_count', n=20, department_id=None, aisle_id=None, order_dow=None,
+                     order_hour_of_day=None, min_orders=1):
+        """Top `n` products by a counter or the reorder rate, within the given categories and hours."""
+        if by not in SORT_COLUMNS:
+            raise ValueError(f'by must be one of {SORT_COLUMNS}, got {by!r}')
+        if order_dow is None and order_hour_of_day is None:
+            metrics = self.product_stats
+        else:
+            _check_range(order_dow, 'order_dow', 7)
+            _check_range(order_hour_of_day, 'order_hour_of_day', 24)
+            cells = np.zeros((7, 24), dtype=bool)
+            cells[np.ix_(order_dow if order_dow is not None else range(7),
+                         order_hour_of_day if order_hour_of_day is not None else range(24))] = True
+            columns = np.flatnonzero(cells.ravel())
+            counters = {name: np.asarray(matrix[:, columns].sum(axis=1)).ravel()
+                        for name, matrix in self.time_counts.items()}
+            metrics = metrics_frame(counters, self.products)
+
+        product_ids = metrics.index.to_numpy()
+        keep = metrics['order_count'].to_numpy() >= min_orders
+        if department_id is not None:
+            keep &= self._in_category(product_ids, self.department_of, department_id)
+        if aisle_id is not None:
+            keep &= self._in_category(product_ids, self.aisle_of, aisle_id)
+        return top_products(metrics[keep], by, self.products, n)
+
+    def product(self, product_id):
+        """Counters, reorder rate, name, aisle and department of one product."""
+        position = lookup_positions(self.positions, np.array([product_id]))[0]
+        if position < 0:
+            raise KeyError(f'product_id {product_id} is not in the products table')
+        row = self.products.iloc[position]
+        answer = {
+            'product_id': product_id,
+            'product_name': row['product_name'],
+            'aisle_id': int(row['aisle_id']),
+            'department_id': int(row['department_id']),
+        }
+        if product_id in self.product_stats.index:
+            answer.update(self.product_stats.loc[product_id].to_dict())
+        else:
+            answer.update({name: 0 for name in COUNTERS}, reorder_rate=None)
+        for name in COUNTERS:
+            answer[name] = int(answer[name])
+        return answer
+
+    def user(self, user_id, n=10):
+        """One user's order and item counts, reorder rate and `n` most bought products."""
+        history = self.user_index.basket_history(user_id)
+        product_ids = np.asarray(history['product_ids'])
+        items = len(product_ids)
+        counts = pd.Series(np.bincount(product_ids)) if items else pd.Series(dtype=np.int64)
+        counts = counts[counts > 0]
+        top = counts.sort_values(ascending=False, kind='stable').head(n)
+        return {
+            'user_id': user_id,
+            'orders': len(history['order_ids']),
+            'items': items,
+            'reorder_rate': float(np.asarray(history['reordered']).mean()) if items else None,
+            'mean_basket_size': items / len(history['order_ids']),
+            'top_products': [{'product_id': int(product_id), 'times_bought': int(times)}
+                             for product_id, times in top.items()],
+        }
+
+    def marginal(self, axis, **fixed):
+        """Order counts along one axis of the time cube, with the other axes restricted."""
+        if axis not in AXES:
+            raise ValueError(f'axis must be one of {AXES}, got {axis!r}')
+        for name, size in zip(AXES, self.time_cube.counts.shape):
+            _check_range(fixed.get(name), name, size)
+        return self.time_cube.marginal(axis, **fixed)
+
+    def report(self, name):
+        """One of the pipeline's reports, computed or loaded from the store on first use."""
+        if name not in REPORTS:
+            raise KeyError(f'Unknown report {name!r}, expected one of {REPORTS}')
+        # The pipeline memoizes values in a plain dict, one thread evaluates at a time
+        with self._lock:
+            return self.pipeline.get(name)
+
+    def query(self, path, params):
+        """Answer a request path with its query parameters (a dict of strings)."""
+        parts = [part for part in path.split('/') if part]
+        if parts == ['products', 'top']:
+            n = _ints(params, 'n')
+            min_orders = _ints(params, 'min_orders')
+            return self.top_products(params.get('by', 'order_count'), n[0] if n else 20,
+                                     _ints(params, 'department_id'), _ints(params, 'aisle_id'),
+                                     _ints(params, 'order_dow'), _ints(params, 'order_hour_of_day'),
+                                     min_orders[0] if min_orders else 1)
+        if len(parts) == 2 and parts[0] == 'products':
+            return self.product(_id(parts[1], 'product_id'))
+        if len(parts) == 2 and parts[0] == 'users':
+            n = _ints(params, 'n')
+            return self.user(_id(parts[1], 'user_id'), n[0] if n else 10)
+        if parts == ['orders', 'marginal']:
+            axis = params.get('axis', 'order_hour_of_day')
+            unknown = set(params) - set(AXES) - {'axis'}
+            if unknown:
+                raise ValueError(f'Unknown parameters {sorted(unknown)}, expected axis and some of {AXES}')
+            return self.marginal(axis, **{name: _ints(params, name) for name in AXES if name in params})
+        if len(parts) == 2 and parts[0] == 'reports':
+            return self.report(parts[1])
+        raise KeyError(f'No such path: {path}')
+
+
+class QueryService:
+    """The asyncio HTTP front end: LRU cache of answers, thread pool for the queries, metrics."""
+
+    def __init__(self, engine, cache_size=1024, workers=None):
+        self.engine = engine
+        self.cache = LRUCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}
+        self.requests = 0
+        self.errors = 0
+        self.coalesced = 0
+
+    def metrics(self):
+        return {'requests': self.requests, 'errors': self.errors, 'coalesced': self.coalesced,
+                'in_flight': len(self.pending), 'cache': self.cache.stats()}
+
+    def _compute(self, path, params):
+        # Runs in the thread pool; the body is encoded there too, so hits only send bytes
+        try:
+            return 200, json.dumps(_jsonable(self.engine.query(path, params))).encode()
+        except KeyError as error:
+            return 404, json.dumps({'error': str(error.args[0])}).encode()
+        except ValueError as error:
+            return 400, json.dumps({'error': str(error)}).encode()
+
+    async def answer(self, path, params):
+        """Return (status, JSON body) for a request, from the cache when possible."""
+        self.requests += 1
+        if path.rstrip('/') == '/metrics':
+            return 200, json.dumps(self.metrics()).encode()
+
+        key = (path.rstrip('/'), tuple(sorted(params.items())))
+        found, value = self.cache.get(key)
+        if found:
+            return value
+        if key in self.pending:
+            # Someone is already computing this answer
+            self.coalesced += 1
+            return await asyncio.shield(self.pending[key])
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._compute, path, params)
+        self.pending[key] = future
+        try:
+            status, body = await future
+        finally:
+            del self.pending[key]
+        if status == 200:
+            self.cache.put(key, (status, body))
+        else:
+            self.errors += 1
+        return status, body
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            # Headers are read and ignored; requests have no body
+            while (await reader.readline()).strip():
+                pass
+            if len(request_line) < 2:
+                return
+            if request_line[0] != 'GET':
+                status, body = 405, json.dumps({'error': 'only GET is supported'}).encode()
+            else:
+                url = urlsplit(request_line[1])
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                try:
+                    status, body = await self.answer(url.path, params)
+                except Exception as error:
+                    self.errors += 1
+                    status, body = 500, json.dumps({'error': repr(error)}).encode()
+            writer.write(f'HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n'
+                         f'Content-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f'Serving on http://{host}:{port}')
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the cached aggregates over HTTP/JSON.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--store-dir', default=STORE_DIR)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cache-size', type=int, default=1024, help='answers kept in the LRU cache')
+    parser.add_argument('--workers', type=int, help='threads computing answers')
+    args = parser.parse_args()
+
+    engine = QueryEngine(Pipeline(args.data_dir, store_dir=args.store_dir))
+    service = QueryService(engine, args.cache_size, args.workers)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Repurchase intervals of every customer and product.
+
+Each order is placed on its customer's timeline (user_product_features
+.order_timeline(): days_since_prior_order summed over order_number within the
+user), and every order_products row gets the day of its order. The days
+between two consecutive purchases of a product by the same customer are that
+pair's repurchase intervals. From them, for every (user, product) pair bought
+at least twice:
+
+    purchases                  orders of the user containing the product
+    median_interval            median days between two purchases
+    mean_interval              mean days between two purchases
+    interval_cv                regularity: standard deviation / mean of the intervals
+                               (0 = perfectly regular; needs at least 2 intervals)
+    days_since_last_purchase   days between the last purchase and the user's latest order
+    days_overdue               days_since_last_purchase - median_interval; positive when
+                               the next purchase is later than usual
+
+and per product, over the customers who rebought it (product_cycles()).
+
+days_since_prior_order is capped at 30 in the data, so gaps of more than a
+month count as 30 days and long intervals are underestimated.
+
+Items are sorted once by (user, product, day), so every pair is a contiguous
+segment and its intervals are differences within the segment. Medians come
+from a second sort of the intervals within their segments. Everything else is
+a segmented reduction over those sorted arrays, with no loop over users or
+products.
+
+    python reorder_cycles.py --data-dir /datasets --output reorder_cycles.parquet
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from cleaning import clean_order_products, clean_orders, clean_products
+from product_metrics import attach_product_names
+from user_product_features import order_timeline
+
+CYCLE_DTYPES = {
+    'user_id': 'int32',
+    'product_id': 'int32',
+    'purchases': 'int32',
+    'median_interval': 'float32',
+    'mean_interval': 'float32',
+    'interval_cv': 'float32',
+    'days_since_last_purchase': 'float32',
+    'days_overdue': 'float32',
+}
+
+
+def _segment_starts(*keys):
+    # Start of every run of equal keys in arrays sorted by those keys
+    new = np.ones(len(keys[0]), dtype=bool)
+    if len(new):
+        new[1:] = np.any([key[1:] != key[:-1] for key in keys], axis=0)
+    return np.flatnonzero(new)
+
+
+def segment_medians(values, segments, n_segments):
+    """
+    Median of `values` within each segment id in 0..n_segments-1 (NaN for empty segments).
+
+    `segments` must be sorted; values are sorted within their segment here.
+    """
+    order = np.lexsort((values, segments))
+    values = values[order]
+    counts = np.bincount(segments, minlength=n_segments)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    medians = np.full(n_segments, np.nan)
+    present = counts > 0
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    medians[present] = (values[low] + values[high]) / 2
+    return medians
+
+
+def user_product_cycles(orders, order_products):
+    """
+    Repurchase interval statistics for every (user, product) pair bought at least twice.
+
+    Takes cleaned orders and order_products; items of unknown orders are left
+    out. Returns one row per pair, sorted by user_id then product_id.
+    """
+    timeline = order_timeline(orders)
+    timeline_ids = timeline['order_id'].to_numpy()
+    position = np.full(int(timeline_ids.max()) + 1 if len(timeline_ids) else 0, -1, dtype=np.int64)
+    position[timeline_ids] = np.arange(len(timeline_ids))
+
+    item_orders = order_products['order_id'].to_numpy()
+    item_position = np.full(len(item_orders), -1, dtype=np.int64)
+    in_range = item_orders < len(position)
+    item_position[in_range] = position[item_orders[in_range]]
+    known = item_position >= 0
+    item_position = item_position[known]
+
+    user = timeline['user_id'].to_numpy()[item_position].astype(np.int64)
+    product = order_products['product_id'].to_numpy()[known].astype(np.int64)
+    day = timeline['day'].to_numpy()[item_position]
+    user_last_day = timeline['user_last_day'].to_numpy()[item_position]
+
+    # Every (user, product) pair becomes one segment, in timeline order
+    sort = np.lexsort((day, product, user))
+    user, product, day, user_last_day = user[sort], product[sort], day[sort], user_last_day[sort]
+    starts = _segment_starts(user, product)
+    purchases = np.diff(np.append(starts, len(sort)))
+
+    # Intervals: differences within a segment, i.e. all but the first item of each
+    pair_of_item = np.repeat(np.arange(len(starts)), purchases)
+    follows = np.ones(len(sort), dtype=bool)
+    follows[starts] = False
+    intervals = np.diff(day, prepend=0)[follows]
+    interval_pair = pair_of_item[follows]
+
+    n_pairs = len(starts)
+    n_intervals = purchases - 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(interval_pair, intervals, n_pairs) / n_intervals
+        variance = np.bincount(interval_pair, (intervals - mean[interval_pair]) ** 2, n_pairs) / n_intervals
+        cv = np.where((n_intervals >= 2) & (mean > 0), np.sqrt(variance) / mean, np.nan)
+    median = segment_medians(intervals, interval_pair, n_pairs)
+
+    ends = starts + purchases - 1
+    since_last = user_last_day[ends] - day[ends]
+    cycles = pd.DataFrame({
+        'user_id': user[starts],
+        'product_id': product[starts],
+        'purchases': purchases,
+        'median_interval': median,
+        'mean_interval': mean,
+        'interval_cv': cv,
+        'days_since_last_purchase': since_last,
+        'days_overdue': since_last - median,
+    })
+    return cycles[purchases >= 2].reset_index(drop=True).astype(CYCLE_DTYPES)
+
+
+def product_cycles(cycles):
+    """
+    Aggregate the pair statistics per product.
+
+    Every rebuying customer counts once: median_interval and median_cv are
+    medians over the customers' own median interval and interval_cv.
+    mean_interval is the mean over all of the product's intervals. Sorted by
+    the number of rebuying customers, descending.
+    """
+    product = cycles['product_id'].to_numpy().astype(np.int64)
+    sort = np.argsort(product, kind='stable')
+    product = product[sort]
+    starts = _segment_starts(product)
+    ids = product[starts]
+    segments = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(product))))
+
+    intervals = cycles['purchases'].to_numpy().astype(np.int64)[sort] - 1
+    mean = cycles['mean_interval'].to_numpy(dtype=np.float64)[sort]
+    cv = cycles['interval_cv'].to_numpy(dtype=np.float64)[sort]
+    has_cv = ~np.isnan(cv)
+    total_intervals = np.bincount(segments, intervals, len(starts))
+
+    result = pd.DataFrame({
+        'customers': np.bincount(segments, minlength=len(starts)),
+        'intervals': total_intervals.astype(np.int64),
+        'median_interval': segment_medians(cycles['median_interval'].to_numpy(dtype=np.float64)[sort],
+                                           segments, len(starts)),
+        'mean_interval': np.bincount(segments, mean * intervals, len(starts)) / total_intervals,
+        'median_cv': segment_medians(cv[has_cv], segments[has_cv], len(starts)),
+    }, index=pd.Index(ids, name='product_id'))
+    return result.sort_values('customers', ascending=False, kind='stable')
+
+
+def interval_distribution(cycles):
+    """Number of (user, product) pairs by their median repurchase interval, in whole days."""
+    days = np.floor(cycles['median_interval'].to_numpy(dtype=np.float64)).astype(np.int64)
+    counts = np.bincount(days)
+    present = np.flatnonzero(counts)
+    return pd.Series(counts[present], index=pd.Index(present, name='median_interval'), name='pairs')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute repurchase intervals per customer and product.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--output', help='write the per-pair statistics to this Parquet file')
+    args = parser.parse_args()
+
+    orders = clean_orders(data_loader.load_table('orders', data_dir=args.data_dir))
+    order_products = clean_order_products(data_loader.load_table('order_products', data_dir=args.data_dir))
+    products = clean_products(data_loader.load_table('products', data_dir=args.data_dir))
+
+    cycles = user_product_cycles(orders, order_products)
+    print(f'{len(cycles)} user x product pairs bought at least twice')
+    print('\nPairs by median repurchase interval (days):')
+    print(interval_distribution(cycles))
+    print('\nMost rebought products:')
+    print(attach_product_names(product_cycles(cycles).head(20), products))
+    if args.output:
+        cycles.to_parquet(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
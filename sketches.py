@@ -0,0 +1,199 @@
+"""
+Approximate top products for unbounded order streams.
+
+Each report (popular, reordered, first in cart) keeps a Space-Saving summary:
+at most `capacity` monitored product ids, each with an over-estimated count and
+the maximum over-estimation (error). For every product the true count lies in
+[count - error, count], and no error exceeds total / capacity, so choosing
+capacity = ceil(1 / epsilon) bounds the error by epsilon * total.
+
+Batches are folded in with the merge rule for Space-Saving summaries (combine
+counts, treat products missing from a full summary as having its minimum
+count, keep the `capacity` largest), which is also how two summaries built on
+separate streams are combined. Memory stays fixed at `capacity` entries.
+
+    python sketches.py --data-dir /datasets --epsilon 0.0001 --save sketches.json
+"""
+
+import argparse
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from cleaning import clean_products
+from product_metrics import attach_product_names
+from streaming import DEFAULT_BATCH_ROWS, iter_order_products
+from topk import top_k_positions
+
+
+def _lookup(items, values, keys, default):
+    # values[items == key] for every key, `default` for keys that are not in items
+    result = np.full(len(keys), default, dtype=np.int64)
+    positions = np.searchsorted(items, keys)
+    positions[positions == len(items)] = 0
+    if len(items):
+        found = items[positions] == keys
+        result[found] = values[positions[found]]
+    return result
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter summary over integer ids."""
+
+    def __init__(self, capacity=None, epsilon=None):
+        if capacity is None:
+            if epsilon is None:
+                raise ValueError('give either capacity or epsilon')
+            capacity = math.ceil(1 / epsilon)
+        self.capacity = int(capacity)
+        # Monitored ids are kept sorted so lookups can use searchsorted
+        self.items = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.errors = np.zeros(0, dtype=np.int64)
+        self.total = 0
+
+    @property
+    def epsilon(self):
+        return 1 / self.capacity
+
+    def min_count(self):
+        """Upper bound on the count of any id that is not monitored."""
+        return int(self.counts.min()) if len(self.items) >= self.capacity else 0
+
+    def _combine(self, items, counts, errors, floor, total):
+        # Merge another summary (sorted ids, counts, errors, its min_count) into this one
+        union = np.union1d(self.items, items)
+        own_floor = self.min_count()
+        merged_counts = (_lookup(self.items, self.counts, union, own_floor)
+                         + _lookup(items, counts, union, floor))
+        merged_errors = (_lookup(self.items, self.errors, union, own_floor)
+                         + _lookup(items, errors, union, floor))
+
+        keep = np.sort(top_k_positions(merged_counts, union, self.capacity))
+        self.items = union[keep]
+        self.counts = merged_counts[keep]
+        self.errors = merged_errors[keep]
+        self.total += total
+        return self
+
+    def update(self, ids):
+        """Count every id in an array (one occurrence per element)."""
+        items, counts = np.unique(np.asarray(ids, dtype=np.int64), return_counts=True)
+        # The batch itself is an exact summary: no errors, nothing unmonitored
+        return self._combine(items, counts.astype(np.int64), np.zeros(len(items), dtype=np.int64), 0, len(ids))
+
+    def merge(self, other):
+        """Fold another summary (built on a different part of the stream) into this one."""
+        if other.capacity != self.capacity:
+            raise ValueError('can only merge summaries with the same capacity')
+        return self._combine(other.items, other.counts, other.errors, other.min_count(), other.total)
+
+    def top(self, n=20):
+        """
+        Return the n ids with the largest estimated counts.
+
+        lower/upper bound the true count. `guaranteed` is True when the id is in
+        the true top n no matter how the errors are distributed.
+        """
+        positions = top_k_positions(self.counts, self.items, n)
+        upper = self.counts[positions]
+        lower = upper - self.errors[positions]
+        # Best possible count of anything outside the reported ids
+        rest = np.ones(len(self.items), dtype=bool)
+        rest[positions] = False
+        outside = max([self.min_count()] + ([int(self.counts[rest].max())] if rest.any() else []))
+        return pd.DataFrame(
+            {'estimate': upper, 'lower': lower, 'upper': upper, 'guaranteed': lower >= outside},
+            index=pd.Index(self.items[positions], name='product_id'),
+        )
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'total': self.total,
+            'items': self.items.tolist(),
+            'counts': self.counts.tolist(),
+            'errors': self.errors.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(capacity=data['capacity'])
+        sketch.total = data['total']
+        sketch.items = np.array(data['items'], dtype=np.int64)
+        sketch.counts = np.array(data['counts'], dtype=np.int64)
+        sketch.errors = np.array(data['errors'], dtype=np.int64)
+        return sketch
+
+
+REPORTS = ('popular', 'reordered', 'first_in_cart')
+
+
+class ProductSketches:
+    """One Space-Saving summary for each of the three top-20 product reports."""
+
+    def __init__(self, epsilon=0.001, sketches=None):
+        self.sketches = sketches or {name: SpaceSaving(epsilon=epsilon) for name in REPORTS}
+
+    def update(self, batch):
+        """Fold a batch of order_products rows into all three summaries."""
+        product_ids = batch['product_id'].to_numpy()
+        reordered = batch['reordered'].to_numpy() == 1
+        first_in_cart = batch['add_to_cart_order'].to_numpy(dtype=np.int64, na_value=0) == 1
+        self.sketches['popular'].update(product_ids)
+        self.sketches['reordered'].update(product_ids[reordered])
+        self.sketches['first_in_cart'].update(product_ids[first_in_cart])
+        return self
+
+    def merge(self, other):
+        for name in REPORTS:
+            self.sketches[name].merge(other.sketches[name])
+        return self
+
+    def report(self, name, products=None, n=20):
+        """Top n products for one report, with names attached when `products` is given."""
+        top = self.sketches[name].top(n)
+        return attach_product_names(top, products) if products is not None else top.reset_index()
+
+    def to_json(self):
+        return json.dumps({name: sketch.to_dict() for name, sketch in self.sketches.items()})
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(sketches={name: SpaceSaving.from_dict(data[name]) for name in REPORTS})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Approximate top products with fixed-memory sketches.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS)
+    parser.add_argument('--epsilon', type=float, default=0.001,
+                        help='maximum error as a fraction of the rows seen by each report')
+    parser.add_argument('--merge', nargs='*', default=[], help='saved sketch files to merge in')
+    parser.add_argument('--save', help='write the sketches to this JSON file')
+    args = parser.parse_args()
+
+    sketches = ProductSketches(epsilon=args.epsilon)
+    for batch in iter_order_products(args.data_dir, args.batch_rows):
+        sketches.update(batch)
+    for path in args.merge:
+        with open(path) as f:
+            sketches.merge(ProductSketches.from_json(f.read()))
+    if args.save:
+        with open(args.save, 'w') as f:
+            f.write(sketches.to_json())
+
+    products = clean_products(data_loader.load_table('products', data_dir=args.data_dir))
+    for name in REPORTS:
+        sketch = sketches.sketches[name]
+        print(f'Top 20 {name} (error at most {math.floor(sketch.total / sketch.capacity)} of {sketch.total} rows):')
+        print(sketches.report(name, products))
+        print()
+
+
+if __name__ == '__main__':
+    main()
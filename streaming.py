@@ -0,0 +1,346 @@
+"""
+Out-of-core aggregation of order_products.
+
+order_products is read in batches of a fixed number of rows, and each batch is
+folded into counter arrays indexed by order_id, product_id and user_id. Those
+arrays are as long as the largest id, and so is the order_id -> user_id map
+used for the join with orders. Peak memory is therefore bounded by the id
+space (one batch plus a few int64 values per order, product and user id), not
+by the number of order_products rows: it does not depend on how many items the
+orders hold, but it still grows as new orders get new order_ids.
+
+The results are the same as the in-memory path in instacart_analysis.py:
+
+    python streaming.py --data-dir /datasets --batch-rows 1000000
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from cleaning import clean_orders, clean_products
+from parallel_csv import detect_layout, downcast, wide_dtype
+from product_metrics import add_counters, metrics_frame, top_products
+from topk import top_k
+
+DEFAULT_BATCH_ROWS = 1_000_000
+
+ORDER_PRODUCTS_COLUMNS = ['order_id', 'product_id', 'add_to_cart_order', 'reordered']
+
+
+def _grow(counts, size):
+    # Pad a counter with zeros, for ids past the size it was allocated with
+    return np.concatenate([counts, np.zeros(size - len(counts), dtype=counts.dtype)])
+
+
+def order_user_map(orders):
+    """Return a dense array mapping order_id -> user_id (-1 for unknown orders)."""
+    order_ids = orders['order_id'].to_numpy()
+    users = np.full(int(order_ids.max()) + 1 if len(order_ids) else 0, -1, dtype=np.int64)
+    users[order_ids] = orders['user_id'].to_numpy()
+    return users
+
+
+def iter_table(table, columns=None, data_dir=data_loader.DATA_DIR, batch_rows=DEFAULT_BATCH_ROWS,
+               cache_dir=data_loader.CACHE_DIR, dtypes=None):
+    """
+    Yield one of the tables in DataFrames of at most `batch_rows` rows.
+
+    Reads from the Parquet cache when it is up to date, otherwise streams the
+    CSV file directly (the cache is not written, that would need the whole table).
+    `dtypes` overrides the schema's dtypes of some columns, e.g. with wide
+    nullable ones that keep missing and out-of-range values for validation.
+    """
+    path = data_loader.cache_path(table, data_dir, cache_dir)
+    schema = data_loader.SCHEMAS[table]['dtypes']
+    columns = list(schema) if columns is None else list(columns)
+    dtypes = {column: (dtypes or {}).get(column, schema[column]) for column in columns}
+    try:
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+    except (ImportError, FileNotFoundError):
+        source = data_loader.source_path(table, data_dir)
+        # Same header repair as the full load, for rows with an unnamed leading index
+        names, skip = detect_layout(source)
+        reader = pd.read_csv(
+            source,
+            sep=';',
+            header=None,
+            skiprows=1,
+            names=[f'_skip{i}' for i in range(skip)] + names,
+            usecols=columns,
+            dtype={column: wide_dtype(dtype) for column, dtype in dtypes.items()},
+            chunksize=batch_rows,
+        )
+        with reader:
+            for chunk in reader:
+                yield downcast(chunk, dtypes, source)
+        return
+
+    for record_batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+        yield record_batch.to_pandas().astype(dtypes)
+
+
+def iter_order_products(data_dir=data_loader.DATA_DIR, batch_rows=DEFAULT_BATCH_ROWS,
+                        cache_dir=data_loader.CACHE_DIR):
+    """Yield order_products in DataFrames of at most `batch_rows` rows (see iter_table())."""
+    return iter_table('order_products', ORDER_PRODUCTS_COLUMNS, data_dir, batch_rows, cache_dir)
+
+
+# Id each id-indexed counter is indexed by
+COUNTER_IDS = {
+    'order_count': 'product_id',
+    'reorder_count': 'product_id',
+    'first_in_cart_count': 'product_id',
+    'items_per_order': 'order_id',
+    'user_item_count': 'user_id',
+    'user_reorder_count': 'user_id',
+    'orders_per_user': 'user_id',
+}
+
+
+def id_bounds(orders, products=None, data_dir=data_loader.DATA_DIR, cache_dir=data_loader.CACHE_DIR):
+    """
+    Array sizes (largest id + 1) for order_id, user_id and product_id.
+
+    Taken from the orders and products tables and, when the order_products
+    Parquet cache exists, from its column statistics, so order_products itself
+    is not read.
+    """
+    def size(values):
+        return int(values.max()) + 1 if len(values) else 0
+
+    bounds = {'order_id': size(orders['order_id']), 'user_id': size(orders['user_id']),
+              'product_id': size(products['product_id']) if products is not None else 0}
+    try:
+        import pyarrow.parquet as pq
+        metadata = pq.ParquetFile(data_loader.cache_path('order_products', data_dir, cache_dir)).metadata
+    except (ImportError, FileNotFoundError):
+        return bounds
+    names = metadata.schema.names
+    for group in range(metadata.num_row_groups):
+        for column in ('order_id', 'product_id'):
+            statistics = metadata.row_group(group).column(names.index(column)).statistics
+            if statistics is not None and statistics.has_min_max:
+                bounds[column] = max(bounds[column], int(statistics.max) + 1)
+    return bounds
+
+
+# Counters indexed by a value with a known range are allocated at that size
+VALUE_SIZES = {'hour_counts': 24, 'dow_counts': 7, 'days_since_prior_counts': 31, 'first_order_count': 1}
+
+
+def batch_events(batch, users):
+    """
+    The (counter, ids, weights) triples one batch of order_products adds to the counters.
+
+    `users` holds the user_id of every row's order, -1 where the order is
+    unknown; those rows count for the products but not for the users, the same
+    as merging with orders on order_id would drop them.
+    """
+    order_ids = batch['order_id'].to_numpy()
+    product_ids = batch['product_id'].to_numpy()
+    reordered = batch['reordered'].to_numpy(dtype=np.int64)
+    # add_to_cart_order is NA (or the 999 placeholder) past position 64, never the first item
+    first_in_cart = batch['add_to_cart_order'].to_numpy(dtype=np.int64, na_value=0) == 1
+    known = users >= 0
+    return [
+        ('order_count', product_ids, None),
+        ('reorder_count', product_ids, reordered),
+        ('first_in_cart_count', product_ids[first_in_cart], None),
+        ('items_per_order', order_ids, None),
+        ('user_item_count', users[known], None),
+        ('user_reorder_count', users[known], reordered[known]),
+    ]
+
+
+def order_events(orders):
+    """The (counter, ids, weights) triples rows of the (deduplicated) orders table add to the counters."""
+    days = orders['days_since_prior_order'].to_numpy(dtype=np.float64)
+    first_order = np.isnan(days)
+    return [
+        ('hour_counts', orders['order_hour_of_day'].to_numpy(dtype=np.int64), None),
+        ('dow_counts', orders['order_dow'].to_numpy(dtype=np.int64), None),
+        ('days_since_prior_counts', days[~first_order].astype(np.int64), None),
+        ('first_order_count', np.zeros(int(first_order.sum()), dtype=np.int64), None),
+        ('orders_per_user', orders['user_id'].to_numpy(dtype=np.int64), None),
+    ]
+
+
+def compact_counts(events):
+    """
+    Sum (counter, ids, weights) triples into {counter: (ids, values)} with sorted unique ids.
+
+    Unlike the dense counters, the result is sized by the number of distinct
+    ids in the events, not by the largest id.
+    """
+    compact = {}
+    for name, ids, weights in events:
+        ids, inverse = np.unique(ids, return_inverse=True)
+        compact[name] = (ids, np.bincount(inverse, weights, minlength=len(ids)).astype(np.int64))
+    return compact
+
+
+class PartialAggregates:
+    """
+    Mergeable counters for one or more batches of order_products.
+
+    All counters are int64 arrays indexed by an id (order_id, product_id,
+    user_id) or a value (hour, day of week, days since prior order), so two
+    partial results are combined by adding the arrays.
+
+    With `sizes` (see id_bounds()) every id-indexed counter is allocated once
+    at its final size and batches are added in place, so memory stays the same
+    from the first batch to the last. Ids past the given sizes still work, the
+    counter is then grown to fit.
+    """
+
+    def __init__(self, order_users, counters=None, sizes=None):
+        self.order_users = order_users
+        self.counters = counters if counters is not None else {}
+        for name, id_name in COUNTER_IDS.items():
+            if sizes and sizes.get(id_name) and name not in self.counters:
+                self.counters[name] = np.zeros(sizes[id_name], dtype=np.int64)
+
+    def _add(self, name, ids, weights=None):
+        # Add the per-id counts (or summed weights) of one batch into a counter, in place
+        counter = self.counters.get(name, np.zeros(VALUE_SIZES.get(name, 0), dtype=np.int64))
+        counts = np.bincount(ids, weights, minlength=len(counter))
+        if weights is not None:
+            counts = counts.astype(np.int64)
+        if len(counts) > len(counter):
+            counter = _grow(counter, len(counts))
+        counter[:len(counts)] += counts
+        self.counters[name] = counter
+
+    def add_batch(self, batch):
+        """Fold one batch of order_products rows into the counters."""
+        order_ids = batch['order_id'].to_numpy()
+        in_range = order_ids < len(self.order_users)
+        users = np.full(len(order_ids), -1, dtype=np.int64)
+        users[in_range] = self.order_users[order_ids[in_range]]
+        for name, ids, weights in batch_events(batch, users):
+            self._add(name, ids, weights)
+        return self
+
+    def add_orders(self, orders):
+        """
+        Fold rows of the (deduplicated) orders table into the order-time counters.
+
+        The order -> user map is not touched, it has to be built from the full
+        orders table up front.
+        """
+        for name, ids, weights in order_events(orders):
+            self._add(name, ids, weights)
+        return self
+
+    def add_compact(self, compact):
+        """
+        Add counts given as {counter: (ids, values)} in place (see compact_counts()).
+
+        The ids of one counter must be unique. A counter that is too short is
+        grown to at least twice its size, so adding many small deltas with
+        growing ids does not copy it every time.
+        """
+        for name, (ids, values) in compact.items():
+            counter = self.counters.get(name, np.zeros(VALUE_SIZES.get(name, 0), dtype=np.int64))
+            if len(ids) and ids.max() >= len(counter):
+                counter = _grow(counter, max(int(ids.max()) + 1, 2 * len(counter)))
+            counter[ids] += values
+            self.counters[name] = counter
+        return self
+
+    def merge(self, other):
+        """Return a new PartialAggregates holding the sum of both."""
+        return PartialAggregates(self.order_users, add_counters(self.counters, other.counters))
+
+    def _value_counts(self, name, column):
+        # Nonzero bins of a counter as a Series shaped like df[column].value_counts().sort_index()
+        counts = self.counters.get(name, np.zeros(0, dtype=np.int64))
+        values = np.flatnonzero(counts)
+        dtype = data_loader.SCHEMAS['orders']['dtypes'][column]
+        return pd.Series(counts[values], index=pd.Index(values.astype(dtype), name=column), name='count')
+
+    def hourly_counts(self):
+        """Number of orders per hour of day."""
+        return self._value_counts('hour_counts', 'order_hour_of_day')
+
+    def dow_counts(self):
+        """Number of orders per day of week."""
+        return self._value_counts('dow_counts', 'order_dow')
+
+    def days_since_prior_counts(self):
+        """Number of orders per days_since_prior_order value (first orders are not counted)."""
+        return self._value_counts('days_since_prior_counts', 'days_since_prior_order')
+
+    def orders_per_user(self):
+        """Number of orders per user, like orders.groupby('user_id')['order_id'].count()."""
+        counts = self.counters.get('orders_per_user', np.zeros(0, dtype=np.int64))
+        user_ids = np.flatnonzero(counts)
+        user_ids = user_ids.astype(data_loader.SCHEMAS['orders']['dtypes']['user_id'])
+        return pd.Series(counts[user_ids], index=pd.Index(user_ids, name='user_id'), name='order_id')
+
+    def items_per_order(self):
+        """Number of products in each order, like groupby('order_id')['product_id'].count()."""
+        counts = self.counters.get('items_per_order', np.zeros(0, dtype=np.int64))
+        order_ids = np.flatnonzero(counts).astype(data_loader.SCHEMAS['orders']['dtypes']['order_id'])
+        return pd.Series(counts[order_ids], index=pd.Index(order_ids, name='order_id'), name='product_id')
+
+    def product_metrics(self, products=None):
+        """Per-product counters and reorder rate, see product_metrics.metrics_frame()."""
+        empty = np.zeros(0, dtype=np.int64)
+        counters = {name: self.counters.get(name, empty) for name in
+                    ('order_count', 'reorder_count', 'first_in_cart_count')}
+        return metrics_frame(counters, products)
+
+    def user_reorder_rate(self):
+        """Share of each user's items that are reorders, like the merge + groupby('user_id') version."""
+        item_count = self.counters.get('user_item_count', np.zeros(0, dtype=np.int64))
+        reorder_count = self.counters.get('user_reorder_count', np.zeros(0, dtype=np.int64))
+        user_ids = np.flatnonzero(item_count)
+        rate = reorder_count[user_ids] / item_count[user_ids]
+        user_ids = user_ids.astype(data_loader.SCHEMAS['orders']['dtypes']['user_id'])
+        return pd.Series(rate, index=pd.Index(user_ids, name='user_id'), name='reordered')
+
+
+def stream_aggregates(orders, batches, sizes=None):
+    """
+    Fold an iterable of order_products batches into a PartialAggregates.
+
+    `sizes` pre-allocates the counters (see id_bounds()); by default they are
+    sized from `orders` and grow when a batch has larger product ids.
+    """
+    order_users = order_user_map(orders)
+    if sizes is None:
+        sizes = {'order_id': len(order_users), 'user_id': int(orders['user_id'].max()) + 1 if len(orders) else 0}
+    aggregates = PartialAggregates(order_users, sizes=sizes)
+    for batch in batches:
+        aggregates.add_batch(batch)
+    return aggregates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate order_products in fixed-size batches.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS)
+    args = parser.parse_args()
+
+    # orders and products are small enough to load whole
+    orders = clean_orders(data_loader.load_table('orders', data_dir=args.data_dir))
+    products = clean_products(data_loader.load_table('products', data_dir=args.data_dir))
+
+    sizes = id_bounds(orders, products, args.data_dir)
+    aggregates = stream_aggregates(orders, iter_order_products(args.data_dir, args.batch_rows), sizes)
+
+    metrics = aggregates.product_metrics(products)
+    print(top_products(metrics, 'order_count', products))
+    print(top_products(metrics, 'reorder_count', products))
+    print(top_products(metrics, 'first_in_cart_count', products))
+    print(aggregates.items_per_order().value_counts().sort_index())
+    print(top_k(aggregates.user_reorder_rate(), 20))
+
+
+if __name__ == '__main__':
+    main()
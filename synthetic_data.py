@@ -0,0 +1,233 @@
+"""
+Seeded generator of synthetic Instacart-style data at any scale.
+
+Writes the five semicolon-separated files with the same columns as the real
+dataset, including the quirks instacart_analysis.py deals with:
+
+* days_since_prior_order is empty for every customer's first order
+* add_to_cart_order is empty past the 64th item of a basket
+* a few orders are duplicated
+* some product names differ only in capitalization
+* products in aisle 100 / department 21 have no name
+
+Baskets never repeat a product, and reordered is 1 exactly when the customer
+bought the product in one of their earlier orders.
+
+order_products is generated and written a chunk of orders at a time, so
+100M-row files can be produced with memory bounded by the number of users.
+
+    python synthetic_data.py --rows 10000000 --out-dir /data/synthetic-10m --seed 0
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+
+N_AISLES = 134
+N_DEPARTMENTS = 21
+MISSING_AISLE = 100
+MISSING_DEPARTMENT = 21
+
+MEAN_BASKET_SIZE = 10
+MEAN_ORDERS_PER_USER = 16
+MAX_CART_POSITION = 64
+MAX_ORDERS_PER_USER = 100
+# Products on every user's shortlist, and the share of items drawn from it
+# (gives a reorder rate close to the real data's 59%)
+FAVOURITES = 20
+FAVOURITE_SHARE = 0.75
+
+# Relative order volume per hour of day and per day of week (Sunday and Monday are busiest)
+HOUR_WEIGHTS = np.array([4, 2, 1, 1, 1, 2, 6, 18, 35, 50, 56, 56, 54, 54, 55, 53, 50, 42, 34, 27, 20, 16, 12, 8])
+DOW_WEIGHTS = np.array([60, 57, 45, 42, 42, 45, 45])
+
+WORDS = ('Organic', 'Fresh', 'Whole', 'Large', 'Baby', 'Low Fat', 'Sparkling', 'Greek', 'Natural',
+         'Banana', 'Spinach', 'Avocado', 'Lemon', 'Milk', 'Water', 'Yogurt', 'Bread', 'Cheese',
+         'Strawberries', 'Chicken', 'Eggs', 'Butter', 'Coffee', 'Tea', 'Juice', 'Chips', 'Soup')
+
+
+def _write(df, path, mode='w', header=True):
+    df.to_csv(path, sep=';', index=False, mode=mode, header=header)
+
+
+def scale(rows):
+    """Number of orders, users and products for about `rows` order_products rows."""
+    n_orders = max(1, rows // MEAN_BASKET_SIZE)
+    n_users = max(1, n_orders // MEAN_ORDERS_PER_USER)
+    n_products = int(min(49_688, max(100, rows // 20)))
+    return n_orders, n_users, n_products
+
+
+def generate_products(rng, n_products, case_variants=0.002, missing_names=0.025):
+    """Products with random names, a few case-variant duplicates and unnamed aisle 100 items."""
+    first = rng.choice(WORDS, n_products)
+    second = rng.choice(WORDS, n_products)
+    names = pd.Series(first).str.cat(pd.Series(second), sep=' ').str.cat(
+        pd.Series(np.arange(1, n_products + 1).astype(str)), sep=' ')
+
+    # Copy some names onto other products with different capitalization
+    n_variants = int(n_products * case_variants)
+    sources = rng.choice(n_products, n_variants, replace=False)
+    targets = rng.choice(n_products, n_variants, replace=False)
+    names.iloc[targets] = names.iloc[sources].str.upper().to_numpy()
+
+    aisles = rng.integers(1, N_AISLES + 1, n_products)
+    departments = rng.integers(1, N_DEPARTMENTS, n_products)
+    missing = rng.random(n_products) < missing_names
+    names[missing] = None
+    aisles[missing] = MISSING_AISLE
+    departments[missing] = MISSING_DEPARTMENT
+    # Aisle 100 / department 21 only hold the unnamed products
+    aisles[~missing & (aisles == MISSING_AISLE)] = 1
+
+    return pd.DataFrame({
+        'product_id': np.arange(1, n_products + 1),
+        'product_name': names,
+        'aisle_id': aisles,
+        'department_id': departments,
+    })
+
+
+def generate_orders(rng, n_orders, n_users, duplicates=15):
+    """Orders grouped per user, with empty days_since_prior_order on first orders and a few duplicates."""
+    per_user = np.clip(rng.geometric(1 / MEAN_ORDERS_PER_USER, n_users), 1, MAX_ORDERS_PER_USER)
+    # Drop the last users if the total went past n_orders
+    per_user = per_user[np.cumsum(per_user) <= n_orders] if per_user.sum() > n_orders else per_user
+    user_ids = np.repeat(np.arange(1, len(per_user) + 1), per_user)
+    total = len(user_ids)
+    starts = np.repeat(np.cumsum(per_user) - per_user, per_user)
+    order_number = np.arange(total) - starts + 1
+
+    # Waits cluster around a week and a month, capped at 30 days like the real data
+    days = np.where(rng.random(total) < 0.3, 7, rng.integers(0, 31, total)).astype(np.float64)
+    days[rng.random(total) < 0.1] = 30
+    days[order_number == 1] = np.nan
+
+    orders = pd.DataFrame({
+        'order_id': rng.permutation(total) + 1,
+        'user_id': user_ids,
+        'order_number': order_number,
+        'order_dow': rng.choice(7, total, p=DOW_WEIGHTS / DOW_WEIGHTS.sum()),
+        'order_hour_of_day': rng.choice(24, total, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum()),
+        'days_since_prior_order': days,
+    })
+    extra = orders.iloc[rng.choice(total, min(duplicates, total), replace=False)]
+    return pd.concat([orders, extra], ignore_index=True)
+
+
+def _popularity(n_products):
+    popularity = 1 / np.arange(1, n_products + 1) ** 0.9
+    return popularity / popularity.sum()
+
+
+def generate_favourites(rng, n_users, n_products):
+    """Every user's shortlist of FAVOURITES products they keep coming back to, drawn by popularity."""
+    return (rng.choice(n_products, (n_users, FAVOURITES), p=_popularity(n_products)) + 1).astype(np.int32)
+
+
+def _sample_baskets(rng, basket_of_row, favourites_of_row, n_products, favourite_share):
+    # Each item is one of the user's favourites or a Zipf-like draw over all products;
+    # repeats inside a basket are redrawn until every basket holds distinct products
+    # (sampling without replacement per order)
+    popularity = _popularity(n_products)
+
+    def draw(rows):
+        products = rng.choice(n_products, len(rows), p=popularity) + 1
+        favourite = rng.random(len(rows)) < favourite_share
+        picks = rng.integers(0, FAVOURITES, int(favourite.sum()))
+        products[favourite] = favourites_of_row[rows[favourite], picks]
+        return products
+
+    product_ids = draw(np.arange(len(basket_of_row)))
+    while True:
+        keys = basket_of_row * (n_products + 1) + product_ids
+        repeated = np.flatnonzero(pd.Series(keys).duplicated().to_numpy())
+        if not len(repeated):
+            return product_ids
+        product_ids[repeated] = draw(repeated)
+
+
+def generate_order_products(rng, order_ids, user_ids, n_products, favourites, history=None,
+                            favourite_share=FAVOURITE_SHARE):
+    """
+    Baskets for a chunk of orders; popular products follow a Zipf-like distribution.
+
+    Orders must come in timeline order (grouped by user, by order_number).
+    About `favourite_share` of the items come from the user's row of
+    `favourites` (see generate_favourites()), which is what makes customers
+    reorder. A basket never holds the same product twice, and an item is
+    reordered exactly when its user bought the product in an earlier order. `history`
+    holds the user * (n_products + 1) + product_id keys of the earlier
+    purchases of the chunk's first user; the same keys for the chunk's last
+    user are returned with the rows, to pass on to the next chunk.
+    """
+    sizes = np.clip(rng.geometric(1 / MEAN_BASKET_SIZE, len(order_ids)), 1, min(127, n_products))
+    rows = int(sizes.sum())
+    starts = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    position = np.arange(rows) - starts + 1
+    users = np.repeat(np.asarray(user_ids, dtype=np.int64), sizes)
+    product_ids = _sample_baskets(rng, np.repeat(np.arange(len(order_ids)), sizes), favourites[users - 1],
+                                  n_products, favourite_share)
+
+    earlier = np.zeros(0, dtype=np.int64) if history is None else history
+    keys = np.concatenate([earlier, users * (n_products + 1) + product_ids])
+    reordered = pd.Series(keys).duplicated().to_numpy()[len(earlier):]
+    last_user = user_ids[-1] if len(user_ids) else -1
+    history = np.unique(keys[keys // (n_products + 1) == last_user])
+
+    cart = position.astype(np.float64)
+    cart[position > MAX_CART_POSITION] = np.nan
+    order_products = pd.DataFrame({
+        'order_id': np.repeat(order_ids, sizes),
+        'product_id': product_ids,
+        'add_to_cart_order': cart,
+        'reordered': reordered.astype(np.int8),
+    })
+    return order_products, history
+
+
+def generate(out_dir, rows=1_000_000, seed=0, chunk_orders=500_000):
+    """Write the five files for about `rows` order_products rows into `out_dir`."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    n_orders, n_users, n_products = scale(rows)
+
+    path = lambda table: data_loader.source_path(table, out_dir)
+    _write(pd.DataFrame({'department_id': np.arange(1, N_DEPARTMENTS + 1),
+                         'department': [f'department {i}' for i in range(1, N_DEPARTMENTS)] + ['missing']}),
+           path('departments'))
+    _write(pd.DataFrame({'aisle_id': np.arange(1, N_AISLES + 1),
+                         'aisle': [f'aisle {i}' if i != MISSING_AISLE else 'missing' for i in range(1, N_AISLES + 1)]}),
+           path('aisles'))
+    _write(generate_products(rng, n_products), path('products'))
+
+    orders = generate_orders(rng, n_orders, n_users)
+    _write(orders, path('orders'))
+
+    # The duplicated orders are at the end, so this keeps the timeline order
+    unique_orders = orders.drop_duplicates('order_id')
+    order_ids, user_ids = unique_orders['order_id'].to_numpy(), unique_orders['user_id'].to_numpy()
+    favourites = generate_favourites(rng, int(user_ids.max()) if len(user_ids) else 0, n_products)
+    history = None
+    for start in range(0, len(order_ids), chunk_orders):
+        end = start + chunk_orders
+        chunk, history = generate_order_products(rng, order_ids[start:end], user_ids[start:end], n_products,
+                                                 favourites, history)
+        _write(chunk, path('order_products'), mode='w' if start == 0 else 'a', header=start == 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic Instacart-style data.')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='approximate order_products rows')
+    parser.add_argument('--out-dir', required=True)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.out_dir, args.rows, args.seed)
+
+
+if __name__ == '__main__':
+    main()
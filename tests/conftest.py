@@ -0,0 +1,31 @@
+"""Shared fixtures: a small synthetic dataset written once per test session."""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_loader  # noqa: E402
+import synthetic_data  # noqa: E402
+
+ROWS = 20_000
+
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('data'))
+    synthetic_data.generate(path, rows=ROWS, seed=1)
+    return path
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'cache')
+
+
+@pytest.fixture(scope='session')
+def tables(data_dir, tmp_path_factory):
+    """The five raw tables, as loaded by data_loader."""
+    return data_loader.load_all(data_dir=data_dir, cache_dir=str(tmp_path_factory.mktemp('cache')))
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cleaning
+from backends import BACKENDS, RESULTS, _comparable, check_parity, get_backend, run_analyses
+from product_metrics import product_metrics
+
+
+def _run(name, tables):
+    return run_analyses(get_backend(name), tables['orders'], tables['products'], tables['order_products'])
+
+
+def test_pandas_backend_matches_cleaning(tables):
+    results = _run('pandas', tables)
+    assert set(results) == set(RESULTS)
+    orders = cleaning.clean_orders(tables['orders'])
+    products = cleaning.clean_products(tables['products'])
+    order_products = cleaning.clean_order_products(tables['order_products'])
+    for name, expected in (('orders', orders), ('products', products), ('order_products', order_products)):
+        pd.testing.assert_frame_equal(_comparable(results[name]), _comparable(expected), obj=name)
+
+    np.testing.assert_array_equal(results['hourly_counts'], orders['order_hour_of_day'].value_counts().sort_index())
+    np.testing.assert_array_equal(results['orders_per_user'], orders.groupby('user_id').size())
+    np.testing.assert_array_equal(results['items_per_order'], order_products.groupby('order_id').size())
+
+    metrics = results['product_metrics']
+    expected = product_metrics(order_products, products)
+    np.testing.assert_array_equal(metrics.index, expected.index)
+    for column in ('order_count', 'reorder_count', 'first_in_cart_count'):
+        np.testing.assert_array_equal(metrics[column], expected[column])
+    np.testing.assert_allclose(metrics['reorder_rate'], expected['reorder_rate'])
+
+    items = order_products.merge(orders, on='order_id')
+    np.testing.assert_allclose(results['user_reorder_rate'], items.groupby('user_id')['reordered'].mean())
+
+
+@pytest.mark.parametrize('name', [name for name in BACKENDS if name != 'pandas'])
+def test_engines_match_pandas(tables, name):
+    pytest.importorskip(name)
+    check_parity(_run(name, tables), _run('pandas', tables))
+
+
+def test_check_parity_reports_differences(tables):
+    expected = _run('pandas', tables)
+    results = dict(expected, dow_counts=expected['dow_counts'] + 1)
+    with pytest.raises(AssertionError, match='dow_counts'):
+        check_parity(results, expected)
+
+
+def test_unknown_backend():
+    with pytest.raises(KeyError):
+        get_backend('spark')
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from basket_pairs import co_purchases, column_blocks, incidence_matrix, name_pairs
+from cleaning import clean_order_products, clean_products
+
+
+def _reference(order_products, k, min_support, min_pair_count, metric):
+    # Self-merge of the baskets on order_id, then groupby pair
+    items = order_products[['order_id', 'product_id']].drop_duplicates()
+    support = items.groupby('product_id').size()
+    items = items[items['product_id'].map(support) >= min_support]
+    pairs = items.merge(items, on='order_id', suffixes=('', '_other'))
+    pairs = pairs[pairs['product_id'] != pairs['product_id_other']]
+    pairs = pairs.groupby(['product_id', 'product_id_other']).size().rename('pair_count').reset_index()
+    pairs = pairs.rename(columns={'product_id_other': 'other_product_id'})
+    pairs = pairs[pairs['pair_count'] >= min_pair_count]
+    n_orders = order_products['order_id'].nunique()
+    product_support = support.loc[pairs['product_id']].to_numpy()
+    pairs['confidence'] = pairs['pair_count'] / product_support
+    pairs['lift'] = pairs['pair_count'] * n_orders / (
+        product_support.astype(np.float64) * support.loc[pairs['other_product_id']].to_numpy())
+    pairs = pairs.sort_values(['product_id', metric, 'other_product_id'], ascending=[True, False, True])
+    pairs['rank'] = pairs.groupby('product_id').cumcount() + 1
+    return pairs[pairs['rank'] <= k].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('metric', ['pair_count', 'confidence', 'lift'])
+def test_matches_self_merge(tables, metric):
+    order_products = clean_order_products(tables['order_products'])
+    # A tiny budget forces many column blocks
+    pairs = co_purchases(order_products, k=5, min_support=3, min_pair_count=2, metric=metric, memory_budget=2**16)
+    expected = _reference(order_products, 5, 3, 2, metric)
+    for column in ('product_id', 'other_product_id', 'rank', 'pair_count'):
+        np.testing.assert_array_equal(pairs[column], expected[column])
+    np.testing.assert_allclose(pairs['confidence'], expected['confidence'])
+    np.testing.assert_allclose(pairs['lift'], expected['lift'])
+
+
+def test_incidence_matrix_and_blocks():
+    order_products = pd.DataFrame({'order_id': [10, 10, 10, 11, 12, 12],
+                                   'product_id': [5, 7, 5, 7, 5, 9]})
+    matrix, product_ids, support, n_orders = incidence_matrix(order_products, min_support=2)
+    np.testing.assert_array_equal(product_ids, [5, 7])
+    np.testing.assert_array_equal(support, [2, 2])
+    assert n_orders == 3 and matrix.max() == 1
+
+    blocks = column_blocks(matrix, memory_budget=1)
+    assert blocks == [(0, 1), (1, 2)]
+    assert column_blocks(matrix, memory_budget=2**30) == [(0, 2)]
+
+
+def test_unknown_metric_and_names(tables):
+    order_products = clean_order_products(tables['order_products'])
+    with pytest.raises(ValueError):
+        co_purchases(order_products, metric='support')
+    products = clean_products(tables['products'])
+    pairs = co_purchases(order_products, k=2, min_support=20)
+    named = name_pairs(pairs, products)
+    names = products.set_index('product_id')['product_name']
+    np.testing.assert_array_equal(named['other_product_name'], names.loc[pairs['other_product_id']])
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from charts import FIGURES, chart_data, render_all
+from cleaning import clean_order_products, clean_orders
+from pipeline import Pipeline
+
+
+@pytest.fixture(scope='module')
+def store_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp('store'))
+
+
+@pytest.fixture(scope='module')
+def data(data_dir, tmp_path_factory, store_dir):
+    return chart_data(Pipeline(data_dir, str(tmp_path_factory.mktemp('cache')), store_dir))
+
+
+def test_series_match_the_full_tables(data, tables):
+    orders = clean_orders(tables['orders'])
+    order_products = clean_order_products(tables['order_products'])
+    assert set(data) == set(FIGURES)
+    customers = orders.groupby('user_id')['order_id'].count().value_counts().sort_index()
+    np.testing.assert_array_equal(data['orders_per_customer'].index, customers.index)
+    np.testing.assert_array_equal(data['orders_per_customer'].to_numpy(), customers.to_numpy())
+    sizes = order_products.groupby('order_id')['product_id'].count().value_counts().sort_index()
+    np.testing.assert_array_equal(data['order_sizes'].to_numpy(), sizes.to_numpy())
+    assert (data['order_sizes_filtered'].index < 35).all()
+    hours = orders['order_hour_of_day'].value_counts()
+    assert data['orders_by_hour'][data['orders_by_hour'] > 0].to_dict() == hours.to_dict()
+    assert data['top_20_products'].iloc[0] == order_products['product_id'].value_counts().iloc[0]
+
+
+def test_second_run_reads_the_store(data, data_dir, tmp_path, store_dir):
+    pipeline = Pipeline(data_dir, str(tmp_path / 'cache'), store_dir)
+    chart_data(pipeline)
+    assert pipeline.computed == []
+
+
+def test_unchanged_figures_are_not_redrawn(data, tmp_path):
+    small = {name: data[name] for name in ('orders_by_dow', 'wednesday_vs_saturday')}
+    assert set(render_all(small, str(tmp_path), workers=1).values()) == {'rendered'}
+    assert set(render_all(small, str(tmp_path), workers=1).values()) == {'unchanged'}
+    assert (tmp_path / 'orders_by_dow.png').exists()
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from cleaning import MISSING_CART_POSITION, clean_order_products, clean_orders, clean_products
+from compact import COMPACT_CART_SENTINEL, compact_table, compact_tables, memory_report
+
+
+def test_compact_tables_keep_values(tables):
+    cleaned = {
+        'orders': clean_orders(tables['orders']),
+        'products': clean_products(tables['products']),
+        'order_products': clean_order_products(tables['order_products']),
+    }
+    compacted = compact_tables(cleaned, report=False)
+    for table, df in cleaned.items():
+        for column in df.columns:
+            before, after = df[column], compacted[table][column]
+            if column == 'add_to_cart_order':
+                positions = before.to_numpy(dtype=np.int64, na_value=MISSING_CART_POSITION)
+                expected = np.where(positions == MISSING_CART_POSITION, COMPACT_CART_SENTINEL, positions)
+                np.testing.assert_array_equal(after, expected)
+                assert after.dtype == np.uint8
+            else:
+                pd.testing.assert_series_equal(after.astype(before.dtype), before)
+
+    report = memory_report(cleaned, compacted)
+    assert (report['after_bytes'] <= report['before_bytes']).all()
+    assert report.loc['order_products', 'ratio'] < 1
+
+
+def test_downcast_picks_smallest_type():
+    df = pd.DataFrame({'small': np.array([0, 200], dtype=np.int64), 'signed': np.array([-5, 5], dtype=np.int64),
+                       'days_since_prior_order': [np.nan, 30.0]})
+    compacted = compact_table(df)
+    assert compacted['small'].dtype == np.uint8
+    assert compacted['signed'].dtype == np.int8
+    assert str(compacted['days_since_prior_order'].dtype) == 'UInt8'
+    assert compacted['days_since_prior_order'].isna().tolist() == [True, False]
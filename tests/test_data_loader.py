@@ -0,0 +1,73 @@
+import os
+
+import pandas as pd
+import pytest
+
+import data_loader
+from parallel_csv import downcast
+
+
+def _write_orders(path, hour):
+    path.joinpath('instacart_orders.csv').write_text(
+        'order_id;user_id;order_number;order_dow;order_hour_of_day;days_since_prior_order\n'
+        f'1;1;1;4;{hour};\n'
+        '2;1;2;1;7;1.0\n'
+    )
+
+
+def test_declared_dtypes(tables):
+    for table, df in tables.items():
+        expected = data_loader.SCHEMAS[table]['dtypes']
+        assert list(df.columns) == list(expected)
+        for column, dtype in expected.items():
+            if dtype != 'str':
+                assert str(df[column].dtype) == dtype, (table, column)
+
+
+def test_cache_matches_parse(data_dir, cache_dir):
+    for table in data_loader.SCHEMAS:
+        parsed = data_loader.parse_csv(table, data_dir)
+        data_loader.load_table(table, data_dir=data_dir, cache_dir=cache_dir)
+        cached = data_loader.load_table(table, data_dir=data_dir, cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(cached, parsed, check_dtype=False)
+
+
+def test_out_of_range_value_raises(tmp_path):
+    _write_orders(tmp_path, 266)
+    with pytest.raises(ValueError, match='order_hour_of_day'):
+        data_loader.parse_csv('orders', str(tmp_path))
+
+
+def test_in_range_values_parse(tmp_path):
+    _write_orders(tmp_path, 23)
+    orders = data_loader.parse_csv('orders', str(tmp_path))
+    assert orders['order_hour_of_day'].tolist() == [23, 7]
+    assert str(orders['order_hour_of_day'].dtype) == 'int8'
+
+
+def test_downcast_keeps_missing_values():
+    df = pd.DataFrame({'add_to_cart_order': pd.array([1, None, 64], dtype='Int64')})
+    narrowed = downcast(df, {'add_to_cart_order': 'Int16'})
+    assert str(narrowed['add_to_cart_order'].dtype) == 'Int16'
+    assert narrowed['add_to_cart_order'].isna().tolist() == [False, True, False]
+    with pytest.raises(ValueError):
+        downcast(pd.DataFrame({'x': pd.array([40000], dtype='Int64')}), {'x': 'Int16'})
+
+
+def test_data_dirs_share_the_cache(tmp_path, cache_dir):
+    for name, hour in (('a', 7), ('b', 9)):
+        tmp_path.joinpath(name).mkdir()
+        _write_orders(tmp_path / name, hour)
+    first = data_loader.load_table('orders', data_dir=str(tmp_path / 'a'), cache_dir=cache_dir)
+    second = data_loader.load_table('orders', data_dir=str(tmp_path / 'b'), cache_dir=cache_dir)
+    assert first['order_hour_of_day'].tolist()[0] == 7 and second['order_hour_of_day'].tolist()[0] == 9
+    # Loading b leaves a's entry in place
+    assert os.path.exists(data_loader.cache_path('orders', str(tmp_path / 'a'), cache_dir))
+
+    # A new version of a's file replaces only a's old entry
+    old = data_loader.cache_path('orders', str(tmp_path / 'a'), cache_dir)
+    _write_orders(tmp_path / 'a', 8)
+    os.utime(tmp_path / 'a' / 'instacart_orders.csv', ns=(1, 1))
+    data_loader.load_table('orders', data_dir=str(tmp_path / 'a'), cache_dir=cache_dir)
+    assert not os.path.exists(old)
+    assert os.path.exists(data_loader.cache_path('orders', str(tmp_path / 'b'), cache_dir))
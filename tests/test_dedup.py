@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from dedup import SeenSet, find_duplicates, row_hashes
+
+
+def test_find_duplicates_matches_pandas():
+    df = pd.DataFrame({'id': [1, 2, 2, 3, 1, 4], 'name': ['a', 'B', 'B', 'b', 'a', 'C'],
+                       'value': [0, 1, 1, 2, 0, 3]})
+    report = find_duplicates(df, key='id', name_column='name')
+    np.testing.assert_array_equal(report.exact, df.duplicated().to_numpy())
+    np.testing.assert_array_equal(report.key_collisions, df['id'].duplicated().to_numpy() & ~df.duplicated().to_numpy())
+    np.testing.assert_array_equal(report.name_clashes, df['name'].str.lower().duplicated().to_numpy())
+
+
+def test_seen_set_matches_a_python_set(tmp_path):
+    rng = np.random.default_rng(0)
+    seen, reference = SeenSet(), set()
+    for size in rng.integers(0, 300, 60):
+        hashes = rng.integers(0, 2_000, size).astype(np.uint64)
+        expected = []
+        for value in hashes.tolist():
+            expected.append(value not in reference)
+            reference.add(value)
+        np.testing.assert_array_equal(seen.add(hashes), expected)
+        assert len(seen) == len(reference)
+    # The runs stay few and sorted, and merge into the whole set
+    assert len(seen._runs) <= 2 * int(np.log2(len(reference))) + 1
+    np.testing.assert_array_equal(seen.hashes, np.array(sorted(reference), dtype=np.uint64))
+
+    seen.save(str(tmp_path / 'seen.npy'))
+    loaded = SeenSet.load(str(tmp_path / 'seen.npy'))
+    assert loaded.contains(np.array(sorted(reference), dtype=np.uint64)).all()
+    assert not loaded.contains(np.array([5_000], dtype=np.uint64)).any()
+
+
+def test_new_rows_across_batches():
+    seen = SeenSet()
+    first = pd.DataFrame({'order_id': [1, 2, 2], 'user_id': [7, 8, 8]})
+    second = pd.DataFrame({'order_id': [2, 3], 'user_id': [8, 9]})
+    assert seen.new_rows(first).tolist() == [True, True, False]
+    assert seen.new_rows(second).tolist() == [False, True]
+    assert len(seen) == 3
+    assert seen.contains(row_hashes(second)).all()
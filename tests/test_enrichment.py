@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cleaning import clean_products
+from enrichment import lookup_positions, product_positions
+
+
+def test_lookup_matches_merge(tables):
+    products = clean_products(tables['products'])
+    order_products = tables['order_products']
+    positions = lookup_positions(product_positions(products), order_products['product_id'].to_numpy())
+    known = positions >= 0
+    merged = order_products.merge(products, on='product_id')
+    assert known.sum() == len(merged)
+    np.testing.assert_array_equal(products['product_name'].to_numpy()[positions[known]],
+                                  merged['product_name'].to_numpy())
+
+
+def test_unknown_and_negative_ids():
+    positions = product_positions(pd.DataFrame({'product_id': [3, 1]}))
+    assert lookup_positions(positions, [1, 3, 2, 7, -1]).tolist() == [1, 0, -1, -1, -1]
+
+
+def test_duplicate_ids_rejected():
+    with pytest.raises(ValueError):
+        product_positions(pd.DataFrame({'product_id': [1, 1]}))
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import incremental
+from incremental import AggregateState, update
+from streaming import PartialAggregates, order_user_map
+
+
+@pytest.fixture(scope='module')
+def drops(tables):
+    # Three drops split by order_id, the second re-delivering part of the first
+    orders, order_products = tables['orders'], tables['order_products']
+    bounds = np.quantile(orders['order_id'], [0, 1 / 3, 2 / 3, 1]).astype(np.int64)
+    split = []
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        in_orders = (orders['order_id'] >= low) & (orders['order_id'] < high + (high == bounds[-1]))
+        in_items = order_products['order_id'].isin(orders.loc[in_orders, 'order_id'])
+        split.append((orders[in_orders], order_products[in_items]))
+    first_orders, first_items = split[0]
+    split[1] = (pd.concat([split[1][0], first_orders.head(50)]), pd.concat([split[1][1], first_items.head(500)]))
+    return split
+
+
+@pytest.fixture(scope='module')
+def expected(tables):
+    orders = tables['orders'].drop_duplicates()
+    orders = orders[~orders['order_id'].duplicated()]
+    return PartialAggregates(order_user_map(orders)).add_orders(orders).add_batch(tables['order_products'])
+
+
+def _check(state, expected, order_products):
+    aggregates = state.aggregates
+    for name in ('hourly_counts', 'dow_counts', 'days_since_prior_counts', 'orders_per_user', 'items_per_order',
+                 'user_reorder_rate'):
+        pd.testing.assert_series_equal(getattr(aggregates, name)(), getattr(expected, name)(), check_exact=True)
+    pd.testing.assert_frame_equal(aggregates.product_metrics(), expected.product_metrics())
+    sizes = order_products.groupby('order_id')['product_id'].count().value_counts().sort_index()
+    np.testing.assert_array_equal(state.order_size_distribution().to_numpy(), sizes.to_numpy())
+    np.testing.assert_array_equal(state.order_size_distribution().index, sizes.index)
+
+
+@pytest.mark.parametrize('compact_every', [2, 30])
+def test_drops_add_up_to_the_full_history(tmp_path, monkeypatch, tables, drops, expected, compact_every):
+    monkeypatch.setattr(incremental, 'COMPACT_EVERY', compact_every)
+    path = str(tmp_path / 'state.npz')
+    for orders, order_products in drops:
+        update(path, orders, order_products)
+    # Delivering the first drop again changes nothing
+    state = update(path, *drops[0])
+    _check(AggregateState.load(path), expected, tables['order_products'])
+    _check(state, expected, tables['order_products'])
+
+
+def test_save_writes_deltas_until_compaction(tmp_path, monkeypatch, drops):
+    monkeypatch.setattr(incremental, 'COMPACT_EVERY', 3)
+    path = str(tmp_path / 'state.npz')
+    update(path, *drops[0])
+    base = (tmp_path / 'state.npz').read_bytes()
+    update(path, *drops[1])
+    update(path, *drops[2])
+    assert (tmp_path / 'state.npz').read_bytes() == base
+    assert sorted(p.name for p in tmp_path.glob('*.delta')) == ['state.npz.1.1.delta', 'state.npz.1.2.delta']
+    update(path, drops[0][0].head(0), drops[0][1].head(0))
+    assert not list(tmp_path.glob('*.delta'))
+    assert AggregateState.load(path).generation == 2
+
+
+@pytest.mark.parametrize('compact_every', [2, 30])
+def test_items_only_drop_delivered_twice(tmp_path, monkeypatch, tables, drops, expected, compact_every):
+    monkeypatch.setattr(incremental, 'COMPACT_EVERY', compact_every)
+    path = str(tmp_path / 'state.npz')
+    (first_orders, first_items), *rest = drops
+    # The items arrive (twice) before their orders
+    update(path, first_orders.head(0), first_items)
+    state = update(path, first_orders.head(0), first_items)
+    assert len(state.held) == len(first_items)
+    assert not state.aggregates.counters.get('order_count', np.zeros(0)).any()
+    update(path, first_orders, first_items.head(0))
+    for orders, order_products in rest:
+        update(path, orders, order_products)
+    state = AggregateState.load(path)
+    assert state.held is None
+    _check(state, expected, tables['order_products'])
@@ -0,0 +1,45 @@
+import pytest
+
+import data_loader
+import synthetic_data
+from cleaning import clean_order_products, clean_orders, clean_products
+from parallel import check_against_serial, parallel_results, read_unit, serial_results, work_units
+
+
+@pytest.fixture(scope='module')
+def expected(tables):
+    orders = clean_orders(tables['orders'])
+    products = clean_products(tables['products'])
+    return orders, products, serial_results(orders, clean_order_products(tables['order_products']), products)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_csv_byte_ranges_match_serial(data_dir, cache_dir, expected, workers):
+    orders, products, serial = expected
+    assert len(work_units(data_dir, cache_dir, chunk_bytes=20_000)) > 1
+    results = parallel_results(orders, products, data_dir, cache_dir, workers, chunk_bytes=20_000)
+    check_against_serial(results, serial)
+
+
+def test_parquet_row_groups_match_serial(data_dir, cache_dir, expected):
+    orders, products, serial = expected
+    data_loader.load_table('order_products', data_dir=data_dir, cache_dir=cache_dir)
+    assert work_units(data_dir, cache_dir)[0][0] == 'parquet'
+    check_against_serial(parallel_results(orders, products, data_dir, cache_dir, workers=2), serial)
+
+
+@pytest.mark.parametrize('workers', [3, 8, 32])
+def test_parquet_units_cover_every_worker(data_dir, cache_dir, workers):
+    data_loader.load_table('order_products', data_dir=data_dir, cache_dir=cache_dir)
+    units = work_units(data_dir, cache_dir, workers=workers)
+    assert len(units) >= workers
+    # The slices cover every row exactly once
+    rows = sum(len(read_unit(unit)) for unit in units)
+    assert rows == len(data_loader.load_table('order_products', data_dir=data_dir, cache_dir=cache_dir))
+
+
+def test_row_groups_are_small(tmp_path):
+    synthetic_data.generate(str(tmp_path / 'data'), rows=3 * data_loader.ROW_GROUP_ROWS, seed=2)
+    data_loader.load_table('order_products', data_dir=str(tmp_path / 'data'), cache_dir=str(tmp_path / 'cache'))
+    units = work_units(str(tmp_path / 'data'), str(tmp_path / 'cache'))
+    assert len(units) >= 3 and all(stop - start <= data_loader.ROW_GROUP_ROWS for *_, start, stop in units)
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+import data_loader
+from parallel_csv import byte_ranges, detect_layout, read_csv
+
+
+def test_chunked_parse_matches_pandas(data_dir):
+    for table, schema in data_loader.SCHEMAS.items():
+        path = data_loader.source_path(table, data_dir)
+        names, skip = detect_layout(path)
+        # Single-process pandas parse of the same layout, skipped fields dropped
+        expected = pd.read_csv(path, sep=';', header=0, names=[f'_skip{i}' for i in range(skip)] + names,
+                               usecols=list(schema['dtypes']), dtype=schema['dtypes'])
+        parsed = read_csv(path, schema['dtypes'], workers=2, chunk_bytes=4096)
+        pd.testing.assert_frame_equal(parsed, expected[list(schema['dtypes'])])
+
+
+def test_byte_ranges_cover_whole_rows(data_dir):
+    path = data_loader.source_path('order_products', data_dir)
+    with open(path, 'rb') as f:
+        data = f.read()
+    ranges = byte_ranges(path, chunk_bytes=1000)
+    assert ranges[0][0] == data.index(b'\n') + 1 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[end - 1:end] == b'\n'
+
+
+def test_leading_index_column_is_skipped(tmp_path):
+    path = tmp_path / 'products.csv'
+    path.write_text('product_id;product_name;aisle_id;department_id\n'
+                    '0;1;Chocolate Sandwich Cookies;61;19\n'
+                    '1;2;All-Seasons Salt;104;13\n')
+    assert detect_layout(str(path)) == (['product_id', 'product_name', 'aisle_id', 'department_id'], 1)
+    products = read_csv(str(path), data_loader.SCHEMAS['products']['dtypes'], columns=['product_id', 'aisle_id'])
+    np.testing.assert_array_equal(products['product_id'], [1, 2])
+    np.testing.assert_array_equal(products['aisle_id'], [61, 104])
+    assert str(products['aisle_id'].dtype) == 'int16'
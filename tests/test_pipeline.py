@@ -0,0 +1,80 @@
+import importlib.util
+import shutil
+import types
+
+import pandas as pd
+import pytest
+
+import pipeline
+from cleaning import clean_orders, clean_products
+from dedup import find_duplicates
+from pipeline import REPORTS, Pipeline, code_fingerprint
+
+
+def _pipeline_functions(tmp_path, name, source):
+    # Functions written in a file of their own but living in pipeline.py's namespace,
+    # like the helpers and node functions defined there
+    path = tmp_path / f'{name}.py'
+    path.write_text(source)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return {function: types.FunctionType(getattr(module, function).__code__, vars(pipeline), function)
+            for function in ('_helper', 'node')}
+
+
+@pytest.mark.parametrize('body', ['x + 1', 'x + 2'])
+def test_fingerprint_follows_helpers_of_the_pipeline_module(tmp_path, monkeypatch, body):
+    node_source = 'def node(x):\n    return [_helper(v) for v in x]\n'
+    first = _pipeline_functions(tmp_path, 'first', f'def _helper(x):\n    return x\n\n\n{node_source}')
+    second = _pipeline_functions(tmp_path, 'second', f'def _helper(x):\n    return {body}\n\n\n{node_source}')
+
+    monkeypatch.setitem(vars(pipeline), '_helper', first['_helper'])
+    before = code_fingerprint(first['node'])
+    monkeypatch.setitem(vars(pipeline), '_helper', second['_helper'])
+    # Same node source, the helper it calls (inside a comprehension) changed
+    assert code_fingerprint(second['node']) != before
+
+
+def test_raw_keys_cover_the_parsing_code(data_dir, tmp_path, monkeypatch):
+    key = Pipeline(data_dir, str(tmp_path / 'cache'), str(tmp_path / 'store')).key('raw_orders')
+    original = pipeline.code_fingerprint
+    monkeypatch.setattr(pipeline, 'code_fingerprint',
+                        lambda function: original(function) + ('-edited' if function.__name__ == 'load_table' else ''))
+    assert Pipeline(data_dir, str(tmp_path / 'cache'), str(tmp_path / 'store')).key('raw_orders') != key
+
+
+def test_reports_and_store(data_dir, tmp_path, tables):
+    store = str(tmp_path / 'store')
+    first = Pipeline(data_dir, str(tmp_path / 'cache'), store)
+    reports = first.evaluate(REPORTS)
+    assert reports['orders_duplicates'] == find_duplicates(tables['orders'], key='order_id').summary()
+    assert reports['products_duplicates']['name_clashes'] == int(
+        tables['products']['product_name'].str.lower().duplicated().sum())
+
+    orders = clean_orders(tables['orders'])
+    expected = orders.groupby('user_id')['order_id'].count()
+    pd.testing.assert_series_equal(reports['orders_per_customer'], expected, check_index_type=False,
+                                   check_dtype=False)
+    top = reports['top_20_products']
+    assert top['product_name'].notna().all() and len(top) == 20
+    assert set(top['product_id']) <= set(clean_products(tables['products'])['product_id'])
+
+    second = Pipeline(data_dir, str(tmp_path / 'cache'), store)
+    second.evaluate(REPORTS)
+    assert second.computed == [] and set(second.loaded) == set(REPORTS)
+
+
+def test_data_dirs_keep_their_own_results(data_dir, tmp_path):
+    # A copy with the same sizes and modification times is still a different source
+    other = str(tmp_path / 'copy')
+    shutil.copytree(data_dir, other)
+    store, cache = str(tmp_path / 'store'), str(tmp_path / 'cache')
+    Pipeline(data_dir, cache, store).evaluate(['orders_per_customer'])
+    copied = Pipeline(other, cache, store)
+    copied.evaluate(['orders_per_customer'])
+    assert 'orders_per_customer' in copied.computed
+
+    again = Pipeline(data_dir, cache, store)
+    again.evaluate(['orders_per_customer'])
+    assert again.computed == [] and again.loaded == ['orders_per_customer']
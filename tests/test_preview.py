@@ -0,0 +1,56 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from cleaning import clean_order_products, clean_orders, clean_products
+from preview import STRATA_EDGES, _sample_key, load_sample, preview_metrics, sample_users
+
+
+@pytest.fixture(scope='module')
+def cleaned(tables):
+    return (clean_orders(tables['orders']), clean_order_products(tables['order_products']),
+            clean_products(tables['products']))
+
+
+def test_full_sample_estimates_match_pandas(cleaned):
+    orders, order_products, products = cleaned
+    # The most ordered product is missing from the products table
+    counts = order_products['product_id'].value_counts()
+    products = products[products['product_id'] != counts.index[0]]
+    order_products = order_products[order_products['order_id'].isin(orders['order_id'])]
+    strata = np.zeros(orders['user_id'].nunique(), dtype=np.int64)
+
+    metrics = preview_metrics(orders, order_products, products, strata, n_replicates=20, top_n=10)
+    share = metrics['top_products_item_share']
+    assert len(share) == 10 and share['product_name'].notna().all()
+    known = counts[counts.index.isin(products['product_id'])]
+    expected = known.sort_index().sort_values(ascending=False, kind='stable').head(10) / len(order_products)
+    np.testing.assert_array_equal(share['product_id'].to_numpy(), expected.index.to_numpy())
+    np.testing.assert_allclose(share['estimate'].to_numpy(), expected.to_numpy())
+
+    hours = metrics['hourly_share']['estimate']
+    expected_hours = orders['order_hour_of_day'].value_counts(normalize=True)
+    np.testing.assert_allclose(hours[expected_hours.index].to_numpy(), expected_hours.to_numpy())
+    assert metrics['reorder_rate']['estimate'].iloc[0] == pytest.approx(order_products['reordered'].mean())
+
+
+def test_sample_covers_every_stratum(cleaned):
+    orders = cleaned[0]
+    user_ids, strata = sample_users(orders, 0.2, seed=3)
+    assert np.all(np.diff(user_ids) > 0) and set(user_ids) <= set(orders['user_id'])
+    per_user = orders.groupby('user_id').size()
+    all_strata = np.digitize(per_user.to_numpy(), STRATA_EDGES)
+    assert set(strata) == set(all_strata)
+    assert 0.1 < len(user_ids) / len(per_user) < 0.3
+
+
+def test_samples_of_copied_data_dirs_are_kept_apart(data_dir, tmp_path):
+    # Same file names, sizes and modification times, different directories
+    other = str(tmp_path / 'copy')
+    shutil.copytree(data_dir, other)
+    cache, samples = str(tmp_path / 'cache'), str(tmp_path / 'samples')
+    assert _sample_key(0.1, 0, data_dir, cache) != _sample_key(0.1, 0, other, cache)
+    load_sample(0.1, 0, data_dir, cache, samples)
+    load_sample(0.1, 0, other, cache, samples)
+    assert len(list((tmp_path / 'samples').iterdir())) == 2
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from cleaning import clean_order_products, clean_orders, clean_products
+from product_metrics import metrics_frame, named_series, product_metrics, product_time_counts, top_products
+from topk import top_k
+
+
+def _reference(order_products, products):
+    # The merge + groupby version of instacart_analysis.py
+    info = order_products.merge(products, on='product_id')
+    grouped = info.groupby('product_id')
+    return pd.DataFrame({
+        'order_count': grouped.size(),
+        'reorder_count': grouped['reordered'].sum().astype(np.int64),
+        'first_in_cart_count': info[info['add_to_cart_order'] == 1].groupby('product_id').size(),
+        'reorder_rate': grouped['reordered'].mean(),
+    }).fillna({'first_in_cart_count': 0})
+
+
+def test_matches_merge_and_groupby(tables):
+    products = clean_products(tables['products'])
+    order_products = clean_order_products(tables['order_products'])
+    metrics = product_metrics(order_products, products)
+    expected = _reference(order_products, products)
+    np.testing.assert_array_equal(metrics.index, expected.index)
+    for column in ('order_count', 'reorder_count', 'first_in_cart_count'):
+        np.testing.assert_array_equal(metrics[column], expected[column])
+    np.testing.assert_array_equal(metrics['reorder_rate'], expected['reorder_rate'])
+
+
+def test_named_series_matches_groupby(tables):
+    products = clean_products(tables['products'])
+    order_products = clean_order_products(tables['order_products'])
+    counts = named_series(product_metrics(order_products, products), 'order_count', products).rename(None)
+    expected = order_products.merge(products, on='product_id').groupby(['product_id', 'product_name']).size()
+    pd.testing.assert_series_equal(counts, expected, check_index_type=False)
+
+    # A top_k() selection keeps its ranked order; ties go to the lower product_id
+    top = named_series(top_k(product_metrics(order_products, products)['order_count'], 20).to_frame(),
+                       'order_count', products).rename(None)
+    ranked = expected.reset_index().sort_values([0, 'product_id'], ascending=[False, True]).head(20)
+    pd.testing.assert_series_equal(top, ranked.set_index(['product_id', 'product_name'])[0].rename(None),
+                                   check_index_type=False)
+
+
+def test_top_products(tables):
+    products = clean_products(tables['products'])
+    metrics = product_metrics(clean_order_products(tables['order_products']), products)
+    top = top_products(metrics, 'order_count', products, n=5)
+    assert list(top.columns) == ['product_id', 'product_name', 'order_count']
+    assert top['order_count'].tolist() == sorted(metrics['order_count'], reverse=True)[:5]
+
+
+def test_time_counts_add_up(tables):
+    orders = clean_orders(tables['orders'])
+    order_products = clean_order_products(tables['order_products'])
+    counts = product_time_counts(orders, order_products)
+    metrics = product_metrics(order_products.merge(orders[['order_id']], on='order_id'))
+    for name, matrix in counts.items():
+        totals = np.asarray(matrix.sum(axis=1)).ravel()
+        np.testing.assert_array_equal(totals[metrics.index], metrics[name])
+
+
+def test_metrics_frame_with_counters_of_different_lengths():
+    counters = {'order_count': np.array([0, 2, 0, 1]), 'reorder_count': np.array([0, 1]),
+                'first_in_cart_count': np.array([0, 0, 0])}
+    metrics = metrics_frame(counters)
+    assert metrics.index.tolist() == [1, 3]
+    assert metrics['reorder_count'].tolist() == [1, 0]
+    assert metrics['first_in_cart_count'].tolist() == [0, 0]
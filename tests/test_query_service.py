@@ -0,0 +1,63 @@
+import asyncio
+import json
+
+import pytest
+
+from cleaning import clean_orders
+from pipeline import Pipeline
+from query_service import QueryEngine, QueryService
+
+
+@pytest.fixture(scope='module')
+def service(data_dir, tmp_path_factory):
+    pipeline = Pipeline(data_dir, cache_dir=str(tmp_path_factory.mktemp('cache')), persist=False)
+    return QueryService(QueryEngine(pipeline))
+
+
+def _get(service, path, **params):
+    status, body = asyncio.run(service.answer(path, {name: str(value) for name, value in params.items()}))
+    return status, json.loads(body)
+
+
+def _http_get(service, target):
+    # One request through the real HTTP handler, on an ephemeral port
+    async def roundtrip():
+        server = await asyncio.start_server(service.handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+        return response
+    head, body = asyncio.run(roundtrip()).split(b'\r\n\r\n', 1)
+    return int(head.split()[1]), json.loads(body)
+
+
+def test_marginal_matches_value_counts(service, tables):
+    orders = clean_orders(tables['orders'])
+    status, rows = _get(service, '/orders/marginal', axis='order_hour_of_day', order_dow=3)
+    assert status == 200
+    expected = orders.loc[orders['order_dow'] == 3, 'order_hour_of_day'].value_counts()
+    assert {row['order_hour_of_day']: row['count'] for row in rows if row['count']} == expected.to_dict()
+
+
+def test_first_order_bucket(service, tables):
+    first_orders = int(clean_orders(tables['orders'])['days_since_prior_order'].isna().sum())
+    status, rows = _http_get(service, '/orders/marginal?axis=days_since_prior_order&days_since_prior_order=31')
+    assert status == 200
+    assert rows == [{'days_since_prior_order': None, 'count': first_orders}]
+    status, rows = _get(service, '/orders/marginal', axis='order_dow', days_since_prior_order=31)
+    assert status == 200 and sum(row['count'] for row in rows) == first_orders
+
+
+@pytest.mark.parametrize('params', [{'days_since_prior_order': 32}, {'order_hour_of_day': -1},
+                                    {'order_dow': 'x'}, {'axis': 'minute'}, {'hour': 3}])
+def test_bad_marginal_parameters_are_rejected(service, params):
+    status, body = _get(service, '/orders/marginal', **params)
+    assert status == 400 and 'error' in body
+
+
+def test_unknown_product_is_404(service):
+    assert _get(service, '/products/999999999')[0] == 404
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+from cleaning import clean_order_products, clean_orders
+from reorder_cycles import CYCLE_DTYPES, interval_distribution, product_cycles, segment_medians, user_product_cycles
+
+
+def _reference(orders, order_products):
+    # groupby + diff version of the pair statistics
+    timeline = orders.sort_values(['user_id', 'order_number']).copy()
+    timeline['day'] = timeline['days_since_prior_order'].astype('float64').fillna(0).groupby(timeline['user_id']).cumsum()
+    timeline['user_last_day'] = timeline.groupby('user_id')['day'].transform('max')
+    items = order_products.merge(timeline, on='order_id').sort_values(['user_id', 'product_id', 'day'], kind='stable')
+    items['interval'] = items.groupby(['user_id', 'product_id'])['day'].diff()
+    grouped = items.groupby(['user_id', 'product_id'])
+    cycles = pd.DataFrame({
+        'purchases': grouped.size(),
+        'median_interval': grouped['interval'].median(),
+        'mean_interval': grouped['interval'].mean(),
+        'std': grouped['interval'].std(ddof=0),
+        'days_since_last_purchase': grouped['user_last_day'].first() - grouped['day'].max(),
+    }).reset_index()
+    cycles = cycles[cycles['purchases'] >= 2].reset_index(drop=True)
+    cycles['interval_cv'] = (cycles['std'] / cycles['mean_interval']).where(
+        (cycles['purchases'] >= 3) & (cycles['mean_interval'] > 0))
+    cycles['days_overdue'] = cycles['days_since_last_purchase'] - cycles['median_interval']
+    return cycles
+
+
+def _cleaned(tables):
+    return clean_orders(tables['orders']), clean_order_products(tables['order_products'])
+
+
+def test_pair_statistics_match_groupby(tables):
+    cycles = user_product_cycles(*_cleaned(tables))
+    expected = _reference(*_cleaned(tables))
+    assert cycles.dtypes.astype(str).to_dict() == CYCLE_DTYPES
+    assert len(cycles)
+    for column in ('user_id', 'product_id', 'purchases'):
+        np.testing.assert_array_equal(cycles[column], expected[column])
+    for column in ('median_interval', 'mean_interval', 'interval_cv', 'days_since_last_purchase', 'days_overdue'):
+        np.testing.assert_allclose(cycles[column], expected[column], rtol=1e-5, atol=1e-5, err_msg=column)
+
+
+def test_product_statistics_match_groupby(tables):
+    cycles = user_product_cycles(*_cleaned(tables))
+    products = product_cycles(cycles)
+    assert (np.diff(products['customers']) <= 0).all()
+
+    frame = cycles.astype({'median_interval': 'float64', 'mean_interval': 'float64', 'interval_cv': 'float64'})
+    frame['intervals'] = frame['purchases'] - 1
+    frame['interval_sum'] = frame['mean_interval'] * frame['intervals']
+    grouped = frame.groupby('product_id')
+    expected = pd.DataFrame({
+        'customers': grouped.size(),
+        'intervals': grouped['intervals'].sum(),
+        'median_interval': grouped['median_interval'].median(),
+        'mean_interval': grouped['interval_sum'].sum() / grouped['intervals'].sum(),
+        'median_cv': grouped['interval_cv'].median(),
+    })
+    products = products.sort_index()
+    np.testing.assert_array_equal(products.index, expected.index)
+    for column in ('customers', 'intervals'):
+        np.testing.assert_array_equal(products[column], expected[column])
+    for column in ('median_interval', 'mean_interval', 'median_cv'):
+        np.testing.assert_allclose(products[column], expected[column], err_msg=column)
+
+    distribution = interval_distribution(cycles)
+    np.testing.assert_array_equal(distribution, np.floor(frame['median_interval']).astype(int).value_counts().sort_index())
+
+
+def test_segment_medians():
+    values = np.array([5.0, 1.0, 3.0, 2.0, 4.0])
+    segments = np.array([0, 0, 0, 2, 2])
+    np.testing.assert_array_equal(segment_medians(values, segments, 4), [3.0, np.nan, 3.0, np.nan])
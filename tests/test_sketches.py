@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cleaning import clean_order_products
+from sketches import ProductSketches, SpaceSaving
+
+
+def _check_bounds(sketch, ids):
+    exact = pd.Series(ids).value_counts()
+    true = exact.reindex(sketch.items, fill_value=0).to_numpy()
+    assert sketch.total == len(ids)
+    assert (sketch.counts - sketch.errors <= true).all() and (true <= sketch.counts).all()
+    assert sketch.errors.max(initial=0) <= sketch.total / sketch.capacity
+    # Anything not monitored occurs at most min_count() times
+    unmonitored = exact[~exact.index.isin(sketch.items)]
+    assert (unmonitored <= sketch.min_count()).all()
+
+
+def test_update_and_merge_stay_within_bounds():
+    rng = np.random.default_rng(0)
+    ids = rng.zipf(1.3, 50_000) % 5_000
+    single = SpaceSaving(epsilon=0.01)
+    for batch in np.array_split(ids, 17):
+        single.update(batch)
+    _check_bounds(single, ids)
+
+    left, right = SpaceSaving(capacity=100), SpaceSaving(capacity=100)
+    left.update(ids[:20_000])
+    right.update(ids[20_000:])
+    _check_bounds(left.merge(right), ids)
+
+    # Guaranteed ids are in the true top n
+    top = single.top(10)
+    exact_top = set(pd.Series(ids).value_counts().nlargest(10).index)
+    assert set(top.index[top['guaranteed']]) <= exact_top
+
+
+def test_exact_when_capacity_covers_every_id():
+    ids = np.array([3, 1, 3, 2, 3, 1])
+    sketch = SpaceSaving(capacity=10).update(ids)
+    top = sketch.top(2)
+    assert top.index.tolist() == [3, 1]
+    assert top['estimate'].tolist() == [3, 2] and top['guaranteed'].all()
+
+
+def test_round_trip_and_capacity_checks():
+    sketch = SpaceSaving(capacity=5).update(np.arange(20) % 7)
+    restored = SpaceSaving.from_dict(sketch.to_dict())
+    for name in ('items', 'counts', 'errors'):
+        np.testing.assert_array_equal(getattr(restored, name), getattr(sketch, name))
+    assert restored.total == sketch.total
+    with pytest.raises(ValueError):
+        sketch.merge(SpaceSaving(capacity=6))
+    with pytest.raises(ValueError):
+        SpaceSaving()
+
+
+def test_product_sketches_match_value_counts(tables):
+    order_products = clean_order_products(tables['order_products'])
+    sketches = ProductSketches(epsilon=0.001)
+    for batch in np.array_split(np.arange(len(order_products)), 5):
+        sketches.update(order_products.iloc[batch])
+    sketches = ProductSketches.from_json(sketches.to_json())
+
+    first_in_cart = order_products['add_to_cart_order'].to_numpy(dtype=np.int64, na_value=0) == 1
+    references = {
+        'popular': order_products['product_id'],
+        'reordered': order_products.loc[order_products['reordered'] == 1, 'product_id'],
+        'first_in_cart': order_products.loc[first_in_cart, 'product_id'],
+    }
+    for name, ids in references.items():
+        _check_bounds(sketches.sketches[name], ids.to_numpy())
+        exact = ids.value_counts()
+        report = sketches.report(name, n=20)
+        true = exact.reindex(report['product_id'], fill_value=0).to_numpy()
+        assert ((report['lower'] <= true) & (true <= report['upper'])).all()
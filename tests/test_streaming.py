@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_loader
+from cleaning import clean_order_products, clean_orders, clean_products
+from product_metrics import product_metrics
+from streaming import id_bounds, iter_order_products, iter_table, stream_aggregates
+
+
+@pytest.fixture(scope='module')
+def cleaned(tables):
+    return (clean_orders(tables['orders']), clean_products(tables['products']),
+            clean_order_products(tables['order_products']))
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_matches_in_memory_path(data_dir, cache_dir, cleaned, cached):
+    orders, products, order_products = cleaned
+    if cached:
+        data_loader.load_table('order_products', data_dir=data_dir, cache_dir=cache_dir)
+    raw = data_loader.load_table('order_products', data_dir=data_dir, cache_dir=cache_dir)
+    batches = (clean_order_products(batch) for batch in iter_order_products(data_dir, 3001, cache_dir))
+    aggregates = stream_aggregates(orders, batches)
+
+    pd.testing.assert_series_equal(aggregates.items_per_order(), raw.groupby('order_id')['product_id'].count(),
+                                   check_index_type=False)
+    pd.testing.assert_frame_equal(aggregates.product_metrics(products), product_metrics(order_products, products))
+    expected = order_products.merge(orders, on='order_id').groupby('user_id')['reordered'].mean()
+    pd.testing.assert_series_equal(aggregates.user_reorder_rate(), expected, check_exact=True,
+                                   check_index_type=False)
+
+
+def test_presized_counters_are_not_reallocated(data_dir, cache_dir, cleaned):
+    orders, products, _ = cleaned
+    data_loader.load_table('order_products', data_dir=data_dir, cache_dir=cache_dir)
+    sizes = id_bounds(orders, products, data_dir, cache_dir)
+    batches = iter_order_products(data_dir, 2000, cache_dir)
+    aggregates = stream_aggregates(orders, [next(batches)], sizes)
+    before = {name: id(counter) for name, counter in aggregates.counters.items()}
+    for batch in batches:
+        aggregates.add_batch(batch)
+    assert {name: id(counter) for name, counter in aggregates.counters.items()} == before
+
+
+def test_iter_table_matches_load(data_dir, cache_dir, tables):
+    for table in ('orders', 'products'):
+        chunks = list(iter_table(table, data_dir=data_dir, batch_rows=1000, cache_dir=cache_dir))
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), tables[table])
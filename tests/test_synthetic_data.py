@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+
+import data_loader
+import synthetic_data
+
+
+@pytest.fixture(scope='module')
+def chunked(tmp_path_factory):
+    # Small chunks, so users' histories cross chunk boundaries
+    path = str(tmp_path_factory.mktemp('chunked'))
+    synthetic_data.generate(path, rows=5_000, seed=2, chunk_orders=37)
+    return data_loader.load_all(data_dir=path, cache_dir=str(tmp_path_factory.mktemp('cache')))
+
+
+@pytest.mark.parametrize('dataset', ['tables', 'chunked'])
+def test_baskets_and_reorders(request, dataset):
+    tables = request.getfixturevalue(dataset)
+    orders = tables['orders'].drop_duplicates('order_id')
+    order_products = tables['order_products']
+    assert not order_products.duplicated(['order_id', 'product_id']).any()
+
+    items = order_products.merge(orders, on='order_id').sort_values(['user_id', 'order_number'], kind='stable')
+    bought_before = items.duplicated(['user_id', 'product_id']).astype('int8')
+    pd.testing.assert_series_equal(items['reordered'], bought_before, check_names=False)
+    assert 0.4 < order_products['reordered'].mean() < 0.7
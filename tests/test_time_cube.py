@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cleaning import clean_orders
+from time_cube import FIRST_ORDER, OrderTimeCube
+
+
+@pytest.fixture(scope='module')
+def orders(tables):
+    return clean_orders(tables['orders'])
+
+
+@pytest.fixture(scope='module')
+def cube(orders):
+    return OrderTimeCube.from_orders(orders)
+
+
+@pytest.mark.parametrize('axis', ['order_dow', 'order_hour_of_day', 'days_since_prior_order'])
+def test_marginals_match_value_counts(orders, cube, axis):
+    expected = orders[axis].value_counts().sort_index()
+    marginal = cube.marginal(axis)
+    marginal = marginal[marginal > 0]
+    np.testing.assert_array_equal(marginal.to_numpy(), expected.to_numpy())
+    np.testing.assert_array_equal(marginal.index.to_numpy(dtype=np.float64), expected.index.to_numpy(dtype=np.float64))
+
+
+def test_restricted_marginal(orders, cube):
+    expected = orders.loc[orders['order_dow'].isin([0, 6]), 'order_hour_of_day'].value_counts()
+    marginal = cube.marginal('order_hour_of_day', order_dow=[0, 6])
+    assert marginal[marginal > 0].to_dict() == expected.to_dict()
+    assert cube.total(order_dow=3, order_hour_of_day=10) == int(
+        ((orders['order_dow'] == 3) & (orders['order_hour_of_day'] == 10)).sum())
+
+
+def test_first_order_bucket(orders, cube):
+    first_orders = int(orders['days_since_prior_order'].isna().sum())
+    marginal = cube.marginal('days_since_prior_order', days_since_prior_order=[7, FIRST_ORDER])
+    assert marginal.iloc[1] == first_orders and np.isnan(marginal.index[1])
+    assert cube.total(days_since_prior_order=FIRST_ORDER) == first_orders
+    with pytest.raises(ValueError, match='first-order bucket'):
+        cube.marginal('days_since_prior_order', include_first_orders=False, days_since_prior_order=FIRST_ORDER)
+    with pytest.raises(ValueError, match='between 0 and 23'):
+        cube.marginal('order_dow', order_hour_of_day=-1)
+    assert pd.isna(cube.marginal('days_since_prior_order', include_first_orders=True).index[-1])
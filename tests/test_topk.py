@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from topk import bottom_k, merge_top_k, top_k
+
+
+def _sorted_reference(series, k, largest):
+    # Full stable sort by value, ties by ascending id
+    frame = series.rename('value').rename_axis('id').reset_index()
+    frame = frame.sort_values(['value', 'id'], ascending=[not largest, True], kind='stable')
+    return frame['id'].head(k).tolist()
+
+
+@pytest.mark.parametrize('k', [0, 1, 5, 50, 1000])
+def test_matches_full_sort(k):
+    rng = np.random.default_rng(0)
+    series = pd.Series(rng.integers(0, 20, 300), index=rng.permutation(300))
+    assert top_k(series, k).index.tolist() == _sorted_reference(series, k, True)
+    assert bottom_k(series, k).index.tolist() == _sorted_reference(series, k, False)
+
+
+def test_merge_top_k():
+    series = pd.Series(np.arange(100) % 7, index=np.arange(100))
+    parts = [series.iloc[:40], series.iloc[40:]]
+    merged = merge_top_k([top_k(part, 10) for part in parts], 10)
+    pd.testing.assert_series_equal(merged, top_k(series, 10))
+    with pytest.raises(ValueError):
+        merge_top_k([series, series], 3)
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cleaning import clean_order_products, clean_orders
+from user_index import UserOrderIndex, segment_sums
+
+
+def _cleaned(tables):
+    return clean_orders(tables['orders']), clean_order_products(tables['order_products'])
+
+
+def test_segment_sums():
+    values = np.array([1, 2, 3, 4, 5])
+    np.testing.assert_array_equal(segment_sums(values, np.array([0, 2, 2, 5])), [3, 0, 12])
+
+
+def test_aggregates_match_groupby(tables):
+    orders, order_products = _cleaned(tables)
+    index = UserOrderIndex.build(orders, order_products)
+    merged = order_products.merge(orders[['order_id', 'user_id']], on='order_id')
+
+    pd.testing.assert_series_equal(index.order_counts(), orders.groupby('user_id')['order_id'].count(),
+                                   check_dtype=False)
+    items = merged.groupby('user_id').size().reindex(index.user_ids, fill_value=0)
+    np.testing.assert_array_equal(index.item_counts(), items)
+    expected_rate = merged.groupby('user_id')['reordered'].mean()
+    np.testing.assert_array_equal(index.reorder_rate().index, expected_rate.index)
+    np.testing.assert_allclose(index.reorder_rate(), expected_rate)
+    np.testing.assert_allclose(index.mean_basket_size(), items.to_numpy() / index.order_counts().to_numpy())
+
+
+def test_basket_history_matches_sorted_rows(tables, tmp_path):
+    orders, order_products = _cleaned(tables)
+    UserOrderIndex.build(orders, order_products).save(str(tmp_path / 'index'))
+    index = UserOrderIndex.load(str(tmp_path / 'index'))
+
+    for user_id in orders['user_id'].drop_duplicates().sample(20, random_state=0):
+        user_orders = orders[orders['user_id'] == user_id].sort_values('order_number')
+        history = index.basket_history(user_id)
+        np.testing.assert_array_equal(history['order_ids'], user_orders['order_id'])
+        np.testing.assert_array_equal(history['order_numbers'], user_orders['order_number'])
+        for i, order_id in enumerate(user_orders['order_id']):
+            items = order_products[order_products['order_id'] == order_id]
+            basket = slice(history['item_offsets'][i], history['item_offsets'][i + 1])
+            # Sorted by cart position, with missing positions last
+            np.testing.assert_array_equal(
+                np.sort(history['product_ids'][basket]), np.sort(items['product_id'].to_numpy()))
+            cart = history['add_to_cart_order'][basket]
+            assert (np.diff(cart) >= 0).all()
+
+
+def test_unknown_user_raises(tables):
+    orders, order_products = _cleaned(tables)
+    index = UserOrderIndex.build(orders, order_products)
+    with pytest.raises(KeyError):
+        index.basket_history(int(index.user_ids.max()) + 1)
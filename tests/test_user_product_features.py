@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from cleaning import MISSING_CART_POSITION, clean_order_products, clean_orders
+from user_product_features import FEATURE_DTYPES, build_features, order_timeline, to_sparse
+
+
+def _reference(orders, order_products):
+    # merge + groupby version of the features
+    timeline = orders.sort_values(['user_id', 'order_number']).copy()
+    timeline['day'] = timeline['days_since_prior_order'].astype('float64').fillna(0).groupby(timeline['user_id']).cumsum()
+    timeline['user_last_day'] = timeline.groupby('user_id')['day'].transform('max')
+    items = order_products.merge(timeline, on='order_id')
+    items['cart'] = items['add_to_cart_order'].astype('float64').replace(MISSING_CART_POSITION, np.nan)
+    grouped = items.groupby(['user_id', 'product_id'])
+    features = pd.DataFrame({
+        'times_bought': grouped.size(),
+        'times_reordered': grouped['reordered'].sum(),
+        'last_order_number': grouped['order_number'].max(),
+        'mean_add_to_cart_order': grouped['cart'].mean(),
+        'days_since_last_purchase': grouped['user_last_day'].first() - grouped['day'].max(),
+    })
+    return features.reset_index(), timeline
+
+
+def test_matches_merge_and_groupby(tables):
+    orders = clean_orders(tables['orders'])
+    order_products = clean_order_products(tables['order_products'])
+    features = build_features(orders, order_products)
+    expected, timeline = _reference(orders, order_products)
+
+    assert features.dtypes.astype(str).to_dict() == FEATURE_DTYPES
+    for column in ('user_id', 'product_id', 'times_bought', 'times_reordered', 'last_order_number'):
+        np.testing.assert_array_equal(features[column], expected[column])
+    for column in ('mean_add_to_cart_order', 'days_since_last_purchase'):
+        np.testing.assert_allclose(features[column], expected[column], rtol=1e-6)
+
+    placed = order_timeline(orders)
+    np.testing.assert_array_equal(placed['order_id'], timeline['order_id'])
+    np.testing.assert_allclose(placed['day'], timeline['day'])
+    np.testing.assert_allclose(placed['user_last_day'], timeline['user_last_day'])
+
+
+def test_to_sparse_holds_every_pair(tables):
+    features = build_features(clean_orders(tables['orders']), clean_order_products(tables['order_products']))
+    matrix = to_sparse(features, 'times_bought').tocsr()
+    assert matrix.shape == (features['user_id'].max() + 1, features['product_id'].max() + 1)
+    assert matrix.sum() == features['times_bought'].sum()
+    np.testing.assert_array_equal(
+        np.asarray(matrix[features['user_id'], features['product_id']]).ravel(), features['times_bought'])
+
+
+def test_empty_input_keeps_dtypes(tables):
+    orders = clean_orders(tables['orders'])
+    order_products = clean_order_products(tables['order_products']).iloc[:0]
+    features = build_features(orders, order_products)
+    assert features.empty and features.dtypes.astype(str).to_dict() == FEATURE_DTYPES
@@ -0,0 +1,47 @@
+import shutil
+
+import pandas as pd
+import pytest
+
+import data_loader
+from validation import MAX_ID, validate
+
+
+def _result(report, table, rule):
+    return next(result for result in report.results if result['table'] == table and result['rule'] == rule)
+
+
+def test_clean_data_passes(data_dir, cache_dir):
+    report = validate(data_dir=data_dir, cache_dir=cache_dir, batch_rows=3001)
+    assert report.passed
+    # Only the known duplicated orders warn
+    warnings = [result for result in report.results if result['violations']]
+    assert [result['rule'] for result in warnings] == ['rows per order_id <= 1']
+
+
+@pytest.fixture
+def corrupt_dir(data_dir, tmp_path):
+    # A copy of the data with a missing day of week, an hour past the int8 range and a huge order_id
+    path = tmp_path / 'data'
+    shutil.copytree(data_dir, path)
+    orders_path = data_loader.source_path('orders', str(path))
+    orders = pd.read_csv(orders_path, sep=';', dtype=str, keep_default_na=False)
+    orders.loc[3, 'order_hour_of_day'] = '266'
+    orders.loc[5, 'order_dow'] = ''
+    orders.loc[7, 'order_id'] = str(10**12)
+    orders.to_csv(orders_path, sep=';', index=False)
+    return str(path)
+
+
+def test_null_and_out_of_range_values_are_reported(corrupt_dir, tmp_path):
+    report = validate(data_dir=corrupt_dir, cache_dir=str(tmp_path / 'cache'), batch_rows=1000)
+    assert not report.passed
+
+    hours = _result(report, 'orders', 'order_hour_of_day in [0, 23]')
+    assert hours['violations'] == 1 and hours['examples'] == [3]
+    dow = _result(report, 'orders', 'order_dow in [0, 6]')
+    assert dow['violations'] == 1 and dow['examples'] == [5]
+    order_ids = _result(report, 'orders', f'order_id in [1, {MAX_ID}]')
+    assert order_ids['violations'] == 1 and order_ids['examples'] == [7]
+    # The order's items now refer to an order_id that is not in orders
+    assert _result(report, 'order_products', 'order_id refers to orders.order_id')['violations'] > 0
@@ -0,0 +1,119 @@
+"""
+Dense order-time cube: order_dow x order_hour_of_day x days_since_prior_order.
+
+All orders are counted into a 7 x 24 x 32 array in one pass (days 0-30 plus a
+separate bucket for first orders, which have no days_since_prior_order). The
+hourly, day-of-week, days-since-prior and day-vs-day comparisons then become
+sums over a few thousand cells instead of filters over millions of rows.
+
+    cube = OrderTimeCube.from_orders(orders)
+    cube.marginal('order_hour_of_day', order_dow=3)   # hours on Wednesdays
+    cube.marginal('order_dow')                        # orders per day of week
+"""
+
+import numpy as np
+import pandas as pd
+
+AXES = ('order_dow', 'order_hour_of_day', 'days_since_prior_order')
+
+MAX_DAYS = 30
+# Index of the bucket that holds first orders (days_since_prior_order is missing)
+FIRST_ORDER = MAX_DAYS + 1
+
+SHAPE = (7, 24, MAX_DAYS + 2)
+
+
+class OrderTimeCube:
+    """Order counts by day of week, hour of day and days since the prior order."""
+
+    def __init__(self, counts=None):
+        self.counts = np.zeros(SHAPE, dtype=np.int64) if counts is None else counts
+
+    @classmethod
+    def from_orders(cls, orders):
+        """Count the (deduplicated) orders table into a cube."""
+        dow = orders['order_dow'].to_numpy(dtype=np.int64)
+        hour = orders['order_hour_of_day'].to_numpy(dtype=np.int64)
+        days = orders['days_since_prior_order'].to_numpy(dtype=np.float64, na_value=np.nan)
+
+        first_order = np.isnan(days)
+        days_bucket = np.where(first_order, FIRST_ORDER, np.nan_to_num(days)).astype(np.int64)
+        out_of_range = ((dow < 0) | (dow >= SHAPE[0]) | (hour < 0) | (hour >= SHAPE[1])
+                        | (days_bucket < 0) | (days_bucket > FIRST_ORDER))
+        if out_of_range.any():
+            raise ValueError(f'{out_of_range.sum()} orders have a day, hour or days_since_prior_order out of range')
+
+        cells = np.ravel_multi_index((dow, hour, days_bucket), SHAPE)
+        return cls(np.bincount(cells, minlength=np.prod(SHAPE)).reshape(SHAPE))
+
+    def merge(self, other):
+        """Return a cube with the counts of both cubes."""
+        return OrderTimeCube(self.counts + other.counts)
+
+    def _select(self, fixed, include_first_orders):
+        # Restrict the cube to the fixed values, keeping all three axes. Fixed values
+        # are taken first, so asking for the first-order bucket itself is caught here
+        # instead of indexing past the days that remain once it is dropped.
+        counts = self.counts
+        for axis, name in enumerate(AXES):
+            if fixed.get(name) is None:
+                continue
+            values = np.atleast_1d(fixed[name])
+            if ((values < 0) | (values >= SHAPE[axis])).any():
+                raise ValueError(f'{name} must be between 0 and {SHAPE[axis] - 1}, got {values.tolist()}')
+            if name == 'days_since_prior_order' and not include_first_orders and (values == FIRST_ORDER).any():
+                raise ValueError(f'days_since_prior_order={FIRST_ORDER} is the first-order bucket, '
+                                 'which include_first_orders=False leaves out')
+            counts = counts.take(values, axis=axis)
+        if not include_first_orders and fixed.get('days_since_prior_order') is None:
+            counts = counts[:, :, :FIRST_ORDER]
+        return counts
+
+    def slice(self, include_first_orders=True, **fixed):
+        """
+        Return the sub-array for the fixed values, e.g. slice(order_dow=[0, 6]).
+
+        Axes keep their order (dow, hour, days); a fixed axis has one entry per
+        requested value.
+        """
+        unknown = set(fixed) - set(AXES)
+        if unknown:
+            raise KeyError(f'Unknown axes {sorted(unknown)}, expected some of {AXES}')
+        return self._select(fixed, include_first_orders)
+
+    def marginal(self, axis, include_first_orders=None, **fixed):
+        """
+        Order counts along one axis, summed over the others.
+
+        Other axes can be restricted first, e.g. marginal('order_hour_of_day', order_dow=3).
+        First orders are counted everywhere except along the days axis, where they
+        only show up (as NaN) when include_first_orders is True, matching
+        value_counts() which skips missing values. Asking for the first-order
+        bucket (days_since_prior_order=31) along the days axis includes it.
+        """
+        if axis not in AXES:
+            raise KeyError(f'Unknown axis {axis!r}, expected one of {AXES}')
+        if include_first_orders is None:
+            days = fixed.get('days_since_prior_order')
+            include_first_orders = (axis != 'days_since_prior_order'
+                                    or (days is not None and FIRST_ORDER in np.atleast_1d(days)))
+        counts = self.slice(include_first_orders, **fixed)
+        position = AXES.index(axis)
+        summed = counts.sum(axis=tuple(i for i in range(3) if i != position))
+
+        values = np.atleast_1d(fixed[axis]) if fixed.get(axis) is not None else np.arange(summed.shape[0])
+        index = pd.Index(values, name=axis)
+        if axis == 'days_since_prior_order':
+            index = pd.Index(np.where(values == FIRST_ORDER, np.nan, values), name=axis)
+        return pd.Series(summed, index=index, name='count')
+
+    def total(self, include_first_orders=True, **fixed):
+        """Number of orders matching the fixed values."""
+        return int(self.slice(include_first_orders, **fixed).sum())
+
+    def save(self, path):
+        np.save(path, self.counts)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
@@ -0,0 +1,69 @@
+"""
+Top-k and bottom-k selection without sorting the whole input.
+
+np.argpartition finds the k-th best value in linear time; only the rows that
+tie with or beat it are sorted. Ties are always broken by the smaller id, so
+the result doesn't depend on the input order.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _sort_key(values, largest):
+    # lexsort sorts ascending, so the values are negated for the "largest" direction
+    values = np.asarray(values)
+    if values.dtype.kind in 'ub':
+        values = values.astype(np.int64)
+    return -values if largest else values
+
+
+def top_k_positions(values, ids, k, largest=True):
+    """
+    Return the positions of the k largest (or smallest) values, best first.
+
+    Equal values are ordered by ascending id.
+    """
+    values = np.asarray(values)
+    ids = np.asarray(ids)
+    n = len(values)
+    k = max(0, min(k, n))
+    if k == 0:
+        return np.zeros(0, dtype=np.intp)
+
+    if k < n:
+        # Everything that ties with or beats the k-th value is a candidate,
+        # so ties at the cut-off are settled by id and not by argpartition
+        kth = n - k if largest else k - 1
+        threshold = values[np.argpartition(values, kth)[kth]]
+        candidates = np.flatnonzero(values >= threshold if largest else values <= threshold)
+    else:
+        candidates = np.arange(n)
+
+    order = np.lexsort((ids[candidates], _sort_key(values[candidates], largest)))
+    return candidates[order[:k]]
+
+
+def top_k(series, k, largest=True):
+    """Return the k largest (or smallest) entries of a Series indexed by id, best first."""
+    positions = top_k_positions(series.to_numpy(), series.index.to_numpy(), k, largest)
+    return series.iloc[positions]
+
+
+def bottom_k(series, k):
+    """Return the k smallest entries of a Series, best first."""
+    return top_k(series, k, largest=False)
+
+
+def merge_top_k(partials, k, largest=True):
+    """
+    Combine top-k Series computed on separate partitions into the overall top-k.
+
+    The partitions must hold disjoint ids (for example partitioned by product_id)
+    with complete values for each id; partial counts for the same id have to be
+    added together before selecting.
+    """
+    combined = pd.concat(partials)
+    if combined.index.has_duplicates:
+        raise ValueError('partials share ids; add their values together before selecting the top k')
+    return top_k(combined, k, largest)
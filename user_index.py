@@ -0,0 +1,152 @@
+"""
+CSR-style user -> orders -> items index.
+
+Orders are sorted by user_id and order_number, and order_products rows by
+order and add_to_cart_order, and both are stored as flat arrays with offset
+arrays marking where each user's orders and each order's items start (like a
+compressed sparse row matrix). One customer's full basket history is then a
+contiguous slice of the item arrays, and per-user aggregates are differences
+of cumulative sums at the offsets, with no merge or groupby.
+
+    index = UserOrderIndex.build(orders, order_products)
+    index.save('user_index')
+    index = UserOrderIndex.load('user_index')   # memory-mapped, nothing is copied
+    index.basket_history(42)
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+ORDER_ARRAYS = ('order_ids', 'order_numbers')
+ITEM_ARRAYS = ('product_ids', 'add_to_cart_order', 'reordered')
+ARRAYS = ('user_ids', 'user_offsets') + ORDER_ARRAYS + ('order_offsets',) + ITEM_ARRAYS
+
+
+def segment_sums(values, offsets):
+    """Sum `values` over each segment values[offsets[i]:offsets[i + 1]]."""
+    cumulative = np.concatenate([[0], np.cumsum(values, dtype=np.int64)])
+    return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+
+class UserOrderIndex:
+    """Offset arrays over orders sorted by user and items sorted by order."""
+
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def build(cls, orders, order_products):
+        """
+        Build the index from the cleaned orders and order_products tables.
+
+        Items of orders that are not in `orders` are left out, the same as an
+        inner merge of order_products with orders.
+        """
+        user = orders['user_id'].to_numpy()
+        order_sort = np.lexsort((orders['order_number'].to_numpy(), user))
+        order_ids = orders['order_id'].to_numpy()[order_sort]
+        user = user[order_sort]
+
+        user_ids, user_starts = np.unique(user, return_index=True)
+        user_offsets = np.append(user_starts, len(user)).astype(np.int64)
+
+        # Position of every order in the sorted order arrays, by order_id
+        order_position = np.full(int(order_ids.max()) + 1 if len(order_ids) else 0, -1, dtype=np.int64)
+        order_position[order_ids] = np.arange(len(order_ids))
+
+        item_orders = order_products['order_id'].to_numpy()
+        in_range = item_orders < len(order_position)
+        item_position = np.full(len(item_orders), -1, dtype=np.int64)
+        item_position[in_range] = order_position[item_orders[in_range]]
+        known = item_position >= 0
+
+        # Items past position 64 have the 999 placeholder (or no value), so they sort last in their order
+        cart = order_products['add_to_cart_order'].to_numpy(dtype=np.int64, na_value=np.iinfo(np.int64).max)[known]
+        item_position = item_position[known]
+        item_sort = np.lexsort((cart, item_position))
+        order_offsets = np.concatenate([[0], np.cumsum(np.bincount(item_position, minlength=len(order_ids)))])
+
+        return cls({
+            'user_ids': user_ids,
+            'user_offsets': user_offsets,
+            'order_ids': order_ids,
+            'order_numbers': orders['order_number'].to_numpy()[order_sort],
+            'order_offsets': order_offsets.astype(np.int64),
+            'product_ids': order_products['product_id'].to_numpy()[known][item_sort],
+            'add_to_cart_order': cart[item_sort],
+            'reordered': order_products['reordered'].to_numpy()[known][item_sort],
+        })
+
+    def save(self, path):
+        """Write every array to its own .npy file in the directory `path`."""
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Open an index written by save(), memory-mapped (read-only) by default."""
+        return cls({name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS})
+
+    def _user_position(self, user_id):
+        position = np.searchsorted(self.user_ids, user_id)
+        if position == len(self.user_ids) or self.user_ids[position] != user_id:
+            raise KeyError(f'user_id {user_id} is not in the index')
+        return position
+
+    def order_range(self, user_id):
+        """Slice of the order arrays that holds one user's orders."""
+        position = self._user_position(user_id)
+        return slice(self.user_offsets[position], self.user_offsets[position + 1])
+
+    def item_range(self, user_id):
+        """Slice of the item arrays that holds all items of one user's orders."""
+        orders = self.order_range(user_id)
+        return slice(self.order_offsets[orders.start], self.order_offsets[orders.stop])
+
+    def basket_history(self, user_id):
+        """
+        One user's orders and items, as views into the index arrays (no copies).
+
+        Returns a dict with the user's order_ids and order_numbers, their item
+        offsets (relative to the user's first item) and the item arrays.
+        """
+        orders = self.order_range(user_id)
+        items = self.item_range(user_id)
+        history = {name: getattr(self, name)[orders] for name in ORDER_ARRAYS}
+        history['item_offsets'] = self.order_offsets[orders.start:orders.stop + 1] - items.start
+        history.update({name: getattr(self, name)[items] for name in ITEM_ARRAYS})
+        return history
+
+    def _user_series(self, values, name, mask=None):
+        user_ids = self.user_ids if mask is None else self.user_ids[mask]
+        values = values if mask is None else values[mask]
+        return pd.Series(values, index=pd.Index(user_ids, name='user_id'), name=name)
+
+    def order_counts(self):
+        """Number of orders per user, like orders.groupby('user_id')['order_id'].count()."""
+        return self._user_series(np.diff(self.user_offsets), 'order_id')
+
+    def item_counts(self):
+        """Number of items over all orders of each user."""
+        return self._user_series(np.diff(self.order_offsets[self.user_offsets]), 'product_id')
+
+    def reorder_rate(self):
+        """
+        Share of each user's items that are reorders.
+
+        Users without any items are left out, the same as the merge + groupby version.
+        """
+        user_item_offsets = self.order_offsets[self.user_offsets]
+        items = np.diff(user_item_offsets)
+        reorders = segment_sums(self.reordered, user_item_offsets)
+        has_items = items > 0
+        return self._user_series(reorders[has_items] / items[has_items], 'reordered', has_items)
+
+    def mean_basket_size(self):
+        """Average number of items per order for each user."""
+        items = np.diff(self.order_offsets[self.user_offsets])
+        return self._user_series(items / np.diff(self.user_offsets), 'mean_basket_size')
@@ -0,0 +1,167 @@
+"""
+Sparse user x product reorder features for modeling.
+
+For every (user, product) pair that was actually bought, this builds:
+
+    times_bought               number of orders of the user containing the product
+    times_reordered            how many of those were reorders
+    last_order_number          order_number of the user's last order with the product
+    mean_add_to_cart_order     average cart position (positions past 64 are unknown and skipped)
+    days_since_last_purchase   days between that last order and the user's latest order
+
+Only pairs that exist are stored (COO layout: one row per pair), since a dense
+users x products pivot would not fit in memory. Everything is computed with
+sorts and segmented reductions, there are no Python loops over users or products.
+
+    python user_product_features.py --data-dir /datasets --output user_product_features.parquet
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import data_loader
+from cleaning import MISSING_CART_POSITION, clean_order_products, clean_orders
+
+# Output columns and the compact dtypes they are stored with
+FEATURE_DTYPES = {
+    'user_id': 'int32',
+    'product_id': 'int32',
+    'times_bought': 'int32',
+    'times_reordered': 'int32',
+    'last_order_number': 'int16',
+    'mean_add_to_cart_order': 'float32',
+    'days_since_last_purchase': 'float32',
+}
+
+
+def order_timeline(orders):
+    """
+    Place every order on its user's timeline.
+
+    Orders are sorted by user_id and order_number and days_since_prior_order is
+    summed within each user, so `day` is the number of days since the user's
+    first order. Returns a DataFrame with order_id, user_id, order_number, day
+    and user_last_day (the day of the user's latest order), in that sort order.
+    """
+    user = orders['user_id'].to_numpy()
+    order_number = orders['order_number'].to_numpy()
+    sort = np.lexsort((order_number, user))
+    user = user[sort]
+    # First orders have no prior order; they start the timeline at day 0
+    gaps = np.nan_to_num(orders['days_since_prior_order'].to_numpy(dtype=np.float64, na_value=np.nan)[sort])
+
+    elapsed = np.cumsum(gaps)
+    _, starts, counts = np.unique(user, return_index=True, return_counts=True)
+    # Subtract everything accumulated before each user's first order
+    day = elapsed - np.repeat(elapsed[starts] - gaps[starts], counts)
+    last_day = np.repeat(day[starts + counts - 1], counts)
+
+    return pd.DataFrame({
+        'order_id': orders['order_id'].to_numpy()[sort],
+        'user_id': user,
+        'order_number': order_number[sort],
+        'day': day,
+        'user_last_day': last_day,
+    })
+
+
+def _dense_map(keys, values, fill):
+    # Array with values[i] at position keys[i], for joining by integer id
+    mapped = np.full(int(keys.max()) + 1 if len(keys) else 0, fill, dtype=values.dtype)
+    mapped[keys] = values
+    return mapped
+
+
+def build_features(orders, order_products):
+    """
+    Compute the user x product features from cleaned orders and order_products.
+
+    Items of orders that are not in `orders` are left out. Returns one row per
+    (user_id, product_id) pair, sorted by user_id then product_id.
+    """
+    timeline = order_timeline(orders)
+    timeline_ids = timeline['order_id'].to_numpy()
+    position = _dense_map(timeline_ids, np.arange(len(timeline_ids)), -1)
+
+    item_orders = order_products['order_id'].to_numpy()
+    item_position = np.full(len(item_orders), -1, dtype=np.int64)
+    in_range = item_orders < len(position)
+    item_position[in_range] = position[item_orders[in_range]]
+    known = item_position >= 0
+    item_position = item_position[known]
+
+    user = timeline['user_id'].to_numpy()[item_position].astype(np.int64)
+    product = order_products['product_id'].to_numpy()[known].astype(np.int64)
+    reordered = order_products['reordered'].to_numpy(dtype=np.int64)[known]
+    cart = order_products['add_to_cart_order'].to_numpy(dtype=np.float64, na_value=np.nan)[known]
+    cart[cart == MISSING_CART_POSITION] = np.nan
+    order_number = timeline['order_number'].to_numpy()[item_position].astype(np.int64)
+    day = timeline['day'].to_numpy()[item_position]
+    user_last_day = timeline['user_last_day'].to_numpy()[item_position]
+
+    # Sort items so every (user, product) pair is one contiguous segment
+    sort = np.lexsort((product, user))
+    user, product = user[sort], product[sort]
+    new_pair = np.ones(len(sort), dtype=bool)
+    new_pair[1:] = (user[1:] != user[:-1]) | (product[1:] != product[:-1])
+    starts = np.flatnonzero(new_pair)
+
+    if not len(starts):
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in FEATURE_DTYPES.items()})
+
+    cart = cart[sort]
+    cart_known = ~np.isnan(cart)
+    cart_sum = np.add.reduceat(np.where(cart_known, cart, 0), starts)
+    cart_count = np.add.reduceat(cart_known.astype(np.int64), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_cart = cart_sum / cart_count
+
+    times_bought = np.diff(np.append(starts, len(sort)))
+    times_reordered = np.add.reduceat(reordered[sort], starts)
+    last_order_number = np.maximum.reduceat(order_number[sort], starts)
+    last_day = np.maximum.reduceat(day[sort], starts)
+
+    features = pd.DataFrame({
+        'user_id': user[starts],
+        'product_id': product[starts],
+        'times_bought': times_bought,
+        'times_reordered': times_reordered,
+        'last_order_number': last_order_number,
+        'mean_add_to_cart_order': mean_cart,
+        'days_since_last_purchase': user_last_day[sort][starts] - last_day,
+    })
+    return features.astype(FEATURE_DTYPES)
+
+
+def to_sparse(features, column):
+    """Return one feature as a scipy COO matrix of shape (max user_id + 1, max product_id + 1)."""
+    users = features['user_id'].to_numpy()
+    products = features['product_id'].to_numpy()
+    shape = (int(users.max()) + 1 if len(users) else 0, int(products.max()) + 1 if len(products) else 0)
+    return sp.coo_matrix((features[column].to_numpy(), (users, products)), shape=shape)
+
+
+def write_features(features, path):
+    """Write the features to a Parquet file (columnar, with the compact dtypes kept)."""
+    features.to_parquet(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build sparse user x product reorder features.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--output', default='user_product_features.parquet')
+    args = parser.parse_args()
+
+    orders = clean_orders(data_loader.load_table('orders', data_dir=args.data_dir))
+    order_products = clean_order_products(data_loader.load_table('order_products', data_dir=args.data_dir))
+    features = build_features(orders, order_products)
+    write_features(features, args.output)
+    print(f'{len(features)} user x product pairs written to {args.output}')
+    print(features.head())
+
+
+if __name__ == '__main__':
+    main()
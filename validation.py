@@ -0,0 +1,385 @@
+"""
+Declarative validation of a data drop, in one streaming pass per table.
+
+The checks instacart_analysis.py does by hand (hour and day ranges, missing
+days_since_prior_order only on first orders, missing product names only in
+aisle 100 / department 21, cart positions up to 64 with missing ones only in
+bigger orders) are written down as rules in RULES. validate() groups the
+rules by table and reads every table once, in chunks, applying all of its
+rules to each chunk. Rules that need more than one chunk keep small id-indexed
+arrays between chunks (rows per group, keys seen in a referenced table), so
+memory does not grow with the number of rows.
+
+Tables are read in TABLE_ORDER, so the tables other tables refer to are done
+first and their keys are known when the references are checked. Columns are
+read with wide nullable dtypes (Int64, float64) instead of the compact schema,
+so missing values and values the compact dtypes can't hold reach the rules
+instead of failing the read or wrapping around. Ids past MAX_ID are reported
+by the id range rules and left out of the per-id arrays, so one corrupt id
+can't make them huge.
+
+    python validation.py --data-dir /datasets --report validation.json
+
+The exit status is 1 when any rule with severity 'error' is violated, so the
+script can gate a new data drop.
+"""
+
+import argparse
+import json
+import sys
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import data_loader
+from streaming import DEFAULT_BATCH_ROWS, iter_table
+
+TABLE_ORDER = ('departments', 'aisles', 'orders', 'products', 'order_products')
+
+# Rows or group ids kept as examples for every violated rule
+MAX_EXAMPLES = 5
+
+# Largest id the dense per-id arrays grow to (256 MiB of int64 counts)
+MAX_ID = 2**25
+
+
+def wide_dtypes(table):
+    """The table's dtypes with every integer column as Int64 and every float column as float64."""
+    wide = {}
+    for column, dtype in data_loader.SCHEMAS[table]['dtypes'].items():
+        kind = str(dtype).lower()
+        wide[column] = 'Int64' if kind.startswith('int') else 'float64' if kind.startswith('float') else dtype
+    return wide
+
+
+def _grow(values, size):
+    # Extend a dense id-indexed array with zeros (False) to `size` entries
+    if len(values) >= size:
+        return values
+    return np.concatenate([values, np.zeros(size - len(values), dtype=values.dtype)])
+
+
+def _bounds(minimum, maximum):
+    if minimum is None:
+        return f'<= {maximum}'
+    if maximum is None:
+        return f'>= {minimum}'
+    return f'in [{minimum}, {maximum}]'
+
+
+def _numbers(chunk, column):
+    return chunk[column].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _ids(chunk, column):
+    # Integer ids with -1 for missing values, for indexing dense arrays
+    return chunk[column].to_numpy(dtype=np.float64, na_value=-1).astype(np.int64)
+
+
+def _group_ids(chunk, column):
+    # Ids that index the dense per-id arrays; ids past MAX_ID (reported by the id
+    # Range rules) count as missing, so they can't make the arrays huge
+    ids = _ids(chunk, column)
+    ids[ids > MAX_ID] = -1
+    return ids
+
+
+class RowRule:
+    """A rule that decides every row on its own; subclasses define violations()."""
+
+    def start(self):
+        return {'violations': 0, 'examples': []}
+
+    def update(self, state, chunk, offset, keys):
+        mask = self.violations(chunk, keys)
+        found = np.flatnonzero(mask)
+        state['violations'] += len(found)
+        missing = MAX_EXAMPLES - len(state['examples'])
+        if missing > 0 and len(found):
+            state['examples'].extend(int(row) + offset for row in found[:missing])
+
+    def finish(self, state, keys):
+        return state['violations'], state['examples']
+
+
+@dataclass
+class Range(RowRule):
+    """Values of `column` within [minimum, maximum]; missing values only if allow_null."""
+
+    table: str
+    column: str
+    minimum: float = None
+    maximum: float = None
+    allow_null: bool = False
+    severity: str = 'error'
+    kind = 'range'
+
+    @property
+    def columns(self):
+        return [self.column]
+
+    def describe(self):
+        return f'{self.column} {_bounds(self.minimum, self.maximum)}' + (' or missing' if self.allow_null else '')
+
+    def violations(self, chunk, keys):
+        values = _numbers(chunk, self.column)
+        null = np.isnan(values)
+        bad = null & (not self.allow_null)
+        with np.errstate(invalid='ignore'):
+            if self.minimum is not None:
+                bad |= values < self.minimum
+            if self.maximum is not None:
+                bad |= values > self.maximum
+        return bad
+
+
+@dataclass
+class NullImplies(RowRule):
+    """Where `column` is missing, every column in `condition` has the given value."""
+
+    table: str
+    column: str
+    condition: dict
+    severity: str = 'error'
+    kind = 'null_implies'
+
+    @property
+    def columns(self):
+        return [self.column] + list(self.condition)
+
+    def describe(self):
+        condition = ' and '.join(f'{column} == {value}' for column, value in self.condition.items())
+        return f'{self.column} missing only where {condition}'
+
+    def violations(self, chunk, keys):
+        holds = np.ones(len(chunk), dtype=bool)
+        for column, value in self.condition.items():
+            holds &= _numbers(chunk, column) == value
+        return chunk[self.column].isna().to_numpy() & ~holds
+
+
+@dataclass
+class References(RowRule):
+    """Every value of `column` is a `target_column` value of the `target` table."""
+
+    table: str
+    column: str
+    target: str
+    target_column: str
+    severity: str = 'error'
+    kind = 'references'
+
+    @property
+    def columns(self):
+        return [self.column]
+
+    def describe(self):
+        return f'{self.column} refers to {self.target}.{self.target_column}'
+
+    def violations(self, chunk, keys):
+        known = keys[(self.target, self.target_column)]
+        values = _ids(chunk, self.column)
+        found = np.zeros(len(values), dtype=bool)
+        in_range = (values >= 0) & (values < len(known))
+        found[in_range] = known[values[in_range]]
+        return ~found
+
+
+@dataclass
+class GroupSize:
+    """Every value of `group` occurs between min_count and max_count times."""
+
+    table: str
+    group: str
+    min_count: int = None
+    max_count: int = None
+    severity: str = 'error'
+    kind = 'group_size'
+
+    @property
+    def columns(self):
+        return [self.group]
+
+    def describe(self):
+        return f'rows per {self.group} {_bounds(self.min_count, self.max_count)}'
+
+    def start(self):
+        return {'counts': np.zeros(0, dtype=np.int64)}
+
+    def update(self, state, chunk, offset, keys):
+        ids = _group_ids(chunk, self.group)
+        counts = np.bincount(ids[ids >= 0])
+        state['counts'] = _grow(state['counts'], len(counts))
+        state['counts'][:len(counts)] += counts
+
+    def finish(self, state, keys):
+        counts = state['counts']
+        present = counts > 0
+        bad = np.zeros(len(counts), dtype=bool)
+        if self.min_count is not None:
+            bad |= present & (counts < self.min_count)
+        if self.max_count is not None:
+            bad |= counts > self.max_count
+        groups = np.flatnonzero(bad)
+        return len(groups), groups[:MAX_EXAMPLES].tolist()
+
+
+@dataclass
+class NullRequiresGroupSize:
+    """Rows with `column` missing only occur in `group` values with more than min_count rows."""
+
+    table: str
+    column: str
+    group: str
+    min_count: int
+    severity: str = 'error'
+    kind = 'null_requires_group_size'
+
+    @property
+    def columns(self):
+        return [self.column, self.group]
+
+    def describe(self):
+        return f'{self.column} missing only in {self.group} groups with more than {self.min_count} rows'
+
+    def start(self):
+        return {'counts': np.zeros(0, dtype=np.int64), 'null_rows': np.zeros(0, dtype=np.int64)}
+
+    def update(self, state, chunk, offset, keys):
+        ids = _group_ids(chunk, self.group)
+        valid = ids >= 0
+        counts = np.bincount(ids[valid])
+        nulls = np.bincount(ids[valid & chunk[self.column].isna().to_numpy()], minlength=len(counts))
+        size = max(len(state['counts']), len(counts))
+        state['counts'] = _grow(state['counts'], size)
+        state['null_rows'] = _grow(state['null_rows'], size)
+        state['counts'][:len(counts)] += counts
+        state['null_rows'][:len(nulls)] += nulls
+
+    def finish(self, state, keys):
+        bad = (state['null_rows'] > 0) & (state['counts'] <= self.min_count)
+        groups = np.flatnonzero(bad)
+        return int(state['null_rows'][groups].sum()), groups[:MAX_EXAMPLES].tolist()
+
+
+# The checks of instacart_analysis.py, plus the references between the tables.
+# Duplicated orders are a known quirk of the raw data that cleaning removes, so they only warn.
+RULES = (
+    Range('departments', 'department_id', 1, MAX_ID),
+    GroupSize('departments', 'department_id', max_count=1),
+    Range('aisles', 'aisle_id', 1, MAX_ID),
+    GroupSize('aisles', 'aisle_id', max_count=1),
+
+    Range('orders', 'order_id', 1, MAX_ID),
+    Range('orders', 'user_id', 1, MAX_ID),
+    Range('orders', 'order_hour_of_day', 0, 23),
+    Range('orders', 'order_dow', 0, 6),
+    Range('orders', 'order_number', 1),
+    Range('orders', 'days_since_prior_order', 0, 30, allow_null=True),
+    NullImplies('orders', 'days_since_prior_order', {'order_number': 1}),
+    GroupSize('orders', 'order_id', max_count=1, severity='warning'),
+
+    Range('products', 'product_id', 1, MAX_ID),
+    NullImplies('products', 'product_name', {'aisle_id': 100, 'department_id': 21}),
+    References('products', 'aisle_id', 'aisles', 'aisle_id'),
+    References('products', 'department_id', 'departments', 'department_id'),
+    GroupSize('products', 'product_id', max_count=1),
+
+    Range('order_products', 'add_to_cart_order', 1, 64, allow_null=True),
+    Range('order_products', 'reordered', 0, 1),
+    NullRequiresGroupSize('order_products', 'add_to_cart_order', 'order_id', 64),
+    References('order_products', 'order_id', 'orders', 'order_id'),
+    References('order_products', 'product_id', 'products', 'product_id'),
+)
+
+
+@dataclass
+class ValidationReport:
+    """Outcome of every rule, plus the rows read per table."""
+
+    results: list = field(default_factory=list)
+    rows: dict = field(default_factory=dict)
+
+    @property
+    def passed(self):
+        return not any(result['violations'] and result['severity'] == 'error' for result in self.results)
+
+    def to_dict(self):
+        return {'passed': self.passed, 'rows': self.rows, 'rules': self.results}
+
+
+def validate(rules=RULES, chunks=None, data_dir=data_loader.DATA_DIR, cache_dir=data_loader.CACHE_DIR,
+             batch_rows=DEFAULT_BATCH_ROWS):
+    """
+    Check every rule and return a ValidationReport.
+
+    `chunks` maps a table name to an iterable of DataFrames; tables not in it
+    are streamed from `data_dir` in chunks of `batch_rows` rows, with
+    wide_dtypes(). Every table is read once, whatever the number of rules on it.
+    """
+    chunks = chunks or {}
+    by_table = {table: [rule for rule in rules if rule.table == table] for table in TABLE_ORDER}
+    # Key columns other tables refer to, collected while their table is read
+    key_columns = {(rule.target, rule.target_column) for rule in rules if isinstance(rule, References)}
+    keys = {}
+    report = ValidationReport()
+
+    for table in TABLE_ORDER:
+        table_rules = by_table[table]
+        collect = [column for target, column in key_columns if target == table]
+        if not table_rules and not collect:
+            continue
+        columns = sorted({column for rule in table_rules for column in rule.columns} | set(collect))
+        source = chunks.get(table)
+        if source is None:
+            source = iter_table(table, columns, data_dir, batch_rows, cache_dir, wide_dtypes(table))
+
+        states = [rule.start() for rule in table_rules]
+        for column in collect:
+            keys[(table, column)] = np.zeros(0, dtype=bool)
+        offset = 0
+        for chunk in source:
+            for column in collect:
+                ids = _group_ids(chunk, column)
+                ids = ids[ids >= 0]
+                if len(ids):
+                    keys[(table, column)] = _grow(keys[(table, column)], int(ids.max()) + 1)
+                    keys[(table, column)][ids] = True
+            for rule, state in zip(table_rules, states):
+                rule.update(state, chunk, offset, keys)
+            offset += len(chunk)
+
+        report.rows[table] = offset
+        for rule, state in zip(table_rules, states):
+            violations, examples = rule.finish(state, keys)
+            report.results.append({
+                'table': table,
+                'kind': rule.kind,
+                'rule': rule.describe(),
+                'severity': rule.severity,
+                'violations': int(violations),
+                'examples': examples,
+            })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check a data drop against the validation rules.')
+    parser.add_argument('--data-dir', default=data_loader.DATA_DIR)
+    parser.add_argument('--batch-rows', type=int, default=DEFAULT_BATCH_ROWS)
+    parser.add_argument('--report', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    report = validate(data_dir=args.data_dir, batch_rows=args.batch_rows)
+    for result in report.results:
+        status = 'ok' if not result['violations'] else result['severity'].upper()
+        print(f'{status:<8}{result["table"]:<16}{result["rule"]:<70}{result["violations"]:>10}')
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report.to_dict(), f, indent=2)
+    if not report.passed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()